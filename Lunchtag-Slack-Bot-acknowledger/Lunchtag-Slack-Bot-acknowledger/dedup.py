@@ -0,0 +1,167 @@
+"""
+Recognising Slack's retries of commands and button clicks, so each request is handled once.
+
+Set LUNCHTAG_DEDUP=memory to keep the seen-set in memory instead of on S3, e.g. in offline runs.
+"""
+import hashlib
+import json
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from fast_path import s3, BUCKET_NAME
+
+DEDUP_BACKEND = os.getenv('LUNCHTAG_DEDUP', 's3')
+DEDUP_TTL = 15 * 60
+# How long a request being handled holds its key, a retry after that takes it over
+DEDUP_LEASE = 10
+SEEN_PREFIX = 'seen/'
+
+
+class MemorySeenSet:
+    """ Keys handled by this process in the last ttl seconds, or being handled for at most lease seconds. """
+
+    def __init__(self, ttl=DEDUP_TTL, lease=DEDUP_LEASE):
+        self.ttl = ttl
+        self.lease = lease
+        self.expiries = {}
+
+    def claim(self, key):
+        """ Claim key for handling, returning False if it is handled or being handled already. """
+        now = time.time()
+        if len(self.expiries) > 1000:
+            self.expiries = {seen: expiry for seen, expiry in self.expiries.items() if expiry > now}
+        if self.expiries.get(key, 0) > now:
+            return False
+        self.expiries[key] = now + self.lease
+        return True
+
+    def done(self, key):
+        """ Remember the claimed key as handled for ttl seconds. """
+        self.expiries[key] = time.time() + self.ttl
+
+    def release(self, key):
+        """ Give up the claim on key, so a retry can handle it. """
+        self.expiries.pop(key, None)
+
+
+class S3SeenSet:
+    """ Keys handled or being handled by any container, one object per key under SEEN_PREFIX. """
+
+    def __init__(self, ttl=DEDUP_TTL, lease=DEDUP_LEASE):
+        self.ttl = ttl
+        self.lease = lease
+        # A retry landing on the same warm container is answered without a round trip
+        self.local = MemorySeenSet(ttl, lease)
+        # ETags of the objects this container's claims wrote, so it only ever changes its own
+        self.claims = {}
+
+    def _object_key(self, key):
+        return SEEN_PREFIX + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+    def _body(self, state, seconds):
+        return json.dumps({'state': state, 'expires': time.time() + seconds}).encode('utf-8')
+
+    def claim(self, key):
+        if not self.local.claim(key):
+            return False
+        object_key = self._object_key(key)
+        body = self._body('handling', self.lease)
+        try:
+            self.claims[key] = s3.put_object(Body=body, Bucket=BUCKET_NAME, Key=object_key, IfNoneMatch='*')['ETag']
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+        # Seen before, but it may have been released, or be a key from long ago or a claim whose lease has run out
+        s3_object = s3.get_object(Bucket=BUCKET_NAME, Key=object_key)
+        if json.loads(s3_object['Body'].read().decode('utf-8'))['expires'] > time.time():
+            return False
+        try:
+            self.claims[key] = s3.put_object(Body=body, Bucket=BUCKET_NAME, Key=object_key, IfMatch=s3_object['ETag'])['ETag']
+            return True
+        except ClientError:
+            # Someone else took it over first
+            return False
+
+    def _settle(self, key, body):
+        etag = self.claims.pop(key, None)
+        if etag is None:
+            return
+        try:
+            s3.put_object(Body=body, Bucket=BUCKET_NAME, Key=self._object_key(key), IfMatch=etag)
+        except ClientError:
+            # The lease ran out and a retry took the key over, it is theirs now
+            pass
+
+    def done(self, key):
+        self.local.done(key)
+        self._settle(key, self._body('handled', self.ttl))
+
+    def release(self, key):
+        self.local.release(key)
+        # An expired object is taken over by the next claim
+        self._settle(key, self._body('released', 0))
+
+
+seen = MemorySeenSet() if DEDUP_BACKEND == 'memory' else S3SeenSet()
+
+
+def event_key(slack_event_body, payload=None):
+    """ What identifies a command or button click across Slack's retries of it, or None. """
+    if payload is not None:
+        action = (payload.get('actions') or [{}])[0]
+        if payload.get('trigger_id'):
+            return 'trigger:' + payload['trigger_id']
+        if action.get('action_ts'):
+            return f"action:{payload.get('user', {}).get('id')}:{action.get('action_id')}:{action['action_ts']}"
+        return None
+    if slack_event_body.get('trigger_id'):
+        return 'trigger:' + slack_event_body['trigger_id']
+    return None
+
+
+def retry_number(event):
+    """ Slack's X-Slack-Retry-Num header of the request, 0 for a first attempt. """
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    return int(headers.get('x-slack-retry-num') or 0)
+
+
+def is_duplicate(event, slack_event_body, payload=None):
+    """
+    True if the request was already received. Otherwise it is claimed for DEDUP_LEASE seconds, and the caller
+    marks it handled once it is, or releases it if that failed so Slack's retry is handled again.
+    Retries without a key can't be matched to their original and count as duplicates, first attempts without one never do.
+    """
+    key = event_key(slack_event_body, payload)
+    if key is None:
+        return retry_number(event) > 0
+    try:
+        return not seen.claim(key)
+    except Exception as e:
+        # Better an occasional duplicate than dropping the request
+        print(f"Could not check {key} for duplicates: {e}")
+        return False
+
+
+def mark_handled(slack_event_body, payload=None):
+    """ Remember the request as handled, so Slack's retries of it are only acknowledged. """
+    key = event_key(slack_event_body, payload)
+    if key is None:
+        return
+    try:
+        seen.done(key)
+    except Exception as e:
+        print(f"Could not mark {key} as handled: {e}")
+
+
+def release(slack_event_body, payload=None):
+    """ Give up the claim on a request that couldn't be handled, so Slack's retry of it is. """
+    key = event_key(slack_event_body, payload)
+    if key is None:
+        return
+    try:
+        seen.release(key)
+    except Exception as e:
+        print(f"Could not release {key}: {e}")
@@ -0,0 +1,90 @@
+"""
+Buttons the acknowledger answers itself, writing only the clicking user's record. The handler syncs the roster.
+
+blocks.json is written from the handler's all_blocks by its export_blocks.py.
+"""
+import json
+import os
+import random
+import time
+import urllib.request
+
+import boto3
+from botocore.exceptions import ClientError
+
+BUCKET_NAME = 'lunchtag-slack-bot-user-data'
+USER_RECORD_PREFIX = 'users/'
+MAX_WRITE_ATTEMPTS = 8
+WRITE_RETRY_BACKOFF = 0.02
+RESPONSE_TIMEOUT = 1.5
+
+s3 = boto3.client('s3')
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blocks.json')) as _blocks:
+    BLOCKS = json.load(_blocks)
+
+# Button value: (new weekly_interest, blocks replacing the message)
+WEEKLY_INTEREST_BUTTONS = {
+    'weekly_interest_confirmed': ('confirmed', BLOCKS['weekly_interest_confirmed']),
+    'weekly_interest_skipping': ('skipping', BLOCKS['weekly_interest_skipping']),
+    'weekly_interest_paused': ('paused', BLOCKS['weekly_interest_paused']),
+    'weekly_interest_reconsider': ('noResponse', BLOCKS['weekly_interest']),
+}
+
+
+def _update(key, change):
+    """
+    Apply change to the JSON object at key and write it back, conditional on the version read.
+    change edits the document in place and returns False to leave it as it is.
+    Returns False if the object does not exist.
+    """
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        try:
+            s3_object = s3.get_object(Bucket=BUCKET_NAME, Key=key)
+        except s3.exceptions.NoSuchKey:
+            return False
+        doc = json.loads(s3_object['Body'].read().decode('utf-8'))
+        if change(doc) is False:
+            return True
+        try:
+            s3.put_object(Body=json.dumps(doc).encode('utf-8'), Bucket=BUCKET_NAME, Key=key, IfMatch=s3_object['ETag'])
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+            print(f'Write conflict on {key}, retrying (attempt {attempt + 1})')
+            time.sleep(random.uniform(0, WRITE_RETRY_BACKOFF * 2 ** attempt))
+    raise RuntimeError(f'{key} kept changing after {MAX_WRITE_ATTEMPTS} attempts')
+
+
+def _set_weekly_interest(record, weekly_interest):
+    if record is None or record.get('weekly_interest') == weekly_interest:
+        return False
+    record['weekly_interest'] = weekly_interest
+
+
+def _respond(response_url, blocks):
+    """ Replace the message the button belongs to with blocks. """
+    request = urllib.request.Request(response_url, data=json.dumps({'replace_original': True, 'blocks': blocks}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=RESPONSE_TIMEOUT) as response:
+        response.read()
+
+
+def handle_button(payload):
+    """
+    Handle a button click inline if it is one of the cheap ones, the caller then has the handler sync the roster.
+    Returns False when the click has to be forwarded to the handler Lambda.
+    """
+    value = payload['actions'][0].get('value')
+    if value not in WEEKLY_INTEREST_BUTTONS or not payload.get('response_url'):
+        return False
+    user_id = payload['user']['id']
+    weekly_interest, blocks = WEEKLY_INTEREST_BUTTONS[value]
+
+    # Clicks of users without a record are left to the handler
+    if not _update(f'{USER_RECORD_PREFIX}{user_id}.json', lambda record: _set_weekly_interest(record, weekly_interest)):
+        return False
+    _respond(payload['response_url'], blocks)
+    print(f'{user_id} just activated button {value}, handled inline')
+    return True
@@ -3,6 +3,32 @@ import json
 import base64
 import urllib.parse
 
+from fast_path import handle_button
+from dedup import is_duplicate, mark_handled, release
+
+HANDLER_FUNCTION = 'Lunchtag-Slack-Bot-handler'  # Update with your Lambda #2 function name
+
+# Created once per container instead of on every request
+lambda_client = boto3.client('lambda')
+
+
+def forward(event):
+    """ Invoke the handler Lambda asynchronously with event. """
+    lambda_client.invoke(
+        FunctionName=HANDLER_FUNCTION,
+        InvocationType='Event',
+        Payload=json.dumps(event),
+    )
+
+
+def sync_roster(user_id):
+    """ Have the handler copy the record the fast path changed into the roster index. """
+    try:
+        forward({'sync_roster': user_id})
+    except Exception as e:
+        print(f"Could not forward the roster sync of {user_id}: {e}")
+
+
 def lambda_handler(event, context):
     print(f"Received event:\n{event}\nWith context:\n{context}")
     
@@ -26,13 +52,17 @@ def lambda_handler(event, context):
         # check if request is a command
         if "command" in slack_event_body:
             
+            # Slack's retries of a command that was already forwarded are only acknowledged
+            if is_duplicate(event, slack_event_body):
+                print(f"Duplicate of command {slack_event_body.get('trigger_id')}, not forwarded")
+                return {'statusCode': 200, 'body': ''}
 
-            lambda_client = boto3.client('lambda')
-            invoke_response = lambda_client.invoke(
-                FunctionName='Lunchtag-Slack-Bot-handler',  # Update with your Lambda #2 function name
-                InvocationType='Event',
-                Payload=json.dumps({'slack_event_body': slack_event_body}),
-            )
+            try:
+                forward({'slack_event_body': slack_event_body})
+            except Exception:
+                release(slack_event_body)
+                raise
+            mark_handled(slack_event_body)
 
             return {'statusCode': 200, 'body': "Processing your command..."}
             
@@ -40,13 +70,26 @@ def lambda_handler(event, context):
         elif "payload" in slack_event_body:
             payload = json.loads(slack_event_body['payload'])
             if payload['type'] == 'block_actions' and payload['actions'][0]['type'] == 'button':
-            
-                lambda_client = boto3.client('lambda')
-                invoke_response = lambda_client.invoke(
-                    FunctionName='Lunchtag-Slack-Bot-handler',  # Update with your Lambda #2 function name
-                    InvocationType='Event',
-                    Payload=json.dumps({'payload': payload}),
-                )
+
+                if is_duplicate(event, slack_event_body, payload):
+                    print(f"Duplicate of button click {payload.get('trigger_id')}, not handled")
+                    return {'statusCode': 200, 'body': ''}
+
+                # Cheap status changes are answered here, everything else goes to the handler
+                try:
+                    if handle_button(payload):
+                        mark_handled(slack_event_body, payload)
+                        sync_roster(payload['user']['id'])
+                        return {'statusCode': 200, 'body': ''}
+                except Exception as e:
+                    print(f"Fast path failed, forwarding to the handler: {e}")
+
+                try:
+                    forward({'payload': payload})
+                except Exception:
+                    release(slack_event_body, payload)
+                    raise
+                mark_handled(slack_event_body, payload)
                 
                 return {'statusCode': 200, 'body': "Processing your button click..."}
                 
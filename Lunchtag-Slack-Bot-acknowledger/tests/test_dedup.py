@@ -0,0 +1,117 @@
+"""
+Slack's retries of a request are dropped, unless the original was released or its lease ran out.
+
+    python -m pytest Lunchtag-Slack-Bot-acknowledger/tests
+"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'Lunchtag-Slack-Bot-acknowledger'))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(TESTS_DIR)), 'Lunchtag-Slack-Bot-handler', 'benchmarks'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+
+import pytest  # noqa: E402
+
+import dedup  # noqa: E402
+from fakes import FakeS3  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 's3'])
+def seen(request, clock, monkeypatch):
+    if request.param == 'memory':
+        seen = dedup.MemorySeenSet(ttl=900, lease=10)
+    else:
+        monkeypatch.setattr(dedup, 's3', FakeS3())
+        seen = dedup.S3SeenSet(ttl=900, lease=10)
+    monkeypatch.setattr(dedup, 'seen', seen)
+    return seen
+
+
+def fresh_container(seen):
+    """ Another container sharing the bucket, so the S3 set can't answer from its local layer. """
+    return dedup.S3SeenSet(seen.ttl, seen.lease) if isinstance(seen, dedup.S3SeenSet) else seen
+
+
+def request(retry=0):
+    return {'headers': {'X-Slack-Retry-Num': str(retry)} if retry else {}}
+
+
+COMMAND = {'trigger_id': '123.456.abc', 'command': '/lunchtag'}
+
+
+def test_retry_with_the_same_trigger_id_is_dropped(seen):
+    assert not dedup.is_duplicate(request(), COMMAND)
+    dedup.mark_handled(COMMAND)
+
+    assert dedup.is_duplicate(request(1), COMMAND)
+    dedup.seen = fresh_container(seen)
+    assert dedup.is_duplicate(request(2), COMMAND)
+
+
+def test_retry_while_handling_is_dropped(seen):
+    assert not dedup.is_duplicate(request(), COMMAND)
+    dedup.seen = fresh_container(seen)
+    assert dedup.is_duplicate(request(1), COMMAND)
+
+
+def test_released_key_is_handled_again(seen):
+    assert not dedup.is_duplicate(request(), COMMAND)
+    dedup.release(COMMAND)
+
+    dedup.seen = fresh_container(seen)
+    assert not dedup.is_duplicate(request(1), COMMAND)
+
+
+def test_expired_lease_is_taken_over(seen, clock):
+    assert not dedup.is_duplicate(request(), COMMAND)
+    clock.now += seen.lease + 1
+
+    retry_container = fresh_container(seen)
+    dedup.seen = retry_container
+    assert not dedup.is_duplicate(request(1), COMMAND)
+    dedup.mark_handled(COMMAND)
+
+    # The original finishing late doesn't undo the takeover
+    seen.done(dedup.event_key(COMMAND))
+    dedup.seen = fresh_container(seen)
+    assert dedup.is_duplicate(request(2), COMMAND)
+
+
+def test_handled_key_expires_after_ttl(seen, clock):
+    assert not dedup.is_duplicate(request(), COMMAND)
+    dedup.mark_handled(COMMAND)
+    clock.now += seen.ttl + 1
+
+    dedup.seen = fresh_container(seen)
+    assert not dedup.is_duplicate(request(1), COMMAND)
+
+
+def test_request_without_a_key_is_only_dropped_as_a_retry(seen):
+    body = {'command': '/lunchtag'}
+    assert dedup.event_key(body) is None
+    assert not dedup.is_duplicate(request(), body)
+    assert not dedup.is_duplicate(request(), body)
+    assert dedup.is_duplicate(request(1), body)
+
+
+def test_button_key_falls_back_to_action_ts():
+    payload = {'user': {'id': 'U1'}, 'actions': [{'action_id': 'confirm', 'action_ts': '1700000000.1'}]}
+    assert dedup.event_key({}, payload) == 'action:U1:confirm:1700000000.1'
+    assert dedup.event_key({}, dict(payload, trigger_id='t1')) == 'trigger:t1'
+    assert dedup.retry_number({'headers': {'x-slack-retry-num': '2'}}) == 2
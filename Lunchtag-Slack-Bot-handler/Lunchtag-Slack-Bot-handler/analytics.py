@@ -0,0 +1,283 @@
+"""
+Running survey aggregates of every member, pair and interest, {"surveys": 12, "met": 9, "ratings": 11, "rating_sum": 80},
+updated as every survey comes in:
+
+    analytics/users/<shard>.json    {"members": {"U01": {..., "last": their latest survey, "no_show": {"streak": 2, "round": "09-11-23"}}},
+                                     "totals": {"all": {...}, "interests": {"AI Risk": {...}}}}
+    analytics/pairs/<shard>.json    {"U01,U02": {..., "last": {"U01": the round and amounts counted of U01's latest survey}}}
+
+Run `python analytics.py rebuild` to build them from the archived surveys (see archive.py).
+"""
+import hashlib
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import get_backend, set_backend, LocalBackend, load_user, load_users, WriteConflict, MAX_PARALLEL_READS
+from archive import partition, round_order, archived_meetings, survey_entries
+from pair_history import pair_key
+from slack_client import log_exception
+from config import ANALYTICS_PREFIX, ANALYTICS_SHARDS, MAX_WRITE_ATTEMPTS, WRITE_RETRY_BACKOFF, INTEREST_RATING_WEIGHT, PAIR_RATING_WEIGHT, NO_SHOW_STREAK_LIMIT, NO_SHOW_PENALTY, ANALYTICS_MIN_RATINGS
+
+def _shard_key(kind, key):
+    shard = int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % ANALYTICS_SHARDS
+    return f'{ANALYTICS_PREFIX}{kind}/{shard}.json'
+
+
+def _read(key):
+    body = get_backend().read(key)
+    return json.loads(body.decode('utf-8')) if body else {}
+
+
+def _update(key, change, docs=None):
+    """
+    Apply change to the JSON object at key and write it back, applying it again on top of
+    whatever other invocations wrote meanwhile. Returns what change returned.
+    With docs, the object in that dict is changed instead, for rebuilds.
+    """
+    if docs is not None:
+        return change(docs.setdefault(key, {}))
+    backend = get_backend()
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        body, version = backend.read_versioned(key)
+        doc = json.loads(body.decode('utf-8')) if body else {}
+        result = change(doc)
+        try:
+            backend.write(key, json.dumps(doc).encode('utf-8'), expected_version=version)
+            return result
+        except WriteConflict:
+            time.sleep(random.uniform(0, WRITE_RETRY_BACKOFF * 2 ** attempt))
+    raise WriteConflict(f'{key} kept changing after {MAX_WRITE_ATTEMPTS} attempts')
+
+
+def contribution(responses):
+    """ What survey responses add to an aggregate, unanswered questions count for nothing. """
+    met_up = responses.get('MetUp') or ''
+    rating = str(responses.get('Rating', ''))
+    rating = int(rating.rsplit('-', 1)[1]) if rating.startswith('Rating-') else None
+    return {'surveys': int(bool(met_up)), 'met': int(met_up == 'MetUp-Yes'),
+            'ratings': int(rating is not None), 'rating_sum': rating or 0}
+
+
+def _add(aggregate, amounts, sign=1):
+    for field, amount in amounts.items():
+        aggregate[field] = aggregate.get(field, 0) + sign * amount
+    return aggregate
+
+
+def meet_up_rate(aggregate):
+    return aggregate['met'] / aggregate['surveys'] if aggregate.get('surveys') else None
+
+
+def mean_rating(aggregate):
+    return aggregate['rating_sum'] / aggregate['ratings'] if aggregate.get('ratings') else None
+
+
+def _no_shows(responses, user_id, partners):
+    """ (members the survey reports didn't show up, members it reports met) """
+    met_up = responses.get('MetUp') or ''
+    if met_up == 'MetUp-Yes':
+        return [], [user_id] + partners
+    return {'MetUp-No-Me': [user_id], 'MetUp-No-Them': partners, 'MetUp-No-both': [user_id] + partners}.get(met_up, []), []
+
+
+def _streaks(members, reported, absent, met, round_name):
+    """ Update the no-show streaks of the reported members, entries of the users shard members. """
+    # Reports about an older round than a member's streak came in late and don't change it
+    for member in reported:
+        if member in absent:
+            streak = members.setdefault(member, {}).setdefault('no_show', {'streak': 0, 'round': None})
+            if streak['round'] is None or round_order(round_name) > round_order(streak['round']):
+                streak['streak'] += 1
+                streak['round'] = round_name
+        elif 'no_show' in members.get(member, {}) and round_order(members[member]['no_show']['round']) <= round_order(round_name):
+            del members[member]['no_show']
+            if not members[member]:
+                del members[member]
+
+
+def record_survey(user_id, round_name, partners, interests, responses, docs=None):
+    """ Add the survey user_id answered about round_name, met with partners over common interests, to the aggregates. """
+    survey = {'round': round_name, 'partners': partners, 'interests': interests, 'amounts': contribution(responses)}
+    absent, met = _no_shows(responses, user_id, partners)
+    reported = {}
+    for member in absent + met:
+        reported.setdefault(_shard_key('users', member), []).append(member)
+    own_key = _shard_key('users', user_id)
+
+    def change_user(shard):
+        entry = shard.setdefault('members', {}).setdefault(user_id, {})
+        totals = shard.setdefault('totals', {})
+        previous = entry.get('last') if entry.get('last', {}).get('round') == round_name else None
+        for sign, counted in ((-1, previous), (1, survey)):
+            if counted:
+                _add(entry, counted['amounts'], sign)
+                _add(totals.setdefault('all', {}), counted['amounts'], sign)
+                for interest in counted['interests']:
+                    _add(totals.setdefault('interests', {}).setdefault(interest, {}), counted['amounts'], sign)
+        entry['last'] = survey
+        _streaks(shard['members'], reported.get(own_key, []), absent, met, round_name)
+        return previous
+    previous = _update(own_key, change_user, docs)
+
+    for key, members in reported.items():
+        if key != own_key:
+            _update(key, lambda shard, members=members: _streaks(shard.setdefault('members', {}), members, absent, met, round_name), docs)
+
+    shards = {}
+    for partner in set(partners) | set(previous['partners'] if previous else []):
+        shards.setdefault(_shard_key('pairs', pair_key(user_id, partner)), []).append(partner)
+    for key, shard_partners in shards.items():
+        def change_pairs(shard, shard_partners=shard_partners):
+            for partner in shard_partners:
+                aggregate = shard.setdefault(pair_key(user_id, partner), {})
+                counted = aggregate.setdefault('last', {})
+                if counted.get(user_id, {}).get('round') == round_name:
+                    _add(aggregate, counted.pop(user_id)['amounts'], -1)
+                if partner in partners:
+                    _add(aggregate, survey['amounts'])
+                    counted[user_id] = {'round': round_name, 'amounts': survey['amounts']}
+        _update(key, change_pairs, docs)
+
+
+def round_partners(record, round_name):
+    """ The partners the record's history summary lists for the round. """
+    partners = next((partners for meeting_date, partners in record.get('history', {}).items() if partition(meeting_date) == round_name), '')
+    return [partner.strip() for partner in partners.split(',') if partner.strip()]
+
+
+def common_interests(record, partner_records):
+    """ Interests the record shares with any of the partners. """
+    interests = set(record['profile']['all_interests'])
+    return sorted({interest for partner in partner_records if partner for interest in interests & set(partner['profile']['all_interests'])})
+
+
+def survey_submitted(user_id, record, round_name, responses):
+    """
+    Update the aggregates with a survey user_id just submitted about round_name. This is best effort: the survey
+    is already archived, so errors are only logged and `python analytics.py rebuild` catches the aggregates up.
+    """
+    try:
+        partners = round_partners(record, round_name)
+        record_survey(user_id, round_name, partners, common_interests(record, map(load_user, partners)), responses)
+    except Exception as e:
+        print(f"Error updating the survey analytics of {user_id}: {e}")
+        log_exception(e)
+
+
+def _read_shards(kind):
+    keys = [f'{ANALYTICS_PREFIX}{kind}/{shard}.json' for shard in range(ANALYTICS_SHARDS)]
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_READS) as executor:
+        return list(executor.map(_read, keys))
+
+
+def _totals(users_shards):
+    """ The overall and per-interest totals and the no-show streaks, summed over the users shards. """
+    totals = {'all': {}, 'interests': {}, 'no_shows': {}}
+    for shard in users_shards:
+        _add(totals['all'], shard.get('totals', {}).get('all', {}))
+        for interest, aggregate in shard.get('totals', {}).get('interests', {}).items():
+            _add(totals['interests'].setdefault(interest, {}), aggregate)
+        totals['no_shows'].update((member, entry['no_show']) for member, entry in shard.get('members', {}).items() if 'no_show' in entry)
+    return totals
+
+
+def score_adjustments():
+    """
+    The pairing score adjustments of the current aggregates, computed once per generated round:
+    {'interests': {interest: points}, 'pairs': {pair key: points}, 'no_shows': set of member ids}.
+    """
+    totals = _totals(_read_shards('users'))
+    overall = mean_rating(totals['all'])
+    adjustments = {'interests': {}, 'pairs': {}, 'no_shows': {member for member, streak in totals['no_shows'].items()
+                                                             if streak['streak'] >= NO_SHOW_STREAK_LIMIT}}
+    if overall is None:
+        return adjustments
+    for interest, aggregate in totals['interests'].items():
+        points = round(INTEREST_RATING_WEIGHT * (mean_rating(aggregate) - overall)) if aggregate.get('ratings', 0) >= ANALYTICS_MIN_RATINGS else 0
+        if points:
+            adjustments['interests'][interest] = points
+    for shard in _read_shards('pairs'):
+        for key, aggregate in shard.items():
+            points = round(PAIR_RATING_WEIGHT * (mean_rating(aggregate) - overall)) if aggregate.get('ratings') else 0
+            if points:
+                adjustments['pairs'][key] = points
+    return adjustments
+
+
+def survey_adjustment(adjustments, user1, user2, common):
+    """ Score adjustment of pairing user1 and user2 with the common interests, see score_adjustments. """
+    if not adjustments:
+        return 0
+    no_shows = adjustments['no_shows']
+    return (sum(adjustments['interests'].get(interest, 0) for interest in common)
+            + adjustments['pairs'].get(pair_key(user1, user2), 0)
+            - NO_SHOW_PENALTY * ((user1 in no_shows) != (user2 in no_shows)))
+
+
+def _describe(aggregate):
+    rate, rating = meet_up_rate(aggregate), mean_rating(aggregate)
+    return (f"{aggregate.get('surveys', 0)} surveys, " + (f"{rate:.0%} met up" if rate is not None else "no meet-ups reported")
+            + (f", mean rating {rating:.1f}" if rating is not None else ""))
+
+
+def summary(user_id=None):
+    """ The analytics of every survey, or of one member's, as a message for admins. """
+    if user_id is not None:
+        aggregate = _read(_shard_key('users', user_id)).get('members', {}).get(user_id)
+        if aggregate is None:
+            return f"No surveys from <@{user_id}> yet."
+        streak = aggregate.get('no_show', {}).get('streak', 0)
+        return f"<@{user_id}>: {_describe(aggregate)}, no-show streak of {streak} rounds"
+
+    totals = _totals(_read_shards('users'))
+    streaks = totals['no_shows']
+    if not totals.get('all'):
+        return "No surveys yet."
+    lines = ['Survey analytics:', f"     • All: {_describe(totals['all'])}"]
+    for interest, aggregate in sorted(totals['interests'].items(), key=lambda item: -item[1].get('surveys', 0)):
+        lines.append(f"     • {interest}: {_describe(aggregate)}")
+    flaky = sorted(((streak['streak'], member) for member, streak in streaks.items() if streak['streak'] >= NO_SHOW_STREAK_LIMIT), reverse=True)
+    lines.append(f"No-show streaks of {NO_SHOW_STREAK_LIMIT}+ rounds: " + (', '.join(f'<@{member}> ({streak})' for streak, member in flaky) or 'none'))
+    return '\n'.join(lines)
+
+
+def rebuild_analytics(backend=None):
+    """ Build the aggregates from scratch out of the archived rounds and surveys, replacing the stored ones. """
+    if backend is not None:
+        set_backend(backend)
+    user_data = load_users()
+    partners = {}
+    for name, users in archived_meetings():
+        for user_id in users:
+            partners.setdefault((name, user_id), []).extend(user for user in users if user != user_id)
+
+    surveys = []
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_READS) as executor:
+        entries = executor.map(lambda user_id: survey_entries(user_id, user_data[user_id].get('archived_rounds', [])), user_data)
+        for user_id, user_entries in zip(user_data, entries):
+            surveys += [(entry.pop('date'), name, user_id, entry) for name, entry in user_entries]
+    print(f'Replaying {len(surveys)} surveys of {len(user_data)} users')
+
+    docs = {}
+    for submitted, name, user_id, responses in sorted(surveys, key=lambda survey: (round_order(survey[0]), survey[2])):
+        met = partners.get((name, user_id), [])
+        record_survey(user_id, name, met, common_interests(user_data[user_id], [user_data.get(partner) for partner in met]), responses, docs)
+
+    backend = get_backend()
+    stale = [f'{ANALYTICS_PREFIX}{kind}/{shard}.json' for kind in ('users', 'pairs') for shard in range(ANALYTICS_SHARDS)]
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_READS) as executor:
+        list(executor.map(lambda key: backend.write(key, json.dumps(docs.get(key, {})).encode('utf-8')), set(stale) | set(docs)))
+    return len(surveys)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print('Usage: python analytics.py rebuild [--local DIR]')
+        sys.exit(1)
+    if '--local' in sys.argv:
+        rebuild_analytics(LocalBackend(sys.argv[sys.argv.index('--local') + 1]))
+    else:
+        rebuild_analytics()
@@ -0,0 +1,251 @@
+"""
+Append-only archive of past rounds and survey answers, one partition per round named after its meeting date:
+
+    archive/rounds.json                  {"rounds": ["09-04-23", "09-11-23"]}, oldest first
+    archive/rounds/09-11-23.jsonl        {"users": ["U01", "U02"]} for every pair that met
+    archive/surveys/09-11-23/U01.jsonl   {"date": "09/17/23", "MetUp": ..., "Rating": ..., "Survey_Feedback": ...}
+
+Run `python archive.py migrate` once to move the history and surveys of existing records into the archive,
+or `python archive.py migrate --local DIR` to do it against a local directory.
+"""
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from storage import get_backend, set_backend, LocalBackend, load_users, save_users, WriteConflict, MAX_PARALLEL_READS
+from config import ARCHIVE_PREFIX, RECENT_PARTNER_ROUNDS, MAX_WRITE_ATTEMPTS, WRITE_RETRY_BACKOFF
+
+MANIFEST_KEY = ARCHIVE_PREFIX + 'rounds.json'
+
+
+def partition(meeting_date):
+    """ Partition of a round date, '09/11/23' and '09-11-23' are both '09-11-23'. """
+    return meeting_date.replace('/', '-')
+
+
+def round_order(meeting_date):
+    """ Sort key of a round date in either of the formats the bot has used. """
+    for date_format in ("%m-%d-%y", "%m/%d/%y"):
+        try:
+            return datetime.strptime(meeting_date, date_format)
+        except ValueError:
+            pass
+    return datetime.min
+
+
+def _round_key(name):
+    return f'{ARCHIVE_PREFIX}rounds/{name}.jsonl'
+
+
+def _survey_key(name, user_id):
+    return f'{ARCHIVE_PREFIX}surveys/{name}/{user_id}.jsonl'
+
+
+def _read_lines(key):
+    body = get_backend().read(key)
+    return [json.loads(line) for line in body.decode('utf-8').splitlines() if line] if body else []
+
+
+def _read_all(keys):
+    """ The entries of every JSON lines object in keys, read in parallel. """
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_READS) as executor:
+        return list(executor.map(_read_lines, keys))
+
+
+def append_lines(key, entries, replace=False):
+    """
+    Append entries to the JSON lines object at key, retrying on top of whatever other invocations appended meanwhile.
+    With replace, the entries already in it are dropped instead of kept.
+    """
+    backend = get_backend()
+    lines = ''.join(json.dumps(entry) + '\n' for entry in entries).encode('utf-8')
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        body, version = backend.read_versioned(key)
+        try:
+            backend.write(key, (b'' if replace else body or b'') + lines, expected_version=version)
+            return
+        except WriteConflict:
+            print(f'Write conflict on {key}, appending again (attempt {attempt + 1})')
+            time.sleep(random.uniform(0, WRITE_RETRY_BACKOFF * 2 ** attempt))
+    raise WriteConflict(f'{key} kept changing after {MAX_WRITE_ATTEMPTS} attempts')
+
+
+def archived_rounds():
+    """ Every archived round, oldest first. """
+    body = get_backend().read(MANIFEST_KEY)
+    return json.loads(body.decode('utf-8'))['rounds'] if body else []
+
+
+def _add_to_manifest(names):
+    backend = get_backend()
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        body, version = backend.read_versioned(MANIFEST_KEY)
+        rounds = json.loads(body.decode('utf-8'))['rounds'] if body else []
+        if set(names) <= set(rounds):
+            return
+        rounds = sorted(set(rounds) | set(names), key=round_order)
+        try:
+            backend.write(MANIFEST_KEY, json.dumps({'rounds': rounds}).encode('utf-8'), expected_version=version)
+            return
+        except WriteConflict:
+            time.sleep(random.uniform(0, WRITE_RETRY_BACKOFF * 2 ** attempt))
+    raise WriteConflict(f'{MANIFEST_KEY} kept changing after {MAX_WRITE_ATTEMPTS} attempts')
+
+
+def archive_round(meeting_date, pairs):
+    """ Append the (user1, user2) pairs that met in the round of meeting_date to its partition, unless they are in it already. """
+    name = partition(meeting_date)
+    archived = {tuple(sorted(entry['users'])) for entry in _read_lines(_round_key(name))}
+    pairs = [pair for pair in pairs if tuple(sorted(pair)) not in archived]
+    if pairs:
+        append_lines(_round_key(name), [{'users': list(pair)} for pair in pairs])
+    _add_to_manifest([name])
+
+
+def archived_meetings():
+    """ (meeting_date, users) of every archived meeting, oldest round first. """
+    names = archived_rounds()
+    return [(name, entry['users']) for name, entries in zip(names, _read_all(map(_round_key, names))) for entry in entries]
+
+
+def note_partition(record, name):
+    """ List partition name among the ones holding entries of the record's user. """
+    names = record.setdefault('archived_rounds', [])
+    if name not in names:
+        names.append(name)
+        names.sort(key=round_order)
+
+
+def compact_history(record):
+    """
+    Drop all but the last RECENT_PARTNER_ROUNDS rounds from the record's history summary.
+    Only rounds already in the archive are dropped, history from before it stays until it is migrated.
+    """
+    archived = set(record.get('archived_rounds', []))
+    history = record.get('history', {})
+    dates = sorted(history, key=round_order)
+    for meeting_date in dates[:max(0, len(dates) - RECENT_PARTNER_ROUNDS)]:
+        if partition(meeting_date) in archived:
+            del history[meeting_date]
+    return record
+
+
+def archive_survey(user_id, record, responses, submitted):
+    """
+    File the survey responses user_id submitted on that date under their latest round, and note it in their record.
+    A member has one survey per round, so submitting again (or a retried click) replaces it. Returns the partition of the round.
+    """
+    rounds = list(record.get('history', {})) + record.get('archived_rounds', [])
+    name = partition(max(rounds, key=round_order) if rounds else submitted)
+    append_lines(_survey_key(name, user_id), [{'date': submitted, **responses}], replace=True)
+    note_partition(record, name)
+    return name
+
+
+def survey_entries(user_id, names):
+    """ (partition, entry) of every survey user_id filed under the partitions in names. """
+    names = list(names)
+    return [(name, entry) for name, entries in zip(names, _read_all(_survey_key(name, user_id) for name in names)) for entry in entries]
+
+
+def user_history(user_id, record, rounds=None):
+    """
+    The {date: partners} history of the user's last `rounds` rounds (all of them for None). Rounds
+    in the record's summary are free, only older ones are read from their round partitions.
+    """
+    history = dict(sorted(record.get('history', {}).items(), key=lambda item: round_order(item[0])))
+    summarized = {partition(meeting_date) for meeting_date in history}
+    older = [name for name in record.get('archived_rounds', []) if name not in summarized]
+    if rounds is not None:
+        older = older[max(0, len(older) - max(0, rounds - len(history))):]
+    for name, entries in zip(older, _read_all(map(_round_key, older))):
+        partners = [partner for entry in entries if user_id in entry['users'] for partner in entry['users'] if partner != user_id]
+        if partners:
+            history[name] = ', '.join(partners)
+    history = sorted(history.items(), key=lambda item: round_order(item[0]))
+    return dict(history if rounds is None else history[max(0, len(history) - rounds):])
+
+
+def survey_round(rounds, submitted):
+    """ Partition of the round a survey submitted on that date is about, the latest of the sorted rounds before it. """
+    earlier = [name for name in rounds if round_order(name) <= round_order(submitted)]
+    return earlier[-1] if earlier else partition(submitted)
+
+
+def user_surveys(user_id, record, rounds=None):
+    """ The {round partition: responses and submission 'date'} surveys about the user's last `rounds` rounds (all of them for None). """
+    names = record.get('archived_rounds', [])
+    if rounds is not None:
+        names = names[max(0, len(names) - rounds):]
+    surveys = {}
+    # Records that haven't been migrated yet still hold their surveys by submission date
+    if record.get('surveys'):
+        known_rounds = sorted({partition(meeting_date) for meeting_date in record.get('history', {})} | set(record.get('archived_rounds', [])), key=round_order)
+        surveys = {survey_round(known_rounds, submitted): {'date': submitted, **responses} for submitted, responses in record['surveys'].items()}
+    for name, entry in survey_entries(user_id, names):
+        surveys[name] = entry
+    surveys = sorted(surveys.items(), key=lambda item: round_order(item[0]))
+    return dict(surveys if rounds is None else surveys[max(0, len(surveys) - rounds):])
+
+
+def round_count(record):
+    """ How many rounds the user has taken part in, archived or not. """
+    return len({partition(meeting_date) for meeting_date in record.get('history', {})} | set(record.get('archived_rounds', [])))
+
+
+def migrate_archive(backend=None):
+    """ Move the history beyond the summary and every survey of the user records into the archive. """
+    if backend is not None:
+        set_backend(backend)
+    user_data = load_users()
+    print(f'Archiving the history and surveys of {len(user_data)} users')
+
+    meetings = {}
+    surveys = {}
+    for user_id, record in user_data.items():
+        names = set()
+        for meeting_date, partners in record.get('history', {}).items():
+            name = partition(meeting_date)
+            names.add(name)
+            for partner in partners.split(','):
+                partner = partner.strip()
+                if partner and partner != user_id:
+                    meetings.setdefault(name, set()).add(tuple(sorted((user_id, partner))))
+        rounds = sorted(names, key=round_order)
+        for submitted, responses in record.pop('surveys', {}).items():
+            # A survey is about the latest round before it was submitted
+            name = survey_round(rounds, submitted)
+            surveys.setdefault((name, user_id), []).append({'date': submitted, **responses})
+            names.add(name)
+        for name in names:
+            note_partition(record, name)
+
+    def archive_meetings(item):
+        # Pairs already archived, e.g. by a publish since the update, aren't appended again
+        name, pairs = item
+        archived = {tuple(sorted(entry['users'])) for entry in _read_lines(_round_key(name))}
+        if pairs - archived:
+            append_lines(_round_key(name), [{'users': list(pair)} for pair in sorted(pairs - archived)])
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_READS) as executor:
+        list(executor.map(archive_meetings, meetings.items()))
+        list(executor.map(lambda item: append_lines(_survey_key(*item[0]), item[1]), surveys.items()))
+    _add_to_manifest(list(meetings))
+
+    for record in user_data.values():
+        compact_history(record)
+    save_users(user_data, complete=False)
+    return len(meetings), len(surveys)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('Usage: python archive.py migrate [--local DIR]')
+        sys.exit(1)
+    if '--local' in sys.argv:
+        migrate_archive(LocalBackend(sys.argv[sys.argv.index('--local') + 1]))
+    else:
+        migrate_archive()
@@ -2,17 +2,109 @@ import os
 
 
 BUCKET_NAME = 'lunchtag-slack-bot-user-data'
+PAIR_HISTORY_KEY = 'pair_history.json'
+USER_DATA_KEY = 'userdata.json'
+# Pairings of the current round, as JSON lines
+PAIRINGS_KEY = 'pairings.jsonl'
+# Compatibility matrix and user index of the generated round, for re-scoring swaps
+ROUND_KEY = 'pairings_round.npz'
+# Rendered views of the current pairings, uploaded to the admin
+REPORT_FILES = {'tiny': 'pairings_tiny.csv', 'short': 'pairings_short.csv', 'full': 'pairings_full.xlsx'}
+ROSTER_KEY = 'users/index.json'
+USER_RECORD_PREFIX = 'users/'
+# Append-only archive of past rounds and survey answers, one partition per round (see archive.py)
+ARCHIVE_PREFIX = 'archive/'
+# Rounds of partners each user record keeps in its 'history' summary, older ones are only in the archive
+RECENT_PARTNER_ROUNDS = 8
+DIRECTORY_KEY = 'directory.json'
+# Seconds before the cached workspace directory is rebuilt from users.list
+DIRECTORY_TTL = 24 * 60 * 60
+# 's3' for the bucket above, 'local' to keep everything under LOCAL_STORAGE_DIR for offline runs
+STORAGE_BACKEND = os.getenv('LUNCHTAG_STORAGE', 's3')
+LOCAL_STORAGE_DIR = os.getenv('LUNCHTAG_STORAGE_DIR', '/tmp/lunchtag')
+# How often a conflicting write is merged and retried before giving up
+MAX_WRITE_ATTEMPTS = 8
+WRITE_RETRY_BACKOFF = 0.02
+# Admin jobs that hold the run lock, so a second one started meanwhile is refused instead of running concurrently
+LOCKED_ADMIN_JOBS = ('invite', 'confirm', 'confirm-followup', 'generate', 'swap', 'publish', 'cohort', 'set_users')
+RUN_LOCK_PREFIX = 'locks/'
+# Locks older than this are left over from an invocation that timed out, keep it above the function timeout
+RUN_LOCK_TTL = 5 * 60
 ADDITIONAL_USERS = ['U03UFPNSDT6', 'U03UFPNSDT6', 'U03UFPNSDT6']
 AVOID_ADJUSTMENT_WEIGHT = 1000
 PROMOTE_ADJUSTMENT_WEIGHT = 10
 HISTORY_PENALTY = 100
+# Multiplier applied to HISTORY_PENALTY for every round since a pair last met, 1.0 never forgets
+HISTORY_RECENCY_DECAY = 1.0
 SELF_MATCH_PENALTY = 10000
+# Running survey aggregates per member, pair and interest (see analytics.py), in this many objects each
+ANALYTICS_PREFIX = 'analytics/'
+ANALYTICS_SHARDS = 64
+# Whether pairing scores are adjusted by the survey analytics: every common interest counts for INTEREST_RATING_WEIGHT
+# more per point its mean rating is above the overall mean, pairs who met before by PAIR_RATING_WEIGHT per point of theirs,
+# and a member on a streak of NO_SHOW_STREAK_LIMIT rounds without showing up loses NO_SHOW_PENALTY with members who do show up
+SURVEY_ADJUSTMENTS = False
+INTEREST_RATING_WEIGHT = 1.0
+PAIR_RATING_WEIGHT = 5.0
+NO_SHOW_STREAK_LIMIT = 2
+NO_SHOW_PENALTY = 20
+# Interests with fewer ratings than this keep their plain point
+ANALYTICS_MIN_RATINGS = 5
+
+# 'blossom' solves a true maximum-weight matching, 'munkres' is the old solver padded with ADDITIONAL_USERS,
+# 'local_search' is a fast heuristic for very large cohorts (a greedy matching improved by pair exchanges)
+MATCHING_ENGINE = 'blossom'
+# Cohorts larger than this are paired with 'local_search' instead of 'blossom', whose O(n^3) time would outrun the handler's Timeout
+BLOSSOM_MAX_USERS = 2000
+# Also run the local search exchanges on the blossom result
+LOCAL_SEARCH_AFTER_SOLVER = False
+# Budget of the local search in seconds and passes, and how many of each user's best partners 3-opt tries
+LOCAL_SEARCH_TIME_BUDGET = 10.0
+LOCAL_SEARCH_MAX_PASSES = 50
+LOCAL_SEARCH_CANDIDATES = 10
+# With an odd number of confirmed users: 'triad' adds the leftover to the best pair, 'leftover' leaves them out
+ODD_USER_POLICY = 'triad'
+# 'generate cohorts' pairs members only within their profile's cohort (e.g. chapter or campus), members without one form a pool of their own
+COHORT_FIELD = 'cohort'
+# Pools solved at once in separate processes, one per vCPU the function gets
+COHORT_WORKERS = os.cpu_count() or 1
+# Whether the leftovers of odd pools are paired with each other across pools, 'generate cohorts crossover' also turns it on
+COHORT_CROSSOVER = False
+# 'generate groups K' forms groups of K (or K + 1) people, K one of GROUP_SIZES, instead of pairs, refining them for at most GROUP_TIME_BUDGET seconds
+GROUP_SIZES = (3, 4, 5, 6, 7)
+# Size of the groups of a plain 'generate groups'
+GROUP_SIZE = 4
+GROUP_TIME_BUDGET = 10.0
+GROUP_MAX_PASSES = 50
+# 'group_dm' sends each pair one combined intro and survey in a shared conversation, 'direct' DMs each partner separately.
+# Opening a shared conversation is in the 50 per minute tier, so a big round in 'group_dm' takes several publishes to send.
+PUBLISH_MODE = 'direct'
+# Publish sends PUBLISH_BATCH_SIZE groups at a time, noting them in PUBLISH_PROGRESS_KEY, and stops starting batches
+# after PUBLISH_TIME_BUDGET seconds so the handler finishes in its 45 second timeout. Publishing again sends the rest.
+PUBLISH_PROGRESS_KEY = 'publish_progress.json'
+PUBLISH_BATCH_SIZE = 10
+PUBLISH_TIME_BUDGET = 25.0
 
 specific_users = ["U03UFPNSDT6", "U03UD78Q7MZ"]
 admin_users = ["U03UFPNSDT6", "U03UD78Q7MZ"]
 
 SLACK_BOT_TOKEN = os.getenv('SLACK_BOT_TOKEN')
 
+# Calls per minute allowed for each Slack Web API method used in bulk, following Slack's rate tiers
+SLACK_RATE_LIMITS = {'chat_postMessage': 1200,
+                     'chat_update': 50,
+                     'conversations_open': 50,
+                     'files_upload': 20,
+                     'users_list': 20,
+                     'users_info': 100}
+FANOUT_WORKERS = 8
+FANOUT_MAX_ATTEMPTS = 4
+# Admin replies of invocations slower than this many seconds get a breakdown of where the time went
+SLOW_PATH_THRESHOLD = 10.0
+# Log entries of an invocation are posted to LOG_CHANNEL as one message at the end, capped at LOG_MAX_CHARS
+LOG_CHANNEL = 'C05EANK93MY'
+LOG_MAX_CHARS = 3500
+
 messages = {'invite': "Would you like to join the LunchTag program?",
             
             'weekly_interest': "Hey! Please confirm your availability for LunchTag this week.",
@@ -42,8 +134,12 @@ messages = {'invite': "Would you like to join the LunchTag program?",
 
                 '     • /lunchtag-admin pairings {tiny, short, full} -> provides sized response file of existing pairings\n'
                 '     • /lunchtag-admin generate {tiny, short, full} -> generates new pairings and provides sized response file\n'
-                '     • /lunchtag-admin swap [A1, B2] -> Swaps two users in the pairings\n'
+                '     • /lunchtag-admin generate cohorts [crossover] {tiny, short, full} -> pairs members within their cohort only, crossover pairs the pools\' leftovers with each other\n'
+                '     • /lunchtag-admin generate groups [K] {tiny, short, full} -> forms groups of K (default 4, one of 3 to 7) instead of pairs, also with cohorts\n'
+                '     • /lunchtag-admin cohort {name, -} U1,U2 -> puts members in a cohort, - takes them out\n'
+                '     • /lunchtag-admin swap [A1, B2] [A3, B4] ... -> Swaps users in the pairings (A is Person 1, B is Person 2 of a row) and reports the score change\n'
                 '     • /lunchtag-admin publish -> publishes pairings by DMing everyone\n'
+                '     • /lunchtag-admin analytics [U1] -> survey meet-up rates, ratings and no-show streaks, overall or of one member\n'
 
 }
 
@@ -0,0 +1,101 @@
+"""
+Cached directory of workspace members.
+
+users.list is paginated and rate limited (tier 2), so instead of calling it on
+every invite, a compact snapshot of the workspace is kept next to the user
+records and in memory for warm invocations:
+
+    {"fetched_at": 1694000000.0,
+     "users": {"U01": {"real_name": "Ada", "is_bot": false, "deleted": false}}}
+
+The snapshot is rebuilt by following response_metadata.next_cursor once it is
+older than DIRECTORY_TTL by list_users. Single users looked up with resolve_user
+are fetched with users.info when the snapshot is missing them (e.g. someone who
+just joined the workspace) or is stale, and added incrementally.
+"""
+import json
+import time
+
+from slack_sdk.errors import SlackApiError
+
+from fanout import call_slack
+from storage import get_backend
+from config import DIRECTORY_KEY, DIRECTORY_TTL
+
+_snapshot = None
+
+
+def _compact(member):
+    return {'real_name': member.get('real_name') or member.get('profile', {}).get('real_name') or member.get('name', ''),
+            'is_bot': member.get('is_bot', False) or member.get('id') == 'USLACKBOT',
+            'deleted': member.get('deleted', False)}
+
+
+def _save(snapshot):
+    get_backend().write(DIRECTORY_KEY, json.dumps(snapshot).encode('utf-8'))
+
+
+def refresh_directory():
+    """ Rebuild the snapshot from every page of users.list. """
+    global _snapshot
+    users, cursor = {}, None
+    while True:
+        response, _ = call_slack('users_list', limit=200, cursor=cursor) if cursor else call_slack('users_list', limit=200)
+        for member in response['members']:
+            users[member['id']] = _compact(member)
+        cursor = response.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            break
+    _snapshot = {'fetched_at': time.time(), 'users': users}
+    _save(_snapshot)
+    return _snapshot
+
+
+def _stored_directory():
+    """ The snapshot in memory or storage as it is, an empty one if there is none yet. """
+    global _snapshot
+    if _snapshot is None:
+        body = get_backend().read(DIRECTORY_KEY)
+        _snapshot = json.loads(body.decode('utf-8')) if body is not None else None
+    return _snapshot if _snapshot is not None else {'fetched_at': 0, 'users': {}}
+
+
+def get_directory(max_age=DIRECTORY_TTL):
+    """ The directory snapshot, refreshed when it is older than max_age seconds. """
+    snapshot = _stored_directory()
+    if time.time() - snapshot['fetched_at'] > max_age:
+        try:
+            return refresh_directory()
+        except SlackApiError as e:
+            # A stale directory is better than none
+            print(f"Error refreshing the user directory: {e}")
+    return snapshot
+
+
+def list_users():
+    """ Active, non-bot members of the workspace as [{'id': ..., 'real_name': ...}]. """
+    return [{'id': user_id, 'real_name': user['real_name']}
+            for user_id, user in get_directory()['users'].items() if not user['is_bot'] and not user['deleted']]
+
+
+def resolve_user(user_id):
+    """
+    Look up one member in the stored snapshot, fetching only them with users.info if the snapshot doesn't
+    know them or is stale. The snapshot is never rebuilt here, that is left to list_users.
+    """
+    global _snapshot
+    snapshot = _stored_directory()
+    if user_id not in snapshot['users'] or time.time() - snapshot['fetched_at'] > DIRECTORY_TTL:
+        try:
+            response, _ = call_slack('users_info', user=user_id)
+            snapshot['users'][user_id] = _compact(response['user'])
+            _snapshot = snapshot
+            _save(snapshot)
+        except SlackApiError as e:
+            print(f"Error getting user {user_id}: {e}")
+            if user_id not in snapshot['users']:
+                return None
+    user = snapshot['users'][user_id]
+    if user['is_bot'] or user['deleted']:
+        return None
+    return {'id': user_id, 'real_name': user['real_name']}
@@ -0,0 +1,24 @@
+"""
+Write the blocks the acknowledger answers buttons with (see its fast_path.py) from all_blocks, so they stay in sync.
+
+    python Lunchtag-Slack-Bot-handler/Lunchtag-Slack-Bot-handler/export_blocks.py
+"""
+import json
+import os
+
+from config import all_blocks
+
+ACKNOWLEDGER_BLOCKS = ('weekly_interest', 'weekly_interest_confirmed', 'weekly_interest_skipping', 'weekly_interest_paused')
+BLOCKS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           'Lunchtag-Slack-Bot-acknowledger', 'Lunchtag-Slack-Bot-acknowledger', 'blocks.json')
+
+
+def acknowledger_blocks():
+    return {name: all_blocks[name]['blocks'] for name in ACKNOWLEDGER_BLOCKS}
+
+
+if __name__ == '__main__':
+    with open(BLOCKS_FILE, 'w') as f:
+        json.dump(acknowledger_blocks(), f, indent=1)
+        f.write('\n')
+    print(f'Wrote {", ".join(ACKNOWLEDGER_BLOCKS)} to {BLOCKS_FILE}')
@@ -0,0 +1,133 @@
+"""
+Concurrent delivery of Slack messages.
+
+Bulk jobs (publishing pairings, weekly confirmations, invites) hand fan_out a
+list of deliveries instead of calling send_message in a loop. Recipients are
+served concurrently from a thread pool, each Web API method is throttled by a
+token bucket sized to its Slack rate tier, and 429 responses are retried after
+the Retry-After delay Slack asks for. Messages to the same recipient are sent
+in order, so an intro still arrives before its survey. A group_message
+delivery opens a group DM between several users and posts into it.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from slack_sdk.errors import SlackApiError
+
+from slack_client import slack_client
+from metrics import span
+from config import SLACK_RATE_LIMITS, FANOUT_WORKERS, FANOUT_MAX_ATTEMPTS
+
+
+class TokenBucket:
+    """ Allows per_minute calls per minute on average, with bursts of up to burst calls. """
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {method: TokenBucket(per_minute) for method, per_minute in SLACK_RATE_LIMITS.items()}
+
+
+def call_slack(method, **kwargs):
+    """
+    Call a Slack Web API method (e.g. 'chat_postMessage') within its rate tier, retrying
+    rate limited calls after Retry-After. Returns (response, attempts), other errors are raised.
+    """
+    for attempt in range(1, FANOUT_MAX_ATTEMPTS + 1):
+        if method in _buckets:
+            _buckets[method].acquire()
+        try:
+            return getattr(slack_client, method)(**kwargs), attempt
+        except SlackApiError as e:
+            if e.response.status_code != 429 or attempt == FANOUT_MAX_ATTEMPTS:
+                raise
+            retry_after = float(e.response.headers.get('Retry-After', 1))
+            print(f"Rate limited on {method}, retrying in {retry_after}s")
+            time.sleep(retry_after)
+
+
+def message(recipient, text, blocks=None):
+    """ A chat_postMessage delivery for fan_out. """
+    kwargs = {'channel': recipient, 'text': text}
+    if blocks:
+        kwargs['blocks'] = blocks['blocks']
+    return recipient, 'chat_postMessage', kwargs
+
+
+def group_message(user_ids, text, blocks=None):
+    """ A delivery that opens one group DM with all of user_ids and posts a single message there. """
+    kwargs = {'text': text}
+    if blocks:
+        kwargs['blocks'] = blocks['blocks']
+    return ','.join(user_ids), 'group_dm', kwargs
+
+
+def fan_out(deliveries):
+    """
+    Send (recipient, method, kwargs) deliveries concurrently, in order per recipient.
+    Returns a delivery report {recipient: {'delivered': n, 'failed': n, 'attempts': n, 'errors': [...]}}.
+    """
+    by_recipient = {}
+    for recipient, method, kwargs in deliveries:
+        by_recipient.setdefault(recipient, []).append((method, kwargs))
+
+    def deliver(recipient):
+        status = {'delivered': 0, 'failed': 0, 'attempts': 0, 'errors': []}
+        for method, kwargs in by_recipient[recipient]:
+            try:
+                if method == 'group_dm':
+                    response, attempts = call_slack('conversations_open', users=recipient)
+                    _, post_attempts = call_slack('chat_postMessage', channel=response['channel']['id'], **kwargs)
+                    attempts += post_attempts
+                else:
+                    _, attempts = call_slack(method, **kwargs)
+                status['delivered'] += 1
+                status['attempts'] += attempts
+            except SlackApiError as e:
+                print(f"Error delivering {method} to {recipient}: {e}")
+                status['failed'] += 1
+                status['attempts'] += FANOUT_MAX_ATTEMPTS if e.response.status_code == 429 else 1
+                status['errors'].append(e.response.get('error', str(e)))
+        return status
+
+    with span('fan_out'), ThreadPoolExecutor(max_workers=FANOUT_WORKERS) as executor:
+        return dict(zip(by_recipient, executor.map(deliver, by_recipient)))
+
+
+def merge_reports(report, other):
+    """ Add the delivery report other to report, e.g. the report of a later batch of deliveries. """
+    for recipient, status in other.items():
+        merged = report.setdefault(recipient, {'delivered': 0, 'failed': 0, 'attempts': 0, 'errors': []})
+        for field in ('delivered', 'failed', 'attempts', 'errors'):
+            merged[field] += status[field]
+    return report
+
+
+def summarize_report(report):
+    """ One line summary of a delivery report for the admin. """
+    delivered = sum(status['delivered'] for status in report.values())
+    # Group DM recipients are comma separated user ids
+    members = {user_id for recipient in report for user_id in recipient.split(',')}
+    failed = sorted({user_id for recipient, status in report.items() if status['failed'] for user_id in recipient.split(',')})
+    summary = f"Delivered {delivered} messages to {len(members)} members"
+    if failed:
+        summary += f", failed for {', '.join('<@' + user_id + '>' for user_id in failed)}"
+    return summary
@@ -0,0 +1,112 @@
+"""
+Group formation for socials: splitting users into groups of about k people
+that maximize the total compatibility of every pair within a group.
+
+Exact partitioning is intractable at this size, so form_groups is a heuristic
+on the compatibility matrix:
+
+  * Seeding: groups are given k or k + 1 members (see group_sizes). Users
+    are placed in order of their best score, each into the group with room
+    whose current members they score highest with.
+  * Refinement: two users in different groups trade places when that raises
+    the total. For every user all trades are scored at once with NumPy from
+    a user x group matrix of summed scores, and the best one is applied.
+
+Passes repeat until one gains nothing or the time or pass budget is spent,
+printing the gain of every pass like refine_matching does.
+"""
+import math
+import time
+
+import numpy as np
+
+from config import GROUP_TIME_BUDGET, GROUP_MAX_PASSES
+
+
+def group_sizes(num_users, group_size):
+    """
+    Sizes of the groups num_users are split into, as equal as possible: group_size each,
+    the users that don't divide evenly making some groups one larger (smaller only when there are too few users).
+    """
+    num_groups = max(1, num_users // group_size, math.ceil(num_users / (group_size + 1)))
+    base, extra = divmod(num_users, num_groups)
+    return [base + 1] * extra + [base] * (num_groups - extra)
+
+
+def form_groups(weights, group_size, time_budget=GROUP_TIME_BUDGET, max_passes=GROUP_MAX_PASSES):
+    """
+    Split users 0..n-1 into groups of group_size or group_size + 1, maximizing the summed weights of the pairs within groups.
+    Returns (groups, gains): a list of user index lists and the gain of each refinement pass.
+    """
+    deadline = time.monotonic() + time_budget
+    weights = np.asarray(weights)
+    n = len(weights)
+    if n == 0:
+        return [], []
+    # The matrix is used in place with a zero diagonal, and gets its own diagonal back at the end
+    diagonal = weights.diagonal().copy()
+    try:
+        return _form_groups(weights, n, group_size, deadline, max_passes)
+    finally:
+        np.fill_diagonal(weights, diagonal)
+
+
+def _form_groups(weights, n, group_size, deadline, max_passes):
+    sizes = np.array(group_sizes(n, group_size))
+    num_groups = len(sizes)
+
+    # together[u, g] is the summed weight of u with the members of group g
+    together = np.zeros((n, num_groups), dtype=np.float32)
+    group_of = np.empty(n, dtype=np.int64)
+    members = np.zeros(num_groups, dtype=np.int64)
+    np.fill_diagonal(weights, -np.inf if np.issubdtype(weights.dtype, np.floating) else np.iinfo(weights.dtype).min)
+    best = weights.max(axis=1) if n > 1 else np.zeros(1)
+    np.fill_diagonal(weights, 0)
+    for user in np.argsort(-best.astype(np.float64), kind='stable'):
+        gain = np.where(members < sizes, together[user], -np.inf)
+        group = int(np.argmax(gain))
+        group_of[user] = group
+        members[group] += 1
+        together[:, group] += weights[user]
+
+    users = np.arange(n)
+    gains = []
+    while len(gains) < max_passes and time.monotonic() < deadline:
+        gain = 0.0
+        for user in range(n):
+            if user % 64 == 0 and time.monotonic() >= deadline:
+                break
+            own = group_of[user]
+            # Gain of trading places with every other user, weights are symmetric so rows stand in for columns
+            trade = (together[user, group_of] - 2 * weights[user] - together[user, own]
+                     + together[:, own] - together[users, group_of])
+            trade[group_of == own] = 0
+            other = int(np.argmax(trade))
+            if trade[other] <= 1e-6:
+                continue
+            gain += float(trade[other])
+            theirs = group_of[other]
+            together[:, own] += weights[other] - weights[user]
+            together[:, theirs] += weights[user] - weights[other]
+            group_of[user], group_of[other] = theirs, own
+
+        gains.append(int(round(gain)))
+        print(f"Group refinement pass {len(gains)}: objective +{gains[-1]}")
+        if gain <= 1e-6:
+            break
+
+    groups = [[] for _ in range(num_groups)]
+    for user, group in enumerate(group_of.tolist()):
+        groups[group].append(user)
+    return groups, gains
+
+
+def group_objective(weights, groups):
+    """ Summed weights of every pair within the groups. """
+    weights = np.asarray(weights)
+    return sum(int(weights[np.ix_(group, group)][np.triu_indices(len(group), 1)].sum()) for group in groups)
+
+
+def group_indexes(groups):
+    """ Every pair within the groups as (user1_index, user2_index) tuples, the form solve_pairings returns. """
+    return [(user1, user2) for group in groups for position, user1 in enumerate(sorted(group)) for user2 in sorted(group)[position + 1:]]
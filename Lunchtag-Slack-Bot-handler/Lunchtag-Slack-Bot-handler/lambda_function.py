@@ -1,9 +1,12 @@
 import json
 
-from config import SLACK_BOT_TOKEN, specific_users, all_blocks, admin_users, messages
-from slack_client import get_message, send_message, update_message, log, log_exception
-from user_management import invite_users, confirm_weekly_interest, ask_interests, save_users, load_users, confirm_weekly_interest_followup, get_user_profile, update_profile, preload_profile, update_survey
-from pairings_manager import generate_pairings, save_pairings, read_pairings, swap_pairings, publish_and_send_dm
+from config import SLACK_BOT_TOKEN, specific_users, all_blocks, admin_users, messages, SLOW_PATH_THRESHOLD, LOCKED_ADMIN_JOBS, COHORT_CROSSOVER
+from slack_client import get_message, send_message, update_message, log, log_exception, flush_log
+from user_management import invite_users, confirm_weekly_interest, ask_interests, save_users, load_users, load_user, save_user, confirm_weekly_interest_followup, get_user_profile, update_profile, preload_profile, update_survey, set_cohort
+from fanout import summarize_report
+from analytics import summary
+from storage import unit_of_work, run_in_background, wait_for_background, run_lock, sync_roster_entry, JobRunning
+from metrics import start_invocation, finish, slow_path_note
 import traceback
 
         
@@ -12,45 +15,54 @@ def button_handler(user_id, channel_id, state, value, message_ts):
     """Check which button was pressed and take action"""
 
     log(f'{user_id} just activated button {value}')
-    user_data = load_users()
-    user_status = user_data.get(user_id, {}).get('status')
-    user_interest = user_data.get(user_id, {}).get('weekly_interest')
+    user_record = load_user(user_id)
+    if user_record is None:
+        # Only members have buttons to click, don't create a partial record for anyone else
+        log(f'{user_id} is not a member, ignoring button {value}')
+        return {}
+    user_status = user_record.get('status')
+    user_interest = user_record.get('weekly_interest')
     
     if value == 'invite_accepted':
-        user_data[user_id]['status'] = "joined"
-        user_data[user_id]["weekly_interest"] = "confirmed"
+        user_record['status'] = "joined"
+        user_record["weekly_interest"] = "confirmed"
         update_message(channel_id, message_ts, all_blocks['invite_accepted'])
         send_message(user_id, "Setup your LunchTag Profile", blocks=all_blocks['profile'])
 
 
     elif value == 'invite_declined':
-        user_data[user_id]['status'] = "declined"
+        user_record['status'] = "declined"
         update_message(channel_id, message_ts, all_blocks['invite_declined'])
     
     elif value == 'invite_reconsider':
         update_message(channel_id, message_ts, all_blocks['invite'])
 
     elif value == 'weekly_interest_confirmed':
-        user_data[user_id]["weekly_interest"] = "confirmed"
+        user_record["weekly_interest"] = "confirmed"
         update_message(channel_id, message_ts, all_blocks['weekly_interest_confirmed'])
 
     elif value == 'weekly_interest_skipping':
-        user_data[user_id]["weekly_interest"] = "skipping"
+        user_record["weekly_interest"] = "skipping"
         update_message(channel_id, message_ts, all_blocks['weekly_interest_skipping'])
     
     elif value == 'weekly_interest_paused':
-        user_data[user_id]["weekly_interest"] = "paused"
+        user_record["weekly_interest"] = "paused"
         update_message(channel_id, message_ts, all_blocks['weekly_interest_paused'])
     
     elif value == 'weekly_interest_reconsider':
-        user_data[user_id]["weekly_interest"] = "noResponse"
+        user_record["weekly_interest"] = "noResponse"
         update_message(channel_id, message_ts, all_blocks['weekly_interest'])
     
-    elif value == 'survey-complete':
+    save_user(user_id, user_record)
+    
+    if value == 'survey-complete':
         update_survey(user_id, state)
         update_message(channel_id, message_ts, all_blocks['survey_completed'])
-        
-    save_users(user_data)
+    
+    elif value == 'survey-complete-shared':
+        # The survey lives in the pair's group DM, so leave it in place for the partner
+        update_survey(user_id, state)
+        send_message(user_id, "Your survey response has been recorded. Thank you!")
     
     if value == 'profile_update':
         update_profile(user_id, state)
@@ -70,7 +82,11 @@ def command_handler(command, text, user_id):
         invite_users('specified', user_id)
     
     elif command == "/lunchtag-profile":
-        send_message(user_id, "View and edit your profile", blocks=preload_profile(user_id))
+        blocks = preload_profile(user_id)
+        if blocks is None:
+            send_message(user_id, messages['missing_user'])
+        else:
+            send_message(user_id, "View and edit your profile", blocks=blocks)
     
     elif command == "/lunchtag-status":
         send_message(user_id, "Set your status", blocks=all_blocks['weekly_interest'])
@@ -83,72 +99,108 @@ def command_handler(command, text, user_id):
             send_message(user_id, "You're not authorized to perform this function")
             return {}
         
-        if text in ("",None):
-            send_message(user_id, messages['admin_controls'])
+        if text and text.split()[0] in LOCKED_ADMIN_JOBS:
+            # One admin job at a time, so e.g. a second publish can't run while the first is still sending DMs
+            try:
+                with run_lock('admin'):
+                    admin_command(text, user_id)
+            except JobRunning:
+                send_message(user_id, "Another admin job is still running, try again when it has finished.")
+        else:
+            admin_command(text, user_id)
+        
+    return {}
+
+
+def admin_command(text, user_id):
+    """ Performs the /lunchtag-admin action named by text. """
+    if text and any(word in text for word in ('generate', 'swap', 'publish', 'pairings')):
+        # numpy, pandas, munkres and the report writers are only needed here, so keep them out of every cold start
+        from pairings_manager import generate_pairings, save_pairings, read_pairings, report_view, swap_pairings, publish_and_send_dm, group_size_of, unpaired_note
+        
+    if text in ("",None):
+        send_message(user_id, messages['admin_controls'])
         
-        elif text == 'view':
-            user_data = load_users()
-            message = str(user_data)
-            send_message(user_id, message)
+    elif text == 'view':
+        user_data = load_users()
+        message = str(user_data)
+        send_message(user_id, message)
         
-        elif 'invite' in text:
-            params = text.split()[-1]
-
-            if params == 'invite' or "":
-                # send_message(user_id, "Please specify.")
-                specific_users = ['U03UFPNSDT6']
-                send_message(user_id, "Sending invitations to specified users.")
-                invite_users('specified', specific_users)
+    elif 'invite' in text:
+        params = text.split()[-1]
+
+        if params == 'invite' or "":
+            # send_message(user_id, "Please specify.")
+            specific_users = ['U03UFPNSDT6']
+            send_message(user_id, "Sending invitations to specified users.")
+            report = invite_users('specified', specific_users)
                 
-            elif params == 'nonresponders':
-                send_message(user_id, "Sending invitations to all nonresponded.")
-                invite_users('nonresponders')
-
-            elif params == 'new':
-                send_message(user_id, "Sending invitations to all new members.")
-                invite_users('new')
-
-            else:
-                specific_users = params.split(',')
-                send_message(user_id, "Sending invitations to specified users.")
-                invite_users('specified', specific_users)
+        elif params == 'nonresponders':
+            send_message(user_id, "Sending invitations to all nonresponded.")
+            report = invite_users('nonresponders')
+
+        elif params == 'new':
+            send_message(user_id, "Sending invitations to all new members.")
+            report = invite_users('new')
+
+        else:
+            specific_users = params.split(',')
+            send_message(user_id, "Sending invitations to specified users.")
+            report = invite_users('specified', specific_users)
+        send_message(user_id, summarize_report(report) + slow_path_note(SLOW_PATH_THRESHOLD))
         
-        elif text == 'confirm':
-            send_message(user_id, "Clearing last weeks status and asking active members for weekly confirmation")
-            confirm_weekly_interest()
+    elif text == 'confirm':
+        send_message(user_id, "Clearing last weeks status and asking active members for weekly confirmation")
+        report = confirm_weekly_interest()
+        send_message(user_id, summarize_report(report) + slow_path_note(SLOW_PATH_THRESHOLD))
             
-        elif text == 'confirm-followup':
-            send_message(user_id, "Following up on asking members for weekly confirmation")
-            confirm_weekly_interest_followup()
+    elif text == 'confirm-followup':
+        send_message(user_id, "Following up on asking members for weekly confirmation")
+        report = confirm_weekly_interest_followup()
+        send_message(user_id, summarize_report(report) + slow_path_note(SLOW_PATH_THRESHOLD))
         
-        elif 'generate' in text:
-            send_message(user_id, "Generating pairings among Confirmed interested participants.")
-            generated_df = generate_pairings()
-            save_pairings(generated_df)
-            file_name = read_pairings(text)
-            send_message(user_id, 'Here is pairing data that was just generated', [], file_name)
+    elif 'generate' in text:
+        send_message(user_id, "Generating pairings among Confirmed interested participants.")
+        generated_df = generate_pairings(by_cohort='cohort' in text, crossover=COHORT_CROSSOVER or 'crossover' in text,
+                                         group_size=group_size_of(text))
+        file_name, content = save_pairings(generated_df, report_view(text))
+        send_message(user_id, 'Here is pairing data that was just generated' + unpaired_note(generated_df) + slow_path_note(SLOW_PATH_THRESHOLD), [], file_name, file_content=content)
         
-        elif 'swap' in text:
-            send_message(user_id, "Swapping pairings...")
-            swapped_df = swap_pairings(text)
-            save_pairings(swapped_df)
-            file_name = read_pairings()
-            send_message(user_id, 'Here is swapped data that was just generated', [], file_name)
+    elif 'swap' in text:
+        send_message(user_id, "Swapping pairings...")
+        swapped_df, score_change = swap_pairings(text)
+        file_name, content = save_pairings(swapped_df)
+        send_message(user_id, f'Here is swapped data that was just generated, total score changed by {score_change:+d}' + slow_path_note(SLOW_PATH_THRESHOLD), [], file_name, file_content=content)
         
-        elif text == 'publish':
-            send_message(user_id, "Publishing the final pairings and creating private chats.")
-            publish_and_send_dm()
-            send_message(user_id, 'Just published!')
+    elif text == 'publish':
+        send_message(user_id, "Publishing the final pairings and creating private chats.")
+        report, remaining = publish_and_send_dm()
+        if remaining:
+            send_message(user_id, f'Published part of the pairings, {remaining} groups are left. ' + summarize_report(report) +
+                         '. Run publish again to send the rest.' + slow_path_note(SLOW_PATH_THRESHOLD))
+        else:
+            send_message(user_id, 'Just published! ' + summarize_report(report) + slow_path_note(SLOW_PATH_THRESHOLD))
         
-        elif 'pairings' in text:
-            file_name = read_pairings(text)
-            send_message(user_id, 'Here is pairing data that currently is saved', [], file_name)
-            
-        elif 'set_users' in text:
-            user_data = {}
-            save_users(user_data)
+    elif text.split()[0] == 'cohort':
+        params = text.split()
+        if len(params) != 3:
+            send_message(user_id, "Usage: /lunchtag-admin cohort {name, -} U1,U2")
+            return
+        updated = set_cohort('' if params[1] == '-' else params[1], params[2].split(','))
+        send_message(user_id, f"Updated the cohort of {updated} members.")
         
-    return {}
+    elif text.split()[0] == 'analytics':
+        params = text.split()
+        send_message(user_id, summary(params[1] if len(params) > 1 else None))
+        
+    elif 'pairings' in text:
+        file_name, content = read_pairings(text)
+        send_message(user_id, 'Here is pairing data that currently is saved' + slow_path_note(SLOW_PATH_THRESHOLD), [], file_name, file_content=content)
+            
+    elif 'set_users' in text:
+        user_data = {}
+        save_users(user_data)
+
     
     
     
@@ -182,20 +234,35 @@ def lambda_handler(event, context):
     """
     AWS Lambda handler.
     Logs the received event and context.
-    Depending on the presence of 'slack_event_body' or 'payload' in the event,
-    calls the respective handling function.
+    Depending on the presence of 'slack_event_body', 'payload' or 'sync_roster' (a user id whose record the
+    acknowledger changed) in the event, calls the respective handling function, then prints the invocation's metrics record.
     """
     print(f"Received event:\n{event}\nWith context:\n{context}")
 
     slack_event_body = event.get('slack_event_body')
     payload = event.get('payload')
+    event_type = (slack_event_body or {}).get('command') or (payload or {}).get('actions', [{}])[0].get('value') or ('sync_roster' if 'sync_roster' in event else None)
+    if slack_event_body and slack_event_body.get('command') == '/lunchtag-admin' and slack_event_body.get('text'):
+        event_type += ' ' + slack_event_body['text'].split()[0]
 
+    start_invocation(event_type)
+    error = None
     try:
-        if slack_event_body:
-            handle_slack_event_body(slack_event_body)
-        elif payload:
-            handle_payload(payload)
+        # One load and one save of each touched user record for the whole invocation
+        with unit_of_work():
+            if slack_event_body:
+                handle_slack_event_body(slack_event_body)
+            elif payload:
+                handle_payload(payload)
+            elif event.get('sync_roster'):
+                sync_roster_entry(event['sync_roster'])
     except Exception as e:
+        error = type(e).__name__
         log_exception(e)
+    # The invocation's log entries are posted alongside the reports archived off the critical path,
+    # both have to land before the container is frozen
+    run_in_background(flush_log)
+    wait_for_background()
 
+    finish(error=error)
     return {'statusCode': 200}
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Local search over pairings.
+
+refine_matching improves an existing matching by exchanging partners between
+pairs, working directly on the compatibility matrix:
+
+  * 2-opt: two pairs (a, b), (c, d) are re-paired as (a, c), (b, d) or
+    (a, d), (b, c). Every pair is tried against all others at once with
+    NumPy and the best improving exchange is applied.
+  * 3-opt: a user moves to one of their LOCAL_SEARCH_CANDIDATES best scoring
+    partners, and the two users left behind are re-paired with the members
+    of whichever third pair gains the most.
+
+Passes alternate until one gains nothing or the time or pass budget is spent,
+and the gain of every pass is printed. Starting from greedy_matching this is a
+fast heuristic for cohorts too large for the exact blossom solver.
+
+Like max_weight_matching, every user is matched when n is even and exactly
+one is left over when n is odd, and the result is a mate list.
+"""
+import time
+
+import numpy as np
+
+from config import LOCAL_SEARCH_TIME_BUDGET, LOCAL_SEARCH_MAX_PASSES, LOCAL_SEARCH_CANDIDATES
+
+
+def greedy_matching(weights):
+    """
+    Match users in order of their best score, each to their best partner still available.
+    Needs O(n) memory on top of the matrix, so it also works for very large cohorts.
+    """
+    weights = np.asarray(weights)
+    n = len(weights)
+    mate = [-1] * n
+    if n < 2:
+        return mate
+    available = np.ones(n, dtype=bool)
+    masked = weights.astype(float)
+    np.fill_diagonal(masked, -np.inf)
+    for user in np.argsort(-masked.max(axis=1), kind='stable'):
+        if not available[user]:
+            continue
+        available[user] = False
+        row = np.where(available, masked[user], -np.inf)
+        partner = int(np.argmax(row))
+        if not available[partner]:
+            # Everyone else is taken, this is the leftover of an odd cohort
+            available[user] = True
+            break
+        available[partner] = False
+        mate[user], mate[partner] = partner, int(user)
+    return mate
+
+
+def refine_matching(weights, mate, time_budget=LOCAL_SEARCH_TIME_BUDGET, max_passes=LOCAL_SEARCH_MAX_PASSES, candidates=LOCAL_SEARCH_CANDIDATES):
+    """
+    Improve mate with 2-opt and 3-opt pair exchanges until a pass gains nothing,
+    time_budget seconds have passed or max_passes passes have run.
+    Returns the improved mate list and the gain of each pass.
+    """
+    deadline = time.monotonic() + time_budget
+    weights = np.asarray(weights)
+    n = len(weights)
+    if n < 4:
+        return list(mate), []
+
+    # The leftover of an odd cohort is paired with a dummy user scoring 0 with everyone,
+    # so exchanges can also swap who is left over
+    size = n + n % 2
+    padded = np.zeros((size, size), dtype=weights.dtype)
+    padded[:n, :n] = weights
+    pairs = [(user, partner) for user, partner in enumerate(mate) if user < partner]
+    pairs += [(user, n) for user, partner in enumerate(mate) if partner == -1]
+    first = np.array([user for user, _ in pairs])
+    second = np.array([partner for _, partner in pairs])
+    num_pairs = len(pairs)
+    pair_of = np.empty(size, dtype=np.int64)
+
+    # The best scoring partners of every user, the only moves 3-opt tries
+    candidates = min(candidates, size - 1)
+    masked = padded.astype(float)
+    np.fill_diagonal(masked, -np.inf)
+    best_partners = np.argpartition(-masked, candidates - 1, axis=1)[:, :candidates]
+    gains = []
+
+    while len(gains) < max_passes and time.monotonic() < deadline:
+        gain = 0
+
+        # 2-opt: (a, b), (c, d) -> (a, c), (b, d) or (a, d), (b, c)
+        for p in range(num_pairs):
+            if time.monotonic() >= deadline:
+                break
+            a, b = first[p], second[p]
+            current = padded[a, b] + padded[first, second]
+            straight = padded[a, first] + padded[b, second] - current
+            crossed = padded[a, second] + padded[b, first] - current
+            straight[p] = crossed[p] = 0
+            q_straight, q_crossed = int(np.argmax(straight)), int(np.argmax(crossed))
+            if max(straight[q_straight], crossed[q_crossed]) <= 0:
+                continue
+            if straight[q_straight] >= crossed[q_crossed]:
+                q = q_straight
+                gain += straight[q]
+                second[p], first[q] = first[q], b
+            else:
+                q = q_crossed
+                gain += crossed[q]
+                second[p], second[q] = second[q], b
+
+        # 3-opt: a leaves b for c, one of its best partners, and the two left behind
+        # (b and c's partner d) are re-paired with the members of a third pair (e, f)
+        for p in range(num_pairs):
+            if time.monotonic() >= deadline:
+                break
+            pair_of[first] = pair_of[second] = np.arange(num_pairs)
+            for mover, left in ((first[p], second[p]), (second[p], first[p])):
+                for c in best_partners[mover]:
+                    q = pair_of[c]
+                    if q == p:
+                        continue
+                    d = second[q] if first[q] == c else first[q]
+                    current = padded[mover, left] + padded[c, d] + padded[first, second]
+                    straight = padded[mover, c] + padded[d, first] + padded[left, second] - current
+                    crossed = padded[mover, c] + padded[d, second] + padded[left, first] - current
+                    straight[[p, q]] = crossed[[p, q]] = 0
+                    r_straight, r_crossed = int(np.argmax(straight)), int(np.argmax(crossed))
+                    if max(straight[r_straight], crossed[r_crossed]) <= 0:
+                        continue
+                    if straight[r_straight] >= crossed[r_crossed]:
+                        r = r_straight
+                        gain += straight[r]
+                        e, f = first[r], second[r]
+                    else:
+                        r = r_crossed
+                        gain += crossed[r]
+                        e, f = second[r], first[r]
+                    first[p], second[p] = mover, c
+                    first[q], second[q] = d, e
+                    first[r], second[r] = left, f
+                    break
+                else:
+                    continue
+                break
+
+        gains.append(int(gain) if float(gain).is_integer() else float(gain))
+        print(f"Local search pass {len(gains)}: objective +{gains[-1]}")
+        if gain <= 0:
+            break
+
+    refined = [-1] * n
+    for user, partner in zip(first.tolist(), second.tolist()):
+        if user < n and partner < n:
+            refined[user], refined[partner] = partner, user
+    return refined, gains
+
+
+def local_search_matching(weights, time_budget=LOCAL_SEARCH_TIME_BUDGET):
+    """ Heuristic replacement for max_weight_matching: a greedy matching refined by local search. """
+    mate, _ = refine_matching(weights, greedy_matching(weights), time_budget=time_budget)
+    return mate
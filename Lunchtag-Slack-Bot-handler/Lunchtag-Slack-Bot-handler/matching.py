@@ -0,0 +1,460 @@
+"""
+Maximum-weight matching on a general (non-bipartite) graph.
+
+This is the primal-dual blossom algorithm of Edmonds, in the O(n^3) form
+described by Galil ("Efficient algorithms for finding maximum matching in
+graphs", 1986). The structure follows Joris van Rantwijk's well known
+public domain implementation, adapted to work directly on a dense, symmetric
+compatibility matrix so no edge list has to be materialised.
+
+Edges are referred to by a directed code p = i * n + j, meaning "the edge
+between i and j, seen from i". The endpoint of p is j, and the same edge
+seen from j is reverse(p).
+"""
+import numpy as np
+
+
+def max_weight_matching(weights):
+    """
+    Compute a maximum-weight maximum-cardinality matching for the complete
+    graph described by the symmetric matrix weights (a list of lists or a
+    NumPy array, which is read in place). The diagonal is ignored. Every vertex is matched when n is
+    even and exactly one is left over when n is odd.
+
+    Returns a list mate where mate[i] is the vertex matched to i, or -1.
+    """
+    weights = np.asarray(weights)
+    nvertex = len(weights)
+    if nvertex < 2:
+        return [-1] * nvertex
+
+    # An odd cohort gets an implicit dummy vertex with weight 0 to everyone, whoever
+    # ends up matched to it is the leftover of the best matching on the rest
+    n = nvertex + nvertex % 2
+    integer_weights = np.issubdtype(weights.dtype, np.integer)
+    work_dtype = np.int64 if integer_weights else np.float64
+
+    def weight(i, j):
+        return weights.item(i, j) if i < nvertex and j < nvertex else 0
+
+    def weight_row(v):
+        """ The weights of v's edges as a fresh array, one row of the matrix at a time. """
+        row = np.zeros(n, dtype=work_dtype)
+        if v < nvertex:
+            row[:nvertex] = weights[v]
+        return row
+
+    def endpoint(p):
+        return p % n
+
+    def reverse(p):
+        return (p % n) * n + p // n
+
+    def allow_edge(p):
+        i, j = divmod(p, n)
+        allowed[i].add(j)
+        allowed[j].add(i)
+
+    def slack(p):
+        i, j = divmod(p, n)
+        return dualvar[i] + dualvar[j] - 2 * weight(i, j)
+
+    # mate[v] is the directed edge code pointing at v's partner, or -1
+    mate = n * [-1]
+    # label[b] for top-level blossom b: 0 free, 1 S-vertex/blossom, 2 T-vertex/blossom
+    label = (2 * n) * [0]
+    # labelend[b] is the edge through which b obtained its label, or -1
+    labelend = (2 * n) * [-1]
+    inblossom = list(range(n))
+    blossomparent = (2 * n) * [-1]
+    blossomchilds = (2 * n) * [None]
+    blossombase = list(range(n)) + n * [-1]
+    blossomendps = (2 * n) * [None]
+    # bestedge[b] is the least-slack edge to a different S-blossom
+    bestedge = (2 * n) * [-1]
+    bestslack = (2 * n) * [0]
+    blossombestedges = (2 * n) * [None]
+    unusedblossoms = list(range(n, 2 * n))
+    dualvar = (2 * n) * [0]
+    # allowed[v] holds the neighbours w for which edge (v, w) may be used this stage
+    allowed = [set() for _ in range(n)]
+    # Set whenever labels or blossoms change, so the NumPy views below are rebuilt
+    labels_changed = [True]
+    queue = []
+
+    def blossom_leaves(b):
+        if b < n:
+            yield b
+        else:
+            for t in blossomchilds[b]:
+                if t < n:
+                    yield t
+                else:
+                    yield from blossom_leaves(t)
+
+    def assign_label(w, t, p):
+        labels_changed[0] = True
+        b = inblossom[w]
+        label[w] = label[b] = t
+        labelend[w] = labelend[b] = p
+        bestedge[w] = bestedge[b] = -1
+        if t == 1:
+            queue.extend(blossom_leaves(b))
+        elif t == 2:
+            base = blossombase[b]
+            assign_label(endpoint(mate[base]), 1, reverse(mate[base]))
+
+    def scan_blossom(v, w):
+        """ Trace back from v and w to find a new blossom base, or -1 for an augmenting path. """
+        path = []
+        base = -1
+        while v != -1 or w != -1:
+            b = inblossom[v]
+            if label[b] & 4:
+                base = blossombase[b]
+                break
+            path.append(b)
+            label[b] = 5
+            if labelend[b] == -1:
+                v = -1
+            else:
+                v = endpoint(labelend[b])
+                b = inblossom[v]
+                v = endpoint(labelend[b])
+            if w != -1:
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def add_blossom(base, v, w):
+        labels_changed[0] = True
+        bb = inblossom[base]
+        bv = inblossom[v]
+        bw = inblossom[w]
+        b = unusedblossoms.pop()
+        blossombase[b] = base
+        blossomparent[b] = -1
+        blossomparent[bb] = b
+        blossomchilds[b] = path = []
+        blossomendps[b] = endps = []
+        closing_edge = w * n + v
+        while bv != bb:
+            blossomparent[bv] = b
+            path.append(bv)
+            endps.append(labelend[bv])
+            v = endpoint(labelend[bv])
+            bv = inblossom[v]
+        path.append(bb)
+        path.reverse()
+        endps.reverse()
+        endps.append(closing_edge)
+        while bw != bb:
+            blossomparent[bw] = b
+            path.append(bw)
+            endps.append(reverse(labelend[bw]))
+            w = endpoint(labelend[bw])
+            bw = inblossom[w]
+        label[b] = 1
+        labelend[b] = labelend[bb]
+        dualvar[b] = 0
+        for leaf in blossom_leaves(b):
+            if label[inblossom[leaf]] == 2:
+                queue.append(leaf)
+            inblossom[leaf] = b
+
+        # Compute the least-slack edges from the new blossom to neighbouring S-blossoms
+        bestedgeto = (2 * n) * [-1]
+        for child in path:
+            if blossombestedges[child] is None:
+                nblist = [leaf * n + other for leaf in blossom_leaves(child) for other in range(n) if other != leaf]
+            else:
+                nblist = blossombestedges[child]
+            for p in nblist:
+                j = endpoint(p)
+                if inblossom[j] == b:
+                    p = reverse(p)
+                    j = endpoint(p)
+                bj = inblossom[j]
+                if bj != b and label[bj] == 1 and (bestedgeto[bj] == -1 or slack(p) < slack(bestedgeto[bj])):
+                    bestedgeto[bj] = p
+            blossombestedges[child] = None
+            bestedge[child] = -1
+        blossombestedges[b] = [p for p in bestedgeto if p != -1]
+        bestedge[b] = -1
+        for p in blossombestedges[b]:
+            kslack = slack(p)
+            if bestedge[b] == -1 or kslack < bestslack[b]:
+                bestedge[b] = p
+                bestslack[b] = kslack
+
+    def expand_blossom(b, endstage):
+        labels_changed[0] = True
+        for s in blossomchilds[b]:
+            blossomparent[s] = -1
+            if s < n:
+                inblossom[s] = s
+            elif endstage and dualvar[s] == 0:
+                expand_blossom(s, endstage)
+            else:
+                for leaf in blossom_leaves(s):
+                    inblossom[leaf] = s
+
+        # A T-blossom expanded mid-stage must relabel the children on its alternating path
+        if not endstage and label[b] == 2:
+            entrychild = inblossom[endpoint(reverse(labelend[b]))]
+            j = blossomchilds[b].index(entrychild)
+            if j & 1:
+                j -= len(blossomchilds[b])
+                jstep = 1
+                endptrick = False
+            else:
+                jstep = -1
+                endptrick = True
+            p = labelend[b]
+            while j != 0:
+                if endptrick:
+                    q = reverse(blossomendps[b][j - 1])
+                else:
+                    q = blossomendps[b][j]
+                label[endpoint(reverse(p))] = 0
+                label[endpoint(reverse(q))] = 0
+                assign_label(endpoint(reverse(p)), 2, p)
+                allow_edge(q)
+                j += jstep
+                p = reverse(blossomendps[b][j - 1]) if endptrick else blossomendps[b][j]
+                allow_edge(p)
+                j += jstep
+            bv = blossomchilds[b][j]
+            label[endpoint(reverse(p))] = label[bv] = 2
+            labelend[endpoint(reverse(p))] = labelend[bv] = p
+            bestedge[bv] = -1
+            j += jstep
+            while blossomchilds[b][j] != entrychild:
+                bv = blossomchilds[b][j]
+                if label[bv] == 1:
+                    j += jstep
+                    continue
+                for leaf in blossom_leaves(bv):
+                    if label[leaf] != 0:
+                        break
+                if label[leaf] != 0:
+                    label[leaf] = 0
+                    label[endpoint(mate[blossombase[bv]])] = 0
+                    assign_label(leaf, 2, labelend[leaf])
+                j += jstep
+
+        label[b] = labelend[b] = -1
+        blossomchilds[b] = blossomendps[b] = None
+        blossombase[b] = -1
+        blossombestedges[b] = None
+        bestedge[b] = -1
+        unusedblossoms.append(b)
+
+    def augment_blossom(b, v):
+        t = v
+        while blossomparent[t] != b:
+            t = blossomparent[t]
+        if t >= n:
+            augment_blossom(t, v)
+        i = j = blossomchilds[b].index(t)
+        if i & 1:
+            j -= len(blossomchilds[b])
+            jstep = 1
+            endptrick = False
+        else:
+            jstep = -1
+            endptrick = True
+        while j != 0:
+            j += jstep
+            t = blossomchilds[b][j]
+            p = reverse(blossomendps[b][j - 1]) if endptrick else blossomendps[b][j]
+            if t >= n:
+                augment_blossom(t, endpoint(p))
+            j += jstep
+            t = blossomchilds[b][j]
+            if t >= n:
+                augment_blossom(t, endpoint(reverse(p)))
+            mate[endpoint(p)] = reverse(p)
+            mate[endpoint(reverse(p))] = p
+        blossomchilds[b] = blossomchilds[b][i:] + blossomchilds[b][:i]
+        blossomendps[b] = blossomendps[b][i:] + blossomendps[b][:i]
+        blossombase[b] = blossombase[blossomchilds[b][0]]
+
+    def augment_matching(v, w):
+        for s, p in ((v, v * n + w), (w, w * n + v)):
+            while True:
+                bs = inblossom[s]
+                if bs >= n:
+                    augment_blossom(bs, s)
+                mate[s] = p
+                if labelend[bs] == -1:
+                    break
+                t = endpoint(labelend[bs])
+                bt = inblossom[t]
+                s = endpoint(labelend[bt])
+                j = endpoint(reverse(labelend[bt]))
+                if bt >= n:
+                    augment_blossom(bt, j)
+                mate[j] = labelend[bt]
+                p = reverse(labelend[bt])
+
+    # Jump start: give every vertex the smallest feasible dual and greedily match
+    # along tight edges, so the stages below only have to place the rest
+    for v in range(n):
+        dualvar[v] = np.delete(weight_row(v), v).max().item()
+    duals = np.array(dualvar[:n], dtype=work_dtype)
+    unmatched = np.ones(n, dtype=bool)
+    for v in range(n):
+        if mate[v] == -1:
+            candidates = 2 * weight_row(v) - duals
+            dualvar[v] = duals[v] = np.delete(candidates, v).max().item()
+            unmatched[v] = False
+            tight = np.flatnonzero(unmatched & (candidates == dualvar[v]))
+            if len(tight):
+                w = int(tight[0])
+                mate[v] = v * n + w
+                mate[w] = w * n + v
+                unmatched[w] = False
+            else:
+                unmatched[v] = True
+
+    for _ in range(n):
+        # Each stage either augments the matching by one edge or proves it is maximum
+        label[:] = (2 * n) * [0]
+        bestedge[:] = (2 * n) * [-1]
+        blossombestedges[n:] = n * [None]
+        for neighbours in allowed:
+            neighbours.clear()
+        queue[:] = []
+
+        for v in range(n):
+            if mate[v] == -1 and label[inblossom[v]] == 0:
+                assign_label(v, 1, -1)
+
+        augmented = False
+        while True:
+            # Slack of each bestedge, valid until the next dual adjustment
+            bestslack[:] = [slack(p) if p != -1 else 0 for p in bestedge]
+            dual_array = np.array(dualvar[:n])
+            while queue and not augmented:
+                v = queue.pop()
+                slack_row = dual_array[v] + dual_array - 2 * weight_row(v)
+
+                # Tight or already allowed edges go through the labelling logic one by one
+                tight = set(np.flatnonzero(slack_row <= 0).tolist())
+                tight.discard(v)
+                allowed[v].update(tight)
+                for w in tight:
+                    allowed[w].add(v)
+                for w in sorted(allowed[v]):
+                    if inblossom[v] == inblossom[w]:
+                        continue
+                    if label[inblossom[w]] == 0:
+                        assign_label(w, 2, w * n + v)
+                    elif label[inblossom[w]] == 1:
+                        base = scan_blossom(v, w)
+                        if base >= 0:
+                            add_blossom(base, v, w)
+                        else:
+                            augment_matching(v, w)
+                            augmented = True
+                            break
+                    elif label[w] == 0:
+                        label[w] = 2
+                        labelend[w] = w * n + v
+                        labels_changed[0] = True
+                if augmented:
+                    break
+
+                # The remaining edges only matter through their least slack
+                if labels_changed[0]:
+                    blossom_of = np.array(inblossom)
+                    top_label = np.array(label)[blossom_of]
+                    unlabelled = np.array(label[:n]) == 0
+                    labels_changed[0] = False
+                loose = blossom_of != inblossom[v]
+                loose[v] = False
+                loose[list(allowed[v])] = False
+
+                to_s = np.flatnonzero(loose & (top_label == 1))
+                if len(to_s):
+                    w = int(to_s[np.argmin(slack_row[to_s])])
+                    kslack = slack_row[w].item()
+                    b = inblossom[v]
+                    if bestedge[b] == -1 or kslack < bestslack[b]:
+                        bestedge[b] = v * n + w
+                        bestslack[b] = kslack
+
+                to_free = np.flatnonzero(loose & (top_label != 1) & unlabelled)
+                if len(to_free):
+                    current = np.where(np.array(bestedge[:n]) == -1, np.inf, bestslack[:n])
+                    for w in to_free[slack_row[to_free] < current[to_free]].tolist():
+                        bestedge[w] = w * n + v
+                        bestslack[w] = slack_row[w].item()
+
+            if augmented:
+                break
+
+            # No augmenting path under the current duals, so compute the dual adjustment
+            deltatype = -1
+            delta = deltaedge = deltablossom = None
+            for v in range(n):
+                if label[inblossom[v]] == 0 and bestedge[v] != -1:
+                    d = slack(bestedge[v])
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 2
+                        deltaedge = bestedge[v]
+            for b in range(2 * n):
+                if blossomparent[b] == -1 and label[b] == 1 and bestedge[b] != -1:
+                    kslack = slack(bestedge[b])
+                    d = kslack // 2 if integer_weights else kslack / 2
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 3
+                        deltaedge = bestedge[b]
+            for b in range(n, 2 * n):
+                if (blossombase[b] >= 0 and blossomparent[b] == -1 and label[b] == 2
+                        and (deltatype == -1 or dualvar[b] < delta)):
+                    delta = dualvar[b]
+                    deltatype = 4
+                    deltablossom = b
+            if deltatype == -1:
+                # Everyone is matched, nothing left to augment
+                break
+
+            for v in range(n):
+                if label[inblossom[v]] == 1:
+                    dualvar[v] -= delta
+                elif label[inblossom[v]] == 2:
+                    dualvar[v] += delta
+            for b in range(n, 2 * n):
+                if blossombase[b] >= 0 and blossomparent[b] == -1:
+                    if label[b] == 1:
+                        dualvar[b] += delta
+                    elif label[b] == 2:
+                        dualvar[b] -= delta
+
+            if deltatype == 2:
+                allow_edge(deltaedge)
+                i, j = divmod(deltaedge, n)
+                if label[inblossom[i]] == 0:
+                    i = j
+                queue.append(i)
+            elif deltatype == 3:
+                allow_edge(deltaedge)
+                queue.append(deltaedge // n)
+            elif deltatype == 4:
+                expand_blossom(deltablossom, False)
+
+        if not augmented:
+            break
+
+        # Expand S-blossoms with zero dual at the end of the stage
+        for b in range(n, 2 * n):
+            if blossomparent[b] == -1 and blossombase[b] >= 0 and label[b] == 1 and dualvar[b] == 0:
+                expand_blossom(b, True)
+
+    mate = [endpoint(p) if p >= 0 else -1 for p in mate[:nvertex]]
+    return [-1 if w >= nvertex else w for w in mate]
@@ -0,0 +1,106 @@
+"""
+Lightweight timing spans for one Lambda invocation.
+
+Code wraps the work it wants measured in `with span('scoring'):`. Spans nest
+per thread, a span opened inside 'outer' is recorded as 'outer/inner'. Every
+span name path accumulates its count, total duration and payload bytes, and
+finish() prints them as a single JSON record:
+
+    {"metric": "invocation", "event_type": "/lunchtag-admin generate", "duration_ms": 5321.4,
+     "spans": {"scoring": {"count": 1, "ms": 120.5, "bytes": 0},
+               "storage.read": {"count": 1002, "ms": 812.0, "bytes": 3250112}, ...}}
+
+Work done in other threads (fan-out workers, background writes) is recorded
+under its own top level names.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_local = threading.local()
+_invocation = {'event_type': None, 'start': time.perf_counter(), 'spans': {}}
+
+
+class Span:
+    """ An open span. Add the size of what it read or sent to bytes. """
+
+    def __init__(self):
+        self.bytes = 0
+
+
+def start_invocation(event_type):
+    """ Forget the spans of the previous invocation of a warm container. """
+    global _invocation
+    with _lock:
+        _invocation = {'event_type': event_type, 'start': time.perf_counter(), 'spans': {}}
+
+
+@contextmanager
+def span(name):
+    """ Time the enclosed block as name, nested under the spans already open in this thread. """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(name)
+    path = '/'.join(stack)
+    current = Span()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        stack.pop()
+        with _lock:
+            totals = _invocation['spans'].setdefault(path, {'count': 0, 'ms': 0.0, 'bytes': 0})
+            totals['count'] += 1
+            totals['ms'] += elapsed
+            totals['bytes'] += current.bytes
+
+
+def elapsed():
+    """ Seconds since the invocation started. """
+    return time.perf_counter() - _invocation['start']
+
+
+def record(**extra):
+    """ The metrics record of the invocation so far. """
+    with _lock:
+        spans = {path: {'count': totals['count'], 'ms': round(totals['ms'], 1), 'bytes': totals['bytes']}
+                 for path, totals in sorted(_invocation['spans'].items())}
+    return {'metric': 'invocation', 'event_type': _invocation['event_type'], 'duration_ms': round(elapsed() * 1000, 1), **extra, 'spans': spans}
+
+
+def finish(**extra):
+    """ Print the invocation's metrics record as one JSON line and return it. """
+    metrics_record = record(**extra)
+    print(json.dumps(metrics_record))
+    return metrics_record
+
+
+def _duration(ms):
+    return f"{ms / 1000:.1f}s" if ms >= 1000 else f"{ms:.0f}ms"
+
+
+def _size(size):
+    return f"{size / 2 ** 20:.1f}MB" if size >= 2 ** 20 else f"{size / 2 ** 10:.0f}KB"
+
+
+def breakdown(top=6):
+    """ Compact summary of the slowest spans, e.g. 'solving 4.2s, storage.read x1002 812ms (3.1MB)'. """
+    spans = record()['spans']
+    parts = []
+    for path, totals in sorted(spans.items(), key=lambda item: -item[1]['ms'])[:top]:
+        part = path + (f" x{totals['count']}" if totals['count'] > 1 else '') + ' ' + _duration(totals['ms'])
+        if totals['bytes']:
+            part += f" ({_size(totals['bytes'])})"
+        parts.append(part)
+    return ', '.join(parts)
+
+
+def slow_path_note(threshold):
+    """ A line to append to an admin reply with the breakdown, if the invocation has taken over threshold seconds. """
+    if elapsed() < threshold:
+        return ''
+    return f"\n:stopwatch: This took {elapsed():.1f}s: {breakdown()}"
@@ -0,0 +1,96 @@
+"""
+The pair history index records every pairing as an unordered pair of user ids,
+with the index of the round they last met in and how many times they have met.
+It is stored as pair_history.json next to the user records, and rebuilt from
+the round partitions of the archive (see archive.py) if it goes missing:
+
+    {"rounds": ["09-04-23", "09-11-23"],
+     "pairs": {"U01,U02": {"last_round": 1, "count": 2}}}
+"""
+import json
+from itertools import combinations
+
+from storage import get_backend, load_users
+from archive import archived_meetings, partition, round_order
+from config import HISTORY_PENALTY, HISTORY_RECENCY_DECAY, PAIR_HISTORY_KEY
+
+
+def pair_key(user1, user2):
+    """ Key of the unordered pair of two users. """
+    return f'{user1},{user2}' if user1 < user2 else f'{user2},{user1}'
+
+
+def new_pair_history():
+    return {'rounds': [], 'pairs': {}}
+
+
+def load_pair_history(user_data=None):
+    """
+    Load the pair history index from storage. If it has not been created yet, it is built from
+    the archived rounds and the history of user_data (every user record when it is None).
+    Errors reading it are raised, so a throttled or denied read doesn't rebuild it from scratch.
+    """
+    body = get_backend().read(PAIR_HISTORY_KEY)
+    if body is None:
+        print("No pair history found, building it from the archive and user data")
+        return build_pair_history(load_users() if user_data is None else user_data, archived_meetings())
+    return json.loads(body.decode('utf-8'))
+
+
+def save_pair_history(pair_history):
+    """ Save the pair history index next to the user records. Errors are raised to the caller, e.g. publish. """
+    get_backend().write(PAIR_HISTORY_KEY, json.dumps(pair_history).encode('utf-8'))
+
+
+def build_pair_history(user_data, archived=()):
+    """
+    Build the index from the date keyed history of every user, including ', ' joined entries,
+    and the (meeting_date, users) meetings archived.
+    """
+    meetings = {}
+    for meeting_date, users in archived:
+        for user1, user2 in combinations(users, 2):
+            meetings.setdefault(meeting_date, set()).add(pair_key(user1, user2))
+    for user_id, data in user_data.items():
+        for meeting_date, partners in data.get('history', {}).items():
+            for partner in partners.split(','):
+                partner = partner.strip()
+                if partner and partner != user_id:
+                    meetings.setdefault(partition(meeting_date), set()).add(pair_key(user_id, partner))
+
+    pair_history = new_pair_history()
+    for meeting_date in sorted(meetings, key=round_order):
+        record_round(pair_history, meeting_date, [key.split(',') for key in meetings[meeting_date]])
+    return pair_history
+
+
+def record_round(pair_history, meeting_date, pairs):
+    """ Record the (user1, user2) pairs that met in the round of meeting_date. Pairs already recorded for that round are skipped. """
+    if meeting_date not in pair_history['rounds']:
+        pair_history['rounds'].append(meeting_date)
+    round_index = pair_history['rounds'].index(meeting_date)
+
+    for user1, user2 in pairs:
+        entry = pair_history['pairs'].setdefault(pair_key(user1, user2), {'last_round': -1, 'count': 0})
+        if entry['last_round'] == round_index:
+            continue
+        entry['last_round'] = max(entry['last_round'], round_index)
+        entry['count'] += 1
+    return pair_history
+
+
+def have_met(pair_history, user1, user2):
+    return pair_key(user1, user2) in pair_history['pairs']
+
+
+def history_penalty(pair_history, user1, user2):
+    """
+    Penalty for pairing two users again. It is HISTORY_PENALTY for a pair that met in the
+    latest round, decaying by HISTORY_RECENCY_DECAY for every round since.
+    """
+    entry = pair_history['pairs'].get(pair_key(user1, user2))
+    if entry is None:
+        return 0
+    rounds_since = len(pair_history['rounds']) - 1 - entry['last_round']
+    return int(round(HISTORY_PENALTY * HISTORY_RECENCY_DECAY ** rounds_since))
+
@@ -1,58 +1,307 @@
 import numpy as np
 import pandas as pd
 from tabulate import tabulate
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
 from datetime import date
+from copy import deepcopy
 from munkres import Munkres
-import boto3
-from botocore.exceptions import NoCredentialsError
 from io import BytesIO, StringIO
-
-from slack_client import send_message
-from user_management import save_users, load_users, update_user_history
-from config import all_blocks, BUCKET_NAME, ADDITIONAL_USERS, AVOID_ADJUSTMENT_WEIGHT, PROMOTE_ADJUSTMENT_WEIGHT, HISTORY_PENALTY, SELF_MATCH_PENALTY
-
-s3 = boto3.client('s3')
-
-def generate_pairings():
-    """ Generate pairings of users based on their compatibility scores. """
-
-    user_data = load_users()
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+import hashlib
+import json
+import re
+import time
+from collections import Counter
+
+from fanout import fan_out, merge_reports, message as slack_message, group_message
+from user_management import save_users, load_users
+from matching import max_weight_matching
+from local_search import local_search_matching, refine_matching
+from grouping import form_groups, group_indexes
+from pair_history import load_pair_history, save_pair_history, record_round, history_penalty
+from archive import archive_round, compact_history, note_partition, partition
+from analytics import score_adjustments, survey_adjustment
+from storage import get_backend, run_in_background, load_roster, roster_indexes
+from metrics import span
+from config import all_blocks, PAIRINGS_KEY, REPORT_FILES, ROUND_KEY, ADDITIONAL_USERS, AVOID_ADJUSTMENT_WEIGHT, PROMOTE_ADJUSTMENT_WEIGHT, SELF_MATCH_PENALTY, MATCHING_ENGINE, BLOSSOM_MAX_USERS, LOCAL_SEARCH_AFTER_SOLVER, ODD_USER_POLICY, PUBLISH_MODE, COHORT_FIELD, COHORT_WORKERS, COHORT_CROSSOVER, GROUP_SIZES, GROUP_SIZE, SURVEY_ADJUSTMENTS, NO_SHOW_PENALTY, PUBLISH_PROGRESS_KEY, PUBLISH_BATCH_SIZE, PUBLISH_TIME_BUDGET
+
+def generate_pairings(by_cohort=False, crossover=COHORT_CROSSOVER, group_size=None):
+    """
+    Generate pairings of users based on their compatibility scores.
+    With by_cohort, members are only paired within their cohort, and with crossover the
+    members left over in odd cohorts are paired with each other across cohorts.
+    With group_size, users are put in groups of that size instead of pairs (see grouping.py).
+    """
+
+    # Only the confirmed members' records are needed, found through the roster's weekly_interest index
+    roster = load_roster()
+    confirmed = roster_indexes(roster)['weekly_interest'].get('confirmed', set())
+    user_data = load_users([user_id for user_id in roster if user_id in confirmed] + (ADDITIONAL_USERS if MATCHING_ENGINE == 'munkres' else []))
+    pair_history = load_pair_history(user_data)
+    adjustments = score_adjustments() if SURVEY_ADJUSTMENTS else None
     users = [user_id for user_id, data in user_data.items() if data["weekly_interest"] == "confirmed"]
-    users += ADDITIONAL_USERS
-    num_users = len(users)
-    compatibility_matrix = np.full((num_users, num_users), -SELF_MATCH_PENALTY)
+    if by_cohort:
+        return generate_cohort_pairings(user_data, users, pair_history, crossover, group_size, adjustments)
+    if MATCHING_ENGINE == 'munkres' and not group_size:
+        users += ADDITIONAL_USERS
+    with span('scoring'):
+        compatibility_matrix = build_compatibility_matrix(user_data, users, pair_history, adjustments)
 
-    for user1_index in range(num_users):
-        for user2_index in range(user1_index + 1, num_users):
-            user1 = users[user1_index]
-            user2 = users[user2_index]
-            compatibility_matrix[user1_index, user2_index] = calculate_score(user_data, user1, user2)
-            compatibility_matrix[user2_index, user1_index] = compatibility_matrix[user1_index, user2_index]
-
-    # Solve the assignment problem
-    m = Munkres()
-    indexes = m.compute(-compatibility_matrix)
+    with span('solving'):
+        indexes = solve_pairings(compatibility_matrix, group_size=group_size)
 
-    final_pairings = compute_final_pairings(user_data, users, compatibility_matrix, indexes)
-    final_df = pd.DataFrame(final_pairings)
+    final_pairings = number_groups(compute_final_pairings(user_data, users, compatibility_matrix, indexes))
+    final_df = with_unpaired(pd.DataFrame(final_pairings), users)
+    # Keep the scores around so swaps don't have to rebuild them
+    run_in_background(save_round, user_data, [users], [compatibility_matrix])
 
     return final_df
 
 
-def calculate_score(user_data, user1, user2):
-    """ Calculate the compatibility score between two users. """
+def cohort_pools(user_data, users):
+    """ Split users into pools by the cohort in their profile, in order of first appearance. """
+    pools = {}
+    for user_id in users:
+        pools.setdefault(user_data[user_id]['profile'].get(COHORT_FIELD) or '', []).append(user_id)
+    return pools
+
+
+def generate_cohort_pairings(user_data, users, pair_history, crossover, group_size=None, adjustments=None):
+    """ Pair every cohort as its own pool, solved in parallel, with crossover pairing the leftovers of odd pools as one more pool. """
+    if MATCHING_ENGINE == 'munkres' and not group_size:
+        raise ValueError("Cohort pools need the 'blossom' or 'local_search' matching engine")
+    pools = list(cohort_pools(user_data, users).values())
+    print(f"Pairing {len(users)} users in {len(pools)} cohorts of {', '.join(str(len(pool)) for pool in pools)}")
+
+    odd_user_policy = 'leftover' if crossover else ODD_USER_POLICY
+    with span('solving cohorts'):
+        results = solve_pools(user_data, pools, pair_history, odd_user_policy, group_size, adjustments)
+
+    matrices = [matrix for matrix, _ in results]
+    pool_indexes = [indexes for _, indexes in results]
+    if crossover:
+        leftovers = [(pool, user_index) for pool, indexes in enumerate(pool_indexes)
+                     for user_index in sorted(set(range(len(pools[pool]))) - {index for pair in indexes for index in pair})]
+        if len(leftovers) > 1:
+            crossover_users = [pools[pool][user_index] for pool, user_index in leftovers]
+            crossover_matrix = build_compatibility_matrix(user_data, crossover_users, pair_history, adjustments)
+            pools.append(crossover_users)
+            matrices.append(crossover_matrix)
+            pool_indexes.append(solve_pairings(crossover_matrix, group_size=group_size))
+    if ODD_USER_POLICY == 'triad':
+        # e.g. the only member of their cohort, or a single leftover with crossover
+        join_pools_leftovers(user_data, pools, matrices, pool_indexes, pair_history, adjustments)
+
+    final_pairings = []
+    for pool_users, matrix, indexes in zip(pools, matrices, pool_indexes):
+        final_pairings += compute_final_pairings(user_data, pool_users, matrix, indexes)
+    run_in_background(save_round, user_data, pools, matrices)
+    return with_unpaired(pd.DataFrame(number_groups(final_pairings)), users)
+
+
+def join_pools_leftovers(user_data, pools, matrices, pool_indexes, pair_history, adjustments=None):
+    """ Add every member their pool left unpaired to the pair they score best with in any pool, as a pool of the three. """
+    paired = {pool_users[index] for pool_users, indexes in zip(pools, pool_indexes) for pair in indexes for index in pair}
+    leftovers = [user_id for pool_users in pools for user_id in pool_users if user_id not in paired]
+    pairs = [(pool_users[user1_index], pool_users[user2_index])
+             for pool_users, indexes in zip(pools, pool_indexes) for user1_index, user2_index in indexes]
+    if not pairs:
+        return
+    for leftover in leftovers:
+        user1, user2 = max(pairs, key=lambda pair: calculate_score(user_data, leftover, pair[0], pair_history, adjustments)
+                                                    + calculate_score(user_data, leftover, pair[1], pair_history, adjustments))
+        pools.append([leftover, user1, user2])
+        matrices.append(build_compatibility_matrix(user_data, pools[-1], pair_history, adjustments))
+        pool_indexes.append([(0, 1), (0, 2)])
+
+
+def with_unpaired(df, users):
+    """ Note the users that have no row in the pairings df in its attrs, for the admin's reply. """
+    paired = set(df['Person 1 ID']) | set(df['Person 2 ID']) if len(df) else set()
+    df.attrs['unpaired'] = [user_id for user_id in dict.fromkeys(users) if user_id not in paired]
+    return df
+
+
+def unpaired_note(df):
+    """ A line for the admin's reply listing the members left without a pairing, if any. """
+    unpaired = df.attrs.get('unpaired', [])
+    if not unpaired:
+        return ''
+    return '\nLeft without a pairing: ' + ', '.join(f'<@{user_id}>' for user_id in unpaired)
+
+
+def _solve_pool(connection, user_data, users, pair_history, odd_user_policy, group_size, adjustments):
+    """ Build and solve one pool's matrix in a child process, sending back (matrix, indexes) or the exception. """
+    try:
+        matrix = build_compatibility_matrix(user_data, users, pair_history, adjustments)
+        connection.send((matrix, solve_pairings(matrix, odd_user_policy=odd_user_policy, group_size=group_size)))
+    except Exception as e:
+        connection.send(e)
+    finally:
+        connection.close()
+
+
+def solve_pools(user_data, pools, pair_history, odd_user_policy=ODD_USER_POLICY, group_size=None, adjustments=None):
+    """ Build and solve the matrix of every pool, COHORT_WORKERS at a time, returning a (matrix, indexes) tuple per pool. """
+    # Plain processes and pipes, Lambda has no /dev/shm for multiprocessing.Pool
+    results = [None] * len(pools)
+    # Largest pools first, so a big one doesn't start last and hold everything up
+    pending = sorted(range(len(pools)), key=lambda pool: -len(pools[pool]))
+    running = {}
+    while pending or running:
+        while pending and len(running) < COHORT_WORKERS:
+            pool = pending.pop(0)
+            receiver, sender = Pipe(duplex=False)
+            process = Process(target=_solve_pool, args=(sender, user_data, pools[pool], pair_history, odd_user_policy, group_size, adjustments))
+            process.start()
+            sender.close()
+            running[receiver] = (pool, process)
+        for receiver in wait(list(running)):
+            pool, process = running.pop(receiver)
+            try:
+                result = receiver.recv()
+            except EOFError:
+                result = RuntimeError(f'The process solving cohort pool {pool} exited with code {process.exitcode}')
+            process.join()
+            if isinstance(result, Exception):
+                for _, other in running.values():
+                    other.terminate()
+                raise result
+            results[pool] = result
+    return results
+
+
+def calculate_score(user_data, user1, user2, pair_history, adjustments=None):
+    """ Calculate the compatibility score between two users, with the survey adjustments if given (see analytics.py). """
     common_interests = set(user_data[user1]['profile']['all_interests']) & set(user_data[user2]['profile']['all_interests'])
     avoid_adjust = AVOID_ADJUSTMENT_WEIGHT *((user1 in user_data[user2]['profile']['avoid_people']) + (user2 in user_data[user1]['profile']['avoid_people']))
     promote_adjust = PROMOTE_ADJUSTMENT_WEIGHT * (((user1 in user_data[user2]['profile']['promoted_people']) or (user2 in user_data[user1]['profile']['promoted_people'])))
-    history_adjust = HISTORY_PENALTY * ((user2 in user_data[user1]['history'].values()) or (user1 in user_data[user2]['history'].values()))
+    history_adjust = history_penalty(pair_history, user1, user2)
     self_match_adjust = SELF_MATCH_PENALTY * (user1 == user2)
+    survey_adjust = survey_adjustment(adjustments, user1, user2, common_interests)
     
-    score = len(common_interests) + promote_adjust - avoid_adjust - history_adjust - self_match_adjust
+    score = len(common_interests) + promote_adjust - avoid_adjust - history_adjust - self_match_adjust + survey_adjust
     return score
 
 
+def build_compatibility_matrix(user_data, users, pair_history, adjustments=None):
+    """
+    Build the full compatibility matrix for the given users in one pass.
+    Interests, avoid/promote lists, pair history and survey adjustments are encoded once as index arrays,
+    then every pair is scored with batched NumPy operations into a single int32 matrix. Off-diagonal entries
+    match calculate_score exactly, the diagonal is -SELF_MATCH_PENALTY.
+    """
+    # Users can appear more than once (ADDITIONAL_USERS), so score by distinct id, in order of first appearance
+    distinct_ids = list(dict.fromkeys(users))
+    id_index = {user_id: index for index, user_id in enumerate(distinct_ids)}
+    num_distinct = len(distinct_ids)
+
+    # Interest membership as a user x interest matrix
+    interest_index = {}
+    interest_rows, interest_cols = [], []
+    for row, user_id in enumerate(distinct_ids):
+        for interest in set(user_data[user_id]['profile']['all_interests']):
+            interest_rows.append(row)
+            interest_cols.append(interest_index.setdefault(interest, len(interest_index)))
+    interests = np.zeros((num_distinct, len(interest_index)), dtype=np.int32)
+    interests[interest_rows, interest_cols] = 1
+
+    # relation[i, j] is True when user i lists user j under the given field
+    def relation(get_targets):
+        rows, cols = [], []
+        for row, user_id in enumerate(distinct_ids):
+            for target in get_targets(user_data[user_id]):
+                if target in id_index:
+                    rows.append(row)
+                    cols.append(id_index[target])
+        matrix = np.zeros((num_distinct, num_distinct), dtype=bool)
+        matrix[rows, cols] = True
+        return matrix
+
+    # Every term is added to the common interests in place, so only one int32 matrix is ever allocated
+    scores = interests @ interests.T
+    promote = relation(lambda data: set(data['profile']['promoted_people']))
+    promote |= promote.T
+    np.add(scores, PROMOTE_ADJUSTMENT_WEIGHT, out=scores, where=promote)
+    del promote
+    avoid = relation(lambda data: set(data['profile']['avoid_people']))
+    np.subtract(scores, AVOID_ADJUSTMENT_WEIGHT, out=scores, where=avoid)
+    np.subtract(scores, AVOID_ADJUSTMENT_WEIGHT, out=scores, where=avoid.T)
+    del avoid
+
+    for key in pair_history['pairs']:
+        user1, user2 = key.split(',')
+        if user1 in id_index and user2 in id_index:
+            penalty = history_penalty(pair_history, user1, user2)
+            scores[id_index[user1], id_index[user2]] -= penalty
+            scores[id_index[user2], id_index[user1]] -= penalty
+
+    if adjustments:
+        interest_points = np.array([adjustments['interests'].get(interest, 0) for interest in interest_index], dtype=np.int32)
+        scores += (interests * interest_points) @ interests.T
+        for key, points in adjustments['pairs'].items():
+            user1, user2 = key.split(',')
+            if user1 in id_index and user2 in id_index:
+                scores[id_index[user1], id_index[user2]] += points
+                scores[id_index[user2], id_index[user1]] += points
+        no_show = np.array([user_id in adjustments['no_shows'] for user_id in distinct_ids], dtype=bool)
+        shows = ~no_show
+        for member in np.flatnonzero(no_show):
+            scores[member, shows] -= NO_SHOW_PENALTY
+            scores[shows, member] -= NO_SHOW_PENALTY
+
+    # A user listed twice pairs with their own copy at -SELF_MATCH_PENALTY on top of their score with themselves
+    scores[np.diag_indices(num_distinct)] -= SELF_MATCH_PENALTY
+    if num_distinct < len(users):
+        scores = scores[np.ix_(*2 * [[id_index[user_id] for user_id in users]])]
+    np.fill_diagonal(scores, -SELF_MATCH_PENALTY)
+    return scores
+
+
+def solve_pairings(compatibility_matrix, engine=MATCHING_ENGINE, odd_user_policy=ODD_USER_POLICY, group_size=None):
+    """
+    Pick the pairs that maximize the total compatibility score, or with group_size, the groups
+    that maximize the summed score of their pairs.
+    Returns a list of (user1_index, user2_index) tuples, as consumed by compute_final_pairings.
+    """
+    if group_size:
+        groups, _ = form_groups(compatibility_matrix, group_size)
+        return group_indexes(groups)
+
+    if engine == 'munkres':
+        # Bipartite solver, relies on ADDITIONAL_USERS and SELF_MATCH_PENALTY to pad the matrix
+        return Munkres().compute(-compatibility_matrix)
+
+    if engine == 'blossom' and len(compatibility_matrix) > BLOSSOM_MAX_USERS:
+        print(f'{len(compatibility_matrix)} users are more than BLOSSOM_MAX_USERS, pairing them with local_search')
+        engine = 'local_search'
+    if engine == 'blossom':
+        mate = max_weight_matching(compatibility_matrix)
+        if LOCAL_SEARCH_AFTER_SOLVER:
+            mate, _ = refine_matching(compatibility_matrix, mate)
+    elif engine == 'local_search':
+        mate = local_search_matching(compatibility_matrix)
+    else:
+        raise ValueError(f"Unknown matching engine: {engine}")
+
+    indexes = [(user1_index, user2_index) for user1_index, user2_index in enumerate(mate) if user1_index < user2_index]
+
+    leftovers = [user_index for user_index, partner in enumerate(mate) if partner == -1]
+    for leftover in leftovers:
+        if odd_user_policy == 'triad' and indexes:
+            indexes = join_best_pair(compatibility_matrix, indexes, leftover)
+        else:
+            print(f'User at index {leftover} was left without a pairing')
+
+    return indexes
+
+
+def join_best_pair(compatibility_matrix, indexes, leftover):
+    """ Add leftover to the pair they get along with best, as two extra 1x1s. """
+    user1_index, user2_index = max(indexes, key=lambda pair: compatibility_matrix[leftover, pair[0]] + compatibility_matrix[leftover, pair[1]])
+    return indexes + [tuple(sorted((leftover, user1_index))), tuple(sorted((leftover, user2_index)))]
+
+
 def compute_final_pairings(user_data, users, compatibility_matrix, indexes):
     """ Generate the final pairings given the assignment of users. """
     final_pairings = []
@@ -78,305 +327,364 @@ def compute_final_pairings(user_data, users, compatibility_matrix, indexes):
     return final_pairings
 
 
-def swap_pairings(command):
-    """ Swap pairings based on the passed command and recalculate scores. """
-    # Parse the command to get the corresponding row and column indices
-    tokens = command[command.find('[')+1:].split(',')
-    row1, cols1 = int(tokens[0][1]), [0,3,6] if tokens[0][0].upper() == 'A' else [1,4,7]
-    row2, cols2 = int(tokens[1][1]), [0,3,6] if tokens[1][0].upper() == 'A' else [1,4,7]
-
-    # Create a new DataFrame to store the updated pairings
-    s3_object = s3.get_object(Bucket='lunchtag-slack-bot-user-data', Key='pairings_full.xlsx')
-    df = pd.read_excel(BytesIO(s3_object['Body'].read()))
-    new_df = df.copy()
-    user_data = load_users()
-
-    # Swap the users according to the specified row and column indices
-    new_df.iloc[row1, cols1], new_df.iloc[row2, cols2] = new_df.iloc[row2, cols2], new_df.iloc[row1, cols1]
-
-    # Recalculate the score for the swapped rows
-    for row in [row1, row2]:
-        user1, user2 = new_df.iloc[row, -2], new_df.iloc[row, -1]
-        score, common_interests = calculate_score(user_data, user1, user2)
-        new_df.iloc[row, 2] = score
-        new_df.iloc[row, 5] = ', '.join(common_interests)
-        
-    return new_df
-
-
-def save_pairings(df):
-    print('saving df...')
-    # df.to_excel("pairings_full.xlsx", index=False)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False)
-    output.seek(0)
-    s3.put_object(Body=output, Bucket='lunchtag-slack-bot-user-data', Key='pairings_full.xlsx')
-    
-    return
+def number_groups(final_pairings):
+    """ Number the groups of the pairings in a 'Group' field, shared by the pairs of a triad or larger group. """
+    group_of = {}
+    for row in final_pairings:
+        user1, user2 = row['Person 1 ID'], row['Person 2 ID']
+        group1, group2 = group_of.get(user1), group_of.get(user2)
+        if group1 is None and group2 is None:
+            group_of[user1] = group_of[user2] = {user1, user2}
+        elif group1 is None or group2 is None or group1 is not group2:
+            # Merge whatever the two users are already in
+            merged = (group1 or set()) | (group2 or set()) | {user1, user2}
+            for user_id in merged:
+                group_of[user_id] = merged
+    numbers = {}
+    for row in final_pairings:
+        row['Group'] = numbers.setdefault(id(group_of[row['Person 1 ID']]), len(numbers) + 1)
+    return final_pairings
 
 
-def read_pairings(text='tiny'):
-    
-    if text == None:
-        text='tiny'
-    
-    s3_object = s3.get_object(Bucket='lunchtag-slack-bot-user-data', Key='pairings_full.xlsx')
-    final_df = pd.read_excel(BytesIO(s3_object['Body'].read()))
-        
-    # final_df = pd.read_excel("pairings_full.xlsx")
-    if 'full' in text:
-        return "pairings_full.xlsx"
-
-    elif 'short' in text:
-        short_df = final_df.copy()[final_df.columns[0:5]]
-        short_df_text = tabulate(short_df, tablefmt="grid", headers=short_df.columns)
-        short_df = pd.DataFrame.from_dict([{'Summary': short_df_text}])
-        # short_df.to_csv("pairings_short.csv", index=False)
-        csv_buffer = StringIO()
-        short_df.to_csv(csv_buffer, index=False)
-        s3.put_object(Body=csv_buffer.getvalue(), Bucket='lunchtag-slack-bot-user-data', Key='pairings_short.csv')
-       
-        return "pairings_short.csv"
-    
-    tiny_df = final_df.copy()[final_df.columns[0:2]]
-    tiny_df_text = tabulate(tiny_df, tablefmt="grid", headers=tiny_df.columns)
-    tiny_df = pd.DataFrame.from_dict([{'Summary': tiny_df_text}])
-    #tiny_df.to_csv("pairings_tiny.csv", index=False)
-    csv_buffer = StringIO()
-    tiny_df.to_csv(csv_buffer, index=False)
-    s3.put_object(Body=csv_buffer.getvalue(), Bucket='lunchtag-slack-bot-user-data', Key='pairings_tiny.csv')
-   
-    return "pairings_tiny.csv"
+def group_size_of(text):
+    """ The group size asked for by 'generate groups K', or None for pairs. """
+    match = re.search(r'\bgroups?\s*(\d*)', text or '')
+    if match is None:
+        return None
+    group_size = int(match.group(1) or GROUP_SIZE)
+    if group_size not in GROUP_SIZES:
+        raise ValueError(f"Groups can have {GROUP_SIZES[0]} to {GROUP_SIZES[-1]} people, not {group_size}")
+    return group_size
 
 
-def publish_and_send_dm():
-    user_data = load_users()
-    meeting_date = date.today().strftime("%m-%d-%y")
+def save_round(user_data, pools, matrices):
+    """ Save the users and matrix of every solved pool and each user's name and interests, for swaps to re-score from. """
+    users = [user_id for pool in pools for user_id in pool]
+    interests = sorted({interest for user_id in set(users) for interest in user_data[user_id]['profile']['all_interests']})
+    interest_index = {interest: index for index, interest in enumerate(interests)}
+    membership = np.zeros((len(users), len(interests)), dtype=bool)
+    for row, user_id in enumerate(users):
+        membership[row, [interest_index[interest] for interest in user_data[user_id]['profile']['all_interests']]] = True
 
-    s3_object = s3.get_object(Bucket='lunchtag-slack-bot-user-data', Key='pairings_full.xlsx')
-    df = pd.read_excel(BytesIO(s3_object['Body'].read()))
-
-    file_name = 'pairings_full' + meeting_date + '.xlsx'
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False)
-    output.seek(0)
-    s3.put_object(Body=output, Bucket='lunchtag-slack-bot-user-data', Key=file_name)
-
-    for index, row in df.iterrows():
-        user1_id = row['Person 1 ID']
-        user1_real_name = row['Person 1']
-        user2_id = row['Person 2 ID']
-        user2_real_name = row['Person 2']
-        shared_interests = row['Common Interests']
-
-        message_to_user1 = f"Hi {user1_real_name}, you've been paired up for LunchTag with <@{user2_id}>! \
-                            You both share interests in {shared_interests}. Please initiate the conversation \
-                            and plan a meetup. Enjoy!"
-        message_to_user2 = f"Hi {user2_real_name}, you've been paired up for LunchTag with <@{user1_id}>! \
-                            You both share interests in {shared_interests}. Please initiate the conversation \
-                            and plan a meetup. Enjoy!"
-
-        send_message(user1_id, message_to_user1)
-        send_message(user2_id, message_to_user2)
-        send_message(user1_id, "Before the next Lunchtag pairings, please complete the survey below!", 
-                      blocks=all_blocks['survey'])
-        send_message(user2_id, "Before the next Lunchtag pairings, please complete the survey below!", 
-                      blocks=all_blocks['survey'])
-
-        user_data[user1_id]['history'][meeting_date] = ", " + user2_id if meeting_date in user_data[user1_id]['history'].keys() else user2_id
-        user_data[user2_id]['history'][meeting_date] = ", " + user1_id if meeting_date in user_data[user2_id]['history'].keys() else user1_id
-
+    np.savez_compressed(output, users=np.array(users, dtype=str), names=np.array([user_data[user_id]['real_name'] for user_id in users], dtype=str),
+                        pool_sizes=np.array([len(pool) for pool in pools], dtype=np.int64), interests=np.array(interests, dtype=str), membership=membership,
+                        **{f'matrix_{pool}': matrix.astype(np.int32, copy=False) for pool, matrix in enumerate(matrices)})
+    get_backend().write(ROUND_KEY, output.getvalue())
+
+
+def load_round():
+    """ The cached round saved by save_round, or None for pairings generated before it existed. """
+    body = get_backend().read(ROUND_KEY)
+    if body is None:
+        return None
+    with np.load(BytesIO(body)) as saved:
+        round_cache = {name: saved[name] for name in saved.files}
+    users = round_cache['users'].tolist()
+    round_cache['index'] = {}
+    for row, user_id in enumerate(users):
+        round_cache['index'].setdefault(user_id, row)
+    # {user_id: row in the pool's matrix} of every pool
+    round_cache['pools'] = []
+    start = 0
+    for size in round_cache['pool_sizes'].tolist():
+        pool_index = {}
+        for row, user_id in enumerate(users[start:start + size]):
+            pool_index.setdefault(user_id, row)
+        round_cache['pools'].append(pool_index)
+        start += size
+    return round_cache
+
+
+def round_score(round_cache, user1, user2):
+    """ The cached score of two users, or None if no pool of the round had both of them. """
+    for pool, pool_index in enumerate(round_cache['pools']):
+        if user1 in pool_index and user2 in pool_index:
+            return int(round_cache[f'matrix_{pool}'][pool_index[user1], pool_index[user2]])
+    return None
 
-    save_users(user_data)
 
-    print('Done sending dms!')
+def swap_pairings(command):
+    """
+    Apply swaps like 'swap [A1,B2] [A3,B4]' (Person 1 of row 1 with Person 2 of row 2) to the saved pairings, re-scored from the saved round.
+    Returns the new pairings and the change of the total score.
+    """
+    swaps = re.findall(r'\[\s*([AB])\s*(\d+)\s*,\s*([AB])\s*(\d+)\s*\]', command, re.IGNORECASE)
+    if not swaps:
+        raise ValueError(f"No swaps like [A1, B2] found in: {command}")
+
+    rows = load_pairings()
+    round_cache = load_round()
+    user_data = pair_history = adjustments = None
+
+    # Rows of a triad or larger group are the pairs within it, so their members can't be swapped one row at a time
+    group_rows = Counter(row.get('Group') for row in rows)
+    changed = set()
+    for side1, row1, side2, row2 in swaps:
+        row1, row2 = int(row1), int(row2)
+        for row in (row1, row2):
+            if not 0 <= row < len(rows):
+                raise ValueError(f"There is no pairing in row {row}")
+            if rows[row].get('Group') is not None and group_rows[rows[row]['Group']] > 1:
+                raise ValueError(f"Row {row} is part of group {rows[row]['Group']}, only pairs can be swapped")
+        person1 = 'Person 1' if side1.upper() == 'A' else 'Person 2'
+        person2 = 'Person 1' if side2.upper() == 'A' else 'Person 2'
+        for field in ('', ' Interests', ' ID'):
+            rows[row1][person1 + field], rows[row2][person2 + field] = rows[row2][person2 + field], rows[row1][person1 + field]
+        changed.update((row1, row2))
+
+    score_change = 0
+    for row in sorted(changed):
+        user1, user2 = rows[row]['Person 1 ID'], rows[row]['Person 2 ID']
+        score = round_score(round_cache, user1, user2) if round_cache is not None else None
+        if score is not None:
+            index1, index2 = round_cache['index'][user1], round_cache['index'][user2]
+            common_interests = round_cache['interests'][round_cache['membership'][index1] & round_cache['membership'][index2]].tolist()
+        else:
+            # Pairings generated before rounds were cached, or users from different cohorts: score from the user records
+            if user_data is None:
+                user_data = load_users([row[person + ' ID'] for row in rows for person in ('Person 1', 'Person 2')])
+                pair_history = load_pair_history(user_data)
+                adjustments = score_adjustments() if SURVEY_ADJUSTMENTS else None
+            score = calculate_score(user_data, user1, user2, pair_history, adjustments)
+            common_interests = list(set(user_data[user1]['profile']['all_interests']) & set(user_data[user2]['profile']['all_interests']))
+        score_change += score - rows[row]['Score']
+        rows[row]['Score'] = score
+        rows[row]['Common Interests'] = ', '.join(common_interests)
 
+    return pd.DataFrame(rows), score_change
 
 
+def dump_pairings(df):
+    """ Encode pairings as JSON lines, one pair per line with both ids, names, interests and the score. """
+    return df.to_json(orient='records', lines=True).encode('utf-8')
 
 
+def parse_pairings(body):
+    """ Decode JSON lines pairings into a list of row dicts, in the saved order. """
+    return [json.loads(line) for line in body.decode('utf-8').splitlines() if line]
 
-"""
-def generate_pairings():
-    user_data = load_users()
-    additional_users = ['U03UFPNSDT6','U03UFPNSDT6','U03UFPNSDT6']
 
-    users = [user_id for user_id, data in user_data.items() if data["weekly_interest"] == "confirmed"]
-    users += additional_users
-    num_users = len(users)
-    compatibility_matrix = np.zeros((num_users, num_users))-10000
+def save_pairings(df, view='tiny'):
+    """ Save the pairings and their reports, returning the requested view as (file_name, content) and storing the others in the background. """
+    print('saving df...')
+    get_backend().write(PAIRINGS_KEY, dump_pairings(df))
 
-    for i in range(num_users):
-        for j in range(i + 1, num_users):
-            user1 = users[i]
-            user2 = users[j]
+    content = render_report(df, view)
+    run_in_background(get_backend().write, REPORT_FILES[view], content)
+    for other_view in REPORT_FILES:
+        if other_view != view:
+            run_in_background(_store_report, df, other_view)
+    return REPORT_FILES[view], content
 
-            common_interests = list(set(user_data[user1]['profile']['all_interests']) & set(user_data[user2]['profile']['all_interests']))
-            avoid_adjust = ((user1 in user_data[user2]['profile']['avoid_people']) + (user2 in user_data[user1]['profile']['avoid_people'])) * 1000
-            promote_adjust = ((user1 in user_data[user2]['profile']['promoted_people']) + (user2 in user_data[user1]['profile']['promoted_people'])) * 10
-            
-            score = len(common_interests) + promote_adjust - avoid_adjust
-
-            if user2 in user_data[user1]['history'].values() and user1 in user_data[user2]['history'].values():
-                score -= 100
-            
-            if user1 == user2:
-                score -= 10000
-
-            compatibility_matrix[i, j] = score
-            compatibility_matrix[j, i] = score
-
-    # row_ind, col_ind = linear_sum_assignment(-compatibility_matrix)
-    m = Munkres()
-    indexes = m.compute(-compatibility_matrix)
-    print(compatibility_matrix)
-    print(indexes)
 
-    final_pairings = []
-    for i, j in indexes:
-        if i < j:
-            user1 = users[i]
-            user2 = users[j]
-            common_interests = list(set(user_data[user1]['profile']['all_interests']) & set(user_data[user2]['profile']['all_interests']))
-            score = compatibility_matrix[i, j]
+def load_pairings():
+    """ The saved pairings as a list of row dicts. """
+    body = get_backend().read(PAIRINGS_KEY)
+    return parse_pairings(body) if body is not None else []
 
-            final_pairings.append({
-                'Person 1': user_data[user1]['real_name'],
-                'Person 2': user_data[user2]['real_name'],
-                'Score': score,
-                'Person 1 Interests': ', '.join(user_data[user1]['profile']['all_interests']),
-                'Person 2 Interests': ', '.join(user_data[user2]['profile']['all_interests']),
-                'Common Interests': ', '.join(common_interests),
-                'Person 1 ID': user1,
-                'Person 2 ID': user2
-            })
 
-    final_df = pd.DataFrame(final_pairings)
-    return final_df
+def report_view(text):
+    """ The report view an admin command asks for: 'full', 'short' or the default 'tiny'. """
+    if text is None:
+        return 'tiny'
+    if 'full' in text:
+        return 'full'
+    if 'short' in text:
+        return 'short'
+    return 'tiny'
+
+
+def render_report(df, view):
+    """ Render one view of the pairings: Excel for 'full', a tabulate grid in a one cell CSV otherwise. """
+    with span('rendering.' + view) as render_span:
+        content = _render(df, view)
+        render_span.bytes += len(content)
+    return content
+
+
+def _render(df, view):
+    if view == 'full':
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False)
+        return output.getvalue()
+
+    columns = 5 if view == 'short' else 2
+    view_df = df.copy()[df.columns[0:columns]]
+    view_df_text = tabulate(view_df, tablefmt="grid", headers=view_df.columns)
+    view_df = pd.DataFrame.from_dict([{'Summary': view_df_text}])
+    csv_buffer = StringIO()
+    view_df.to_csv(csv_buffer, index=False)
+    return csv_buffer.getvalue().encode('utf-8')
 
 
-def swap_pairings(command):
-    # Parse the command to get the corresponding row and column indices
-    tokens = command[command.find('[')+1:].split(',')
-    row1, cols1 = int(tokens[0][1]), [0,3,6] if tokens[0][0].upper() == 'A' else [1,4,7]
-    row2, cols2 = int(tokens[1][1]), [0,3,6] if tokens[1][0].upper() == 'A' else [1,4,7]
-
-    # Create a new DataFrame to store the updated pairingsmm
-    s3_object = s3.get_object(Bucket='lunchtag-slack-bot-user-data', Key='pairings_full.xlsx')
-    df = pd.read_excel(BytesIO(s3_object['Body'].read()))
-    new_df = df.copy()
-    user_data = load_users()
-
-    # Swap the users according to the specified row and column indices
-    new_df.iloc[row1, cols1], new_df.iloc[row2, cols2] = new_df.iloc[row2, cols2], new_df.iloc[row1, cols1]
-
-    for row in [row1, row2]:
-        user1, user2 = new_df.iloc[row, -2], new_df.iloc[row, -1]
-        common_interests = list(set(user_data[user1]['profile']['all_interests']) & set(user_data[user2]['profile']['all_interests']))
-        avoid_adjust = ((user1 in user_data[user2]['profile']['avoid_people']) + (user2 in user_data[user1]['profile']['avoid_people'])) * 1000
-        promote_adjust = ((user1 in user_data[user2]['profile']['promoted_people']) + (user2 in user_data[user1]['profile']['promoted_people'])) * 10
-        
-        score = len(common_interests) + promote_adjust - avoid_adjust
-        if user2 in user_data[user1]['history'].values() and user1 in user_data[user2]['history'].values():
-            score -= 100
-        new_df.iloc[row, 2] = score
-        new_df.iloc[row, 5] = ', '.join(common_interests)
-        
-    return new_df
-
-
-def save_pairings(df):
-    print('saving df...')
-    # df.to_excel("pairings_full.xlsx", index=False)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False)
-    output.seek(0)
-    s3.put_object(Body=output, Bucket='lunchtag-slack-bot-user-data', Key='pairings_full.xlsx')
-    
-    return
+def _store_report(df, view):
+    get_backend().write(REPORT_FILES[view], render_report(df, view))
 
 
 def read_pairings(text='tiny'):
-    
-    if text == None:
-        text='tiny'
-    
-    s3_object = s3.get_object(Bucket='lunchtag-slack-bot-user-data', Key='pairings_full.xlsx')
-    final_df = pd.read_excel(BytesIO(s3_object['Body'].read()))
-        
-    # final_df = pd.read_excel("pairings_full.xlsx")
-    if 'full' in text:
-        return "pairings_full.xlsx"
-
-    elif 'short' in text:
-        short_df = final_df.copy()[final_df.columns[0:5]]
-        short_df_text = tabulate(short_df, tablefmt="grid", headers=short_df.columns)
-        short_df = pd.DataFrame.from_dict([{'Summary': short_df_text}])
-        # short_df.to_csv("pairings_short.csv", index=False)
-        csv_buffer = StringIO()
-        short_df.to_csv(csv_buffer, index=False)
-        s3.put_object(Body=csv_buffer.getvalue(), Bucket='lunchtag-slack-bot-user-data', Key='pairings_short.csv')
-       
-        return "pairings_short.csv"
-    
-    tiny_df = final_df.copy()[final_df.columns[0:2]]
-    tiny_df_text = tabulate(tiny_df, tablefmt="grid", headers=tiny_df.columns)
-    tiny_df = pd.DataFrame.from_dict([{'Summary': tiny_df_text}])
-    #tiny_df.to_csv("pairings_tiny.csv", index=False)
-    csv_buffer = StringIO()
-    tiny_df.to_csv(csv_buffer, index=False)
-    s3.put_object(Body=csv_buffer.getvalue(), Bucket='lunchtag-slack-bot-user-data', Key='pairings_tiny.csv')
-   
-    return "pairings_tiny.csv"
+    """ The requested report of the saved pairings as (file_name, content), rendered when they were saved. """
+    view = report_view(text)
+    content = get_backend().read(REPORT_FILES[view])
+    if content is None:
+        # Pairings saved before reports were stored alongside them
+        content = render_report(pd.DataFrame(load_pairings()), view)
+    return REPORT_FILES[view], content
 
 
 def publish_and_send_dm():
-    user_data = load_users()
-    meeting_date = date.today().strftime("%m-%d-%y")
-    survey_block = all_blocks['survey']
-    file_name = 'pairings_full' + meeting_date + '.xlsx'
-
-    s3_object = s3.get_object(Bucket='lunchtag-slack-bot-user-data', Key='pairings_full.xlsx')
-    df = pd.read_excel(BytesIO(s3_object['Body'].read()))
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False)
-    output.seek(0)
-    s3.put_object(Body=output, Bucket='lunchtag-slack-bot-user-data', Key=file_name)
-    
-    
-    user_data = load_users()
-
-    for index, row in df.iterrows():
-        user1_id = row['Person 1 ID']
-        user1_real_name = row['Person 1']
-        user2_id = row['Person 2 ID']
-        user2_real_name = row['Person 2']
-        shared_interests = row['Common Interests']
-        message_to_user1 = f"Hi {user1_real_name}, you've been paired up for LunchTag with <@{user2_id}>! You both share interests in {shared_interests}. Please initiate the conversation and plan a meetup. Enjoy!"
-        message_to_user2 = f"Hi {user2_real_name}, you've been paired up for LunchTag with <@{user1_id}>! You both share interests in {shared_interests}. Please initiate the conversation and plan a meetup. Enjoy!"
-        
-
-        send_message(user1_id, message_to_user1)
-        send_message(user2_id, message_to_user2)
-        
-        send_message(user1_id, "Before the next Lunchtag pairings, please complete the survey below!", blocks = all_blocks['survey'])
-        send_message(user2_id, "Before the next Lunchtag pairings, please complete the survey below!", blocks = all_blocks['survey'])
-        
-        # Update user history
-        # update_user_history(user1_id, user_data[user1_id]['real_name'], user2_id, user_data[user2_id]['real_name'], meeting_date)
-        
-        user_data[user1_id]['history'][meeting_date] = user_data[user1_id]['history'].setdefault(meeting_date, "")
-        user_data[user1_id]['history'][meeting_date] += user2_id
-
-        user_data[user2_id]['history'][meeting_date] = user_data[user2_id]['history'].setdefault(meeting_date, "")
-        user_data[user2_id]['history'][meeting_date] += user1_id
-        
-    save_users(user_data)
-        
+    """ DM every group their intro and survey in batches until PUBLISH_TIME_BUDGET, recording the round once all are sent. Returns (report, groups left). """
+    started = time.monotonic()
+    body = get_backend().read(PAIRINGS_KEY)
+    if body is None:
+        print('No pairings to publish, generate them first')
+        return {}, 0
+    progress = load_publish_progress(body)
+    if progress['recorded']:
+        print('These pairings have already been published, generate new ones first')
+        return {}, 0
+
+    rows = parse_pairings(body)
+    groups = publish_groups(rows)
+    sent = set(progress['sent'])
+    pending = [index for index in range(len(groups)) if index not in sent]
+
+    report = {}
+    for start in range(0, len(pending), PUBLISH_BATCH_SIZE):
+        if time.monotonic() - started > PUBLISH_TIME_BUDGET:
+            break
+        batch = pending[start:start + PUBLISH_BATCH_SIZE]
+        deliveries = []
+        for index in batch:
+            deliveries += pair_deliveries(groups[index][0]) if len(groups[index]) == 1 else group_deliveries(groups[index])
+        merge_reports(report, fan_out(deliveries))
+        progress['sent'] += batch
+        save_publish_progress(progress)
+
+    remaining = len(groups) - len(progress['sent'])
+    if remaining:
+        print(f'{remaining} groups left to send, publish again to send them')
+        return report, remaining
+
+    record_published_round(rows, body, progress['date'])
+    progress['recorded'] = True
+    save_publish_progress(progress)
     print('Done sending dms!')
-
-"""
\ No newline at end of file
+    return report, 0
+
+
+def load_publish_progress(body):
+    """ The publish progress of the pairings in body, a new one if they haven't been published from yet. """
+    digest = hashlib.sha1(body).hexdigest()
+    stored = get_backend().read(PUBLISH_PROGRESS_KEY)
+    progress = json.loads(stored.decode('utf-8')) if stored is not None else None
+    if progress is None or progress['pairings'] != digest:
+        progress = {'pairings': digest, 'date': date.today().strftime("%m-%d-%y"), 'sent': [], 'recorded': False}
+    return progress
+
+
+def save_publish_progress(progress):
+    get_backend().write(PUBLISH_PROGRESS_KEY, json.dumps(progress).encode('utf-8'))
+
+
+def record_published_round(rows, body, meeting_date):
+    """ Record the published round in the user records, the pair history and the archive, skipping what is already recorded. """
+    # Archive this round's pairings as they were published
+    run_in_background(get_backend().write, 'pairings_' + meeting_date + '.jsonl', body)
+
+    pairs = [(row['Person 1 ID'], row['Person 2 ID']) for row in rows]
+    user_data = load_users([user_id for pair in pairs for user_id in pair])
+    pair_history = load_pair_history()
+
+    for user1_id, user2_id in pairs:
+        for user_id, partner_id in ((user1_id, user2_id), (user2_id, user1_id)):
+            history = user_data[user_id]['history']
+            if meeting_date not in history:
+                history[meeting_date] = partner_id
+            elif partner_id not in [partner.strip() for partner in history[meeting_date].split(',')]:
+                history[meeting_date] += ", " + partner_id
+    record_round(pair_history, meeting_date, pairs)
+
+    # The round goes to the archive, so the records only keep the partners of their last few rounds
+    archive_round(meeting_date, pairs)
+    for record in user_data.values():
+        note_partition(record, partition(meeting_date))
+        compact_history(record)
+    save_users(user_data, complete=False)
+    save_pair_history(pair_history)
+
+
+def publish_groups(rows):
+    """ The rows of the pairings grouped by their 'Group', in order. Pairings saved without groups are one row each. """
+    groups = {}
+    for position, row in enumerate(rows):
+        groups.setdefault(row.get('Group', -position), []).append(row)
+    return list(groups.values())
+
+
+def pair_deliveries(row):
+    """ The intro and survey messages of a pair. """
+    user1_id = row['Person 1 ID']
+    user1_real_name = row['Person 1']
+    user2_id = row['Person 2 ID']
+    user2_real_name = row['Person 2']
+    shared_interests = row['Common Interests']
+
+    if PUBLISH_MODE == 'group_dm':
+        group_intro = f"Hi <@{user1_id}> and <@{user2_id}>, you've been paired up for LunchTag! \
+                            You both share interests in {shared_interests}. Use this conversation \
+                            to plan a meetup. Enjoy!"
+        return [group_message([user1_id, user2_id], group_intro, blocks=shared_survey_blocks(group_intro))]
+
+    message_to_user1 = f"Hi {user1_real_name}, you've been paired up for LunchTag with <@{user2_id}>! \
+                            You both share interests in {shared_interests}. Please initiate the conversation \
+                            and plan a meetup. Enjoy!"
+    message_to_user2 = f"Hi {user2_real_name}, you've been paired up for LunchTag with <@{user1_id}>! \
+                            You both share interests in {shared_interests}. Please initiate the conversation \
+                            and plan a meetup. Enjoy!"
+    return [slack_message(user1_id, message_to_user1),
+            slack_message(user2_id, message_to_user2),
+            slack_message(user1_id, "Before the next Lunchtag pairings, please complete the survey below!", 
+                          blocks=all_blocks['survey']),
+            slack_message(user2_id, "Before the next Lunchtag pairings, please complete the survey below!", 
+                          blocks=all_blocks['survey'])]
+
+
+def group_deliveries(group_rows):
+    """ The intro and survey messages of a triad or larger group, given the rows of its pairs. """
+    names = {}
+    for row in group_rows:
+        names[row['Person 1 ID']] = row['Person 1']
+        names[row['Person 2 ID']] = row['Person 2']
+    members = list(names)
+    shared_interests = ', '.join(sorted({interest for row in group_rows for interest in row['Common Interests'].split(', ') if interest}))
+
+    def mentions(user_ids):
+        user_ids = [f'<@{user_id}>' for user_id in user_ids]
+        return ', '.join(user_ids[:-1]) + ' and ' + user_ids[-1] if len(user_ids) > 1 else user_ids[0]
+
+    if PUBLISH_MODE == 'group_dm':
+        group_intro = f"Hi {mentions(members)}, you've been grouped up for LunchTag! \
+                        Between you, you share interests in {shared_interests}. Use this conversation \
+                        to plan a meetup. Enjoy!"
+        return [group_message(members, group_intro, blocks=shared_survey_blocks(group_intro))]
+    deliveries = []
+    for user_id in members:
+        message = f"Hi {names[user_id]}, you've been grouped up for LunchTag with {mentions([other for other in members if other != user_id])}! \
+                    Between you, you share interests in {shared_interests}. Please initiate the conversation \
+                    and plan a meetup. Enjoy!"
+        deliveries += [slack_message(user_id, message),
+                       slack_message(user_id, "Before the next Lunchtag pairings, please complete the survey below!",
+                                     blocks=all_blocks['survey'])]
+    return deliveries
+
+
+def shared_survey_blocks(intro):
+    """ Intro and survey as one message for a group DM, submitted as 'survey-complete-shared' so partners don't replace each other's survey. """
+    survey = deepcopy(all_blocks['survey']['blocks'])
+    for block in survey:
+        for element in block.get('elements', []):
+            if element.get('value') == 'survey-complete':
+                element['value'] = 'survey-complete-shared'
+    return {'blocks': [{"type": "section", "text": {"type": "mrkdwn", "text": intro}}, {"type": "divider"}] + survey}
@@ -1,14 +1,27 @@
 # import os
-import boto3
+import json
+import threading
+import traceback
 
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
-from config import SLACK_BOT_TOKEN
+from storage import get_backend
+from metrics import span
+from config import SLACK_BOT_TOKEN, LOG_CHANNEL, LOG_MAX_CHARS
 
-slack_client = WebClient(token=SLACK_BOT_TOKEN)
 
-s3 = boto3.client('s3')
+class InstrumentedWebClient(WebClient):
+    """ WebClient that records every Web API call as a metrics span, with the size of what it sent. """
+
+    def api_call(self, api_method, **kwargs):
+        with span('slack.' + api_method) as call_span:
+            content = (kwargs.get('data') or {}).get('content')
+            call_span.bytes += len(content) if content is not None else len(json.dumps(kwargs.get('json') or {}, default=str))
+            return super().api_call(api_method, **kwargs)
+
+
+slack_client = InstrumentedWebClient(token=SLACK_BOT_TOKEN)
 
 def get_message(channel_id: str, message_ts: str):
     try:
@@ -34,13 +47,12 @@ def update_message(channel_id, message_ts, blocks):
     return []
 
 # Send a message given a user, message text, and optional reactions
-def send_message(user_id, message, extra_reactions = [], file_name = '', blocks = []):
+def send_message(user_id, message, extra_reactions = [], file_name = '', blocks = [], file_content = None):
     try:
         if file_name != '':
             
-            # Fetch the file from S3
-            s3_object = s3.get_object(Bucket='lunchtag-slack-bot-user-data', Key=file_name)
-            file_data = s3_object['Body'].read()
+            # Upload file_content as file_name when given, otherwise fetch the stored file of that name
+            file_data = file_content if file_content is not None else get_backend().read(file_name)
             
             response = slack_client.files_upload(
                 channels=user_id,
@@ -64,21 +76,44 @@ def send_message(user_id, message, extra_reactions = [], file_name = '', blocks
         print(f"Error sending {message} to user {user_id}: {e}")
         return []
 
-def get_users():
-    try:
-        response = slack_client.users_list()
-        users = response["members"]
-        return [user for user in users if not user["is_bot"]]
-    except SlackApiError as e:
-        print(f"Error getting users: {e}")
-        return []
-        
+_log_lock = threading.Lock()
+_log_entries = []
+_log_size = 0
+_log_dropped = 0
+
+
+def _buffer_log(entry, always=False):
+    """ Add entry to the log buffer, dropping it once the buffer is over LOG_MAX_CHARS unless always is set. """
+    global _log_size, _log_dropped
+    print(entry)
+    with _log_lock:
+        if _log_size + len(entry) > LOG_MAX_CHARS and not always:
+            _log_dropped += 1
+            return
+        _log_entries.append(entry)
+        _log_size += len(entry) + 1
+
+
 def log(text):
-    log_channel = 'C05EANK93MY'
-    send_message(log_channel, text)
-    return
-    
+    """ Buffer text for the log channel, it is posted by flush_log at the end of the invocation. """
+    _buffer_log(str(text))
+
+
 def log_exception(e):
-    log(e)
-    log(traceback.format_exc())
-    return
\ No newline at end of file
+    """ Buffer e with its traceback. Exceptions are kept even when the buffer is full, tracebacks cut to their last lines. """
+    trace = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+    if len(trace) > LOG_MAX_CHARS // 2:
+        trace = '...' + trace[-(LOG_MAX_CHARS // 2):]
+    _buffer_log(f"{type(e).__name__}: {e}\n```{trace}```", always=True)
+
+
+def flush_log():
+    """ Post the buffered log entries to the log channel as one message and empty the buffer. """
+    global _log_entries, _log_size, _log_dropped
+    with _log_lock:
+        entries, dropped = _log_entries, _log_dropped
+        _log_entries, _log_size, _log_dropped = [], 0, 0
+    if dropped:
+        entries.append(f"... and {dropped} more entries")
+    if entries:
+        send_message(LOG_CHANNEL, '\n'.join(entries))
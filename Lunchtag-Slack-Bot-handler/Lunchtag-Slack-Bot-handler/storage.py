@@ -0,0 +1,481 @@
+"""
+Per-user storage for LunchTag: one record per user under users/<user_id>.json and a roster index at users/index.json.
+
+Run `python storage.py migrate` to split an existing userdata.json, or `python storage.py migrate --local DIR` to do it against a local directory.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import boto3
+from botocore.exceptions import ClientError
+
+from metrics import span
+from config import BUCKET_NAME, STORAGE_BACKEND, LOCAL_STORAGE_DIR, USER_DATA_KEY, ROSTER_KEY, USER_RECORD_PREFIX, MAX_WRITE_ATTEMPTS, WRITE_RETRY_BACKOFF, RUN_LOCK_PREFIX, RUN_LOCK_TTL
+
+ROSTER_FIELDS = ('real_name', 'status', 'weekly_interest')
+# Roster fields with a secondary index of the members holding each value
+INDEXED_FIELDS = ('status', 'weekly_interest')
+MAX_PARALLEL_READS = 16
+
+# Passed as expected_version to write unconditionally
+ANY_VERSION = object()
+_DELETED = object()
+
+
+class WriteConflict(Exception):
+    """ The object changed since it was read, so a conditional write was refused. """
+
+
+class JobRunning(Exception):
+    """ Another invocation holds the run lock of the job. """
+
+
+class S3Backend:
+    """ Stores objects as keys in an S3 bucket, using ETags as versions. """
+
+    def __init__(self, bucket=BUCKET_NAME):
+        self.bucket = bucket
+        self.s3 = boto3.client('s3')
+        self.calls = Counter()
+
+    def read(self, key):
+        """ Return the object body as bytes, or None if it does not exist. """
+        return self.read_versioned(key)[0]
+
+    def read_versioned(self, key):
+        """ Return (body, version), or (None, None) if the object does not exist. """
+        self.calls['read'] += 1
+        with span('storage.read') as read_span:
+            try:
+                s3_object = self.s3.get_object(Bucket=self.bucket, Key=key)
+            except self.s3.exceptions.NoSuchKey:
+                return None, None
+            body = s3_object['Body'].read()
+            read_span.bytes += len(body)
+        return body, s3_object['ETag']
+
+    def write(self, key, body, expected_version=ANY_VERSION):
+        """
+        Write the object and return its new version. expected_version None only creates
+        the object, any other version must match the stored one or WriteConflict is raised.
+        """
+        self.calls['write'] += 1
+        conditions = {}
+        if expected_version is None:
+            conditions['IfNoneMatch'] = '*'
+        elif expected_version is not ANY_VERSION:
+            conditions['IfMatch'] = expected_version
+        try:
+            with span('storage.write') as write_span:
+                write_span.bytes += len(body)
+                response = self.s3.put_object(Body=body, Bucket=self.bucket, Key=key, **conditions)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise WriteConflict(key) from e
+            raise
+        return response['ETag']
+
+    def delete(self, key, expected_version=ANY_VERSION):
+        """ Delete the object. With expected_version, only if it still is that version, or WriteConflict is raised. """
+        self.calls['delete'] += 1
+        conditions = {} if expected_version is ANY_VERSION else {'IfMatch': expected_version}
+        try:
+            with span('storage.delete'):
+                self.s3.delete_object(Bucket=self.bucket, Key=key, **conditions)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise WriteConflict(key) from e
+            raise
+
+
+class LocalBackend:
+    """ Stores objects as files under a local directory, for offline runs and tests. """
+
+    def __init__(self, root=LOCAL_STORAGE_DIR):
+        self.root = root
+        self.calls = Counter()
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def read(self, key):
+        return self.read_versioned(key)[0]
+
+    def read_versioned(self, key):
+        self.calls['read'] += 1
+        with span('storage.read') as read_span:
+            body, version = self._read_file(key)
+            read_span.bytes += len(body or b'')
+        return body, version
+
+    def _read_file(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None, None
+        return body, hashlib.md5(body).hexdigest()
+
+    def write(self, key, body, expected_version=ANY_VERSION):
+        self.calls['write'] += 1
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # An exclusive lock on a sidecar file makes check-and-write atomic across processes
+        with span('storage.write') as write_span, open(path + '.lock', 'w') as lock:
+            write_span.bytes += len(body)
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if expected_version is not ANY_VERSION and self._read_file(key)[1] != expected_version:
+                raise WriteConflict(key)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(path + '.tmp', path)
+        return hashlib.md5(body).hexdigest()
+
+    def delete(self, key, expected_version=ANY_VERSION):
+        self.calls['delete'] += 1
+        path = self._path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            return
+        with span('storage.delete'), open(path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if expected_version is not ANY_VERSION and self._read_file(key)[1] != expected_version:
+                raise WriteConflict(key)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class UnitOfWork:
+    """ Request-scoped cache of user records: load_user reads each once and save_user marks it dirty until the flush writes it. """
+
+    def __init__(self):
+        self.records = {}
+        self.dirty = set()
+
+    def flush(self):
+        for user_id in sorted(self.dirty):
+            record = self.records[user_id]
+            if _clean_records.get(user_id, (None, None))[0] != _encode(record):
+                _save_user_now(user_id, record)
+        self.dirty.clear()
+
+
+_backend = None
+_unit_of_work = None
+# (body, version) of each record as last read or written, the base for merges and change detection
+_clean_records = {}
+_clean_roster = [None, None]
+# [roster version, {field: {value: set of user ids}}] of the last roster indexed
+_roster_indexes = [None, None]
+# Writes running off the critical path, joined before the invocation returns
+_background = []
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = LocalBackend() if STORAGE_BACKEND == 'local' else S3Backend()
+    return _backend
+
+
+def set_backend(backend):
+    """ Swap the storage backend, e.g. for a LocalBackend in offline runs. """
+    global _backend
+    _backend = backend
+    _clean_records.clear()
+    _clean_roster[:] = [None, None]
+    _roster_indexes[:] = [None, None]
+
+
+@contextmanager
+def unit_of_work():
+    """ Share user records across the helpers of one invocation and flush them once at the end. """
+    global _unit_of_work
+    _unit_of_work = UnitOfWork()
+    try:
+        yield _unit_of_work
+        _unit_of_work.flush()
+    finally:
+        _unit_of_work = None
+
+
+def run_in_background(function, *args):
+    """ Run a storage job in a thread, joined by wait_for_background before the handler returns and Lambda freezes the container. """
+    def run():
+        try:
+            function(*args)
+        except Exception as e:
+            print(f"Error in background storage job {getattr(function, '__name__', function)}: {e}")
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    _background.append(thread)
+
+
+def wait_for_background():
+    """ Join every job started with run_in_background. """
+    while _background:
+        _background.pop().join()
+
+
+@contextmanager
+def run_lock(job, ttl=RUN_LOCK_TTL):
+    """ Hold the run lock of job for the block or raise JobRunning, taking over a lock older than ttl seconds. """
+    backend = get_backend()
+    key = f'{RUN_LOCK_PREFIX}{job}.json'
+    body = _encode({'expires': time.time() + ttl})
+    try:
+        version = backend.write(key, body, expected_version=None)
+    except WriteConflict:
+        held, held_version = backend.read_versioned(key)
+        if held is not None and _decode(held)['expires'] > time.time():
+            raise JobRunning(job)
+        try:
+            version = backend.write(key, body, expected_version=held_version)
+        except WriteConflict:
+            raise JobRunning(job)
+    try:
+        yield
+    finally:
+        # Only the lock this invocation wrote is released, not one taken over after it expired
+        try:
+            backend.delete(key, expected_version=version)
+        except WriteConflict:
+            print(f'The run lock of {job} was taken over by another invocation, leaving it')
+
+
+def call_counts():
+    """ Storage calls made by the current backend since the last reset_call_counts. """
+    return dict(get_backend().calls)
+
+
+def reset_call_counts():
+    get_backend().calls.clear()
+
+
+def _record_key(user_id):
+    return f'{USER_RECORD_PREFIX}{user_id}.json'
+
+
+def _encode(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def _decode(body):
+    return json.loads(body.decode('utf-8')) if body is not None else None
+
+
+def _diff(base, new, path=()):
+    """ List the (path, value) field changes that turn base into new, _DELETED marks removed keys. """
+    if not isinstance(base, dict) or not isinstance(new, dict):
+        return [] if base == new else [(path, new)]
+    changes = []
+    for key in new:
+        if key not in base:
+            changes.append((path + (key,), new[key]))
+        else:
+            changes += _diff(base[key], new[key], path + (key,))
+    changes += [(path + (key,), _DELETED) for key in base if key not in new]
+    return changes
+
+
+def _apply(doc, changes):
+    """ Apply field changes from _diff on top of doc. """
+    for path, value in changes:
+        if not path:
+            doc = value
+            continue
+        target = doc
+        for key in path[:-1]:
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            target = target[key]
+        if value is _DELETED:
+            target.pop(path[-1], None)
+        else:
+            target[path[-1]] = value
+    return doc
+
+
+def _write_merged(key, base_body, base_version, new_doc):
+    """
+    Conditionally write new_doc over the version that was read. On a conflict, re-read
+    the object, re-apply only the fields that changed relative to base_body, and retry.
+    Returns the (body, version) that was finally written.
+    """
+    backend = get_backend()
+    changes = _diff(_decode(base_body), new_doc)
+    body, expected_version = _encode(new_doc), base_version
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        try:
+            return body, backend.write(key, body, expected_version)
+        except WriteConflict:
+            print(f'Write conflict on {key}, merging (attempt {attempt + 1})')
+            # Jittered backoff so a burst of clicks doesn't keep colliding in lockstep
+            time.sleep(random.uniform(0, WRITE_RETRY_BACKOFF * 2 ** attempt))
+            current_body, expected_version = backend.read_versioned(key)
+            body = _encode(_apply(_decode(current_body) or {}, changes))
+    raise WriteConflict(f'{key} kept changing after {MAX_WRITE_ATTEMPTS} attempts')
+
+
+def load_roster():
+    """ Load the roster index, migrating from the monolithic userdata.json the first time. """
+    body, version = get_backend().read_versioned(ROSTER_KEY)
+    if body is None:
+        migrate_monolithic()
+        body, version = get_backend().read_versioned(ROSTER_KEY)
+    _clean_roster[:] = [body, version]
+    return _decode(body)
+
+
+def save_roster(roster):
+    """ Save the roster, merging with entries other invocations changed since load_roster. """
+    _clean_roster[:] = _write_merged(ROSTER_KEY, _clean_roster[0], _clean_roster[1], roster)
+
+
+def load_user(user_id):
+    """ Load a single user's record, or None if they are not a member. """
+    if _unit_of_work is not None:
+        if user_id not in _unit_of_work.records:
+            _unit_of_work.records[user_id] = _load_user_now(user_id)
+        return _unit_of_work.records[user_id]
+    return _load_user_now(user_id)
+
+
+def _load_user_now(user_id):
+    body, version = get_backend().read_versioned(_record_key(user_id))
+    if body is None:
+        return None
+    _clean_records[user_id] = (body, version)
+    return _decode(body)
+
+
+def save_user(user_id, record):
+    """ Save a single user's record, and their roster entry if it changed. """
+    if _unit_of_work is not None:
+        _unit_of_work.records[user_id] = record
+        _unit_of_work.dirty.add(user_id)
+        return
+    _save_user_now(user_id, record)
+
+
+def _save_user_now(user_id, record):
+    previous_body, previous_version = _clean_records.get(user_id, (None, None))
+    _clean_records[user_id] = _write_merged(_record_key(user_id), previous_body, previous_version, record)
+
+    # The roster only needs a round trip when one of its fields changed
+    entry = {field: record.get(field) for field in ROSTER_FIELDS}
+    if previous_body is not None and {field: _decode(previous_body).get(field) for field in ROSTER_FIELDS} == entry:
+        return
+    roster = load_roster()
+    if roster.get(user_id) != entry:
+        roster[user_id] = entry
+        save_roster(roster)
+
+
+def sync_roster_entry(user_id):
+    """ Copy user_id's roster fields from their record into the roster, e.g. after the acknowledger changed the record. """
+    record = _load_user_now(user_id)
+    if record is None:
+        return
+    entry = {field: record.get(field) for field in ROSTER_FIELDS}
+    roster = load_roster()
+    if roster.get(user_id) != entry:
+        roster[user_id] = entry
+        save_roster(roster)
+
+
+def roster_indexes(roster=None):
+    """ {field: {value: set of user ids}} of the roster's INDEXED_FIELDS, e.g. ['weekly_interest']['confirmed'], rebuilt only when the roster changed. """
+    if roster is None:
+        roster = load_roster()
+    version = _clean_roster[1]
+    if _roster_indexes[0] != version or version is None:
+        indexes = {field: {} for field in INDEXED_FIELDS}
+        for user_id, entry in roster.items():
+            for field in INDEXED_FIELDS:
+                indexes[field].setdefault(entry.get(field), set()).add(user_id)
+        _roster_indexes[:] = [version, indexes]
+    return _roster_indexes[1]
+
+
+def load_users(user_ids=None):
+    """ Load the {user_id: record} of every user, or of user_ids, sharing the records of the current unit of work. """
+    if user_ids is None:
+        user_ids = load_roster()
+    user_ids = list(dict.fromkeys(user_ids))
+    cached = _unit_of_work.records if _unit_of_work is not None else {}
+    missing = [user_id for user_id in user_ids if user_id not in cached]
+    with span('load_users'), ThreadPoolExecutor(max_workers=MAX_PARALLEL_READS) as executor:
+        records = dict(zip(missing, executor.map(_load_user_now, missing)))
+    if _unit_of_work is not None:
+        _unit_of_work.records.update(records)
+        records = _unit_of_work.records
+    return {user_id: records[user_id] for user_id in user_ids if records[user_id] is not None}
+
+
+def save_users(user_data, complete=True):
+    """
+    Save every changed record and update the roster if needed. With complete, user_data is the whole
+    membership and users missing from it are deleted; otherwise it is a subset and the others are kept.
+    """
+    backend = get_backend()
+    roster = _decode(_clean_roster[0]) if _clean_roster[0] is not None else load_roster()
+
+    changed = [(user_id, record) for user_id, record in user_data.items()
+               if _clean_records.get(user_id, (None, None))[0] != _encode(record)]
+
+    def save_record(item):
+        user_id, record = item
+        base_body, base_version = _clean_records.get(user_id, (None, None))
+        _clean_records[user_id] = _write_merged(_record_key(user_id), base_body, base_version, record)
+
+    with span('save_users'), ThreadPoolExecutor(max_workers=MAX_PARALLEL_READS) as executor:
+        list(executor.map(save_record, changed))
+
+    if complete:
+        for user_id in set(roster) - set(user_data):
+            backend.delete(_record_key(user_id))
+            _clean_records.pop(user_id, None)
+
+    new_roster = {} if complete else dict(roster)
+    new_roster.update({user_id: {field: record.get(field) for field in ROSTER_FIELDS} for user_id, record in user_data.items()})
+    if new_roster != roster:
+        save_roster(new_roster)
+
+
+def migrate_monolithic(backend=None):
+    """ Split the monolithic userdata.json into per-user records and a roster index. """
+    if backend is not None:
+        set_backend(backend)
+    backend = get_backend()
+
+    body = backend.read(USER_DATA_KEY)
+    user_data = json.loads(body.decode('utf-8')) if body is not None else {}
+    print(f'Migrating {len(user_data)} users to per-user records')
+
+    for user_id, record in user_data.items():
+        backend.write(_record_key(user_id), _encode(record))
+    roster = {user_id: {field: record.get(field) for field in ROSTER_FIELDS} for user_id, record in user_data.items()}
+    save_roster(roster)
+    return roster
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('Usage: python storage.py migrate [--local DIR]')
+        sys.exit(1)
+    if '--local' in sys.argv:
+        migrate_monolithic(LocalBackend(sys.argv[sys.argv.index('--local') + 1]))
+    else:
+        migrate_monolithic()
@@ -0,0 +1,81 @@
+"""
+Block Kit templates compiled once and rendered per user without copying them.
+
+compile_blocks turns a block set from config.all_blocks into a Template: a
+render plan listing the input blocks that can be pre-filled, keyed by their
+block_id, and what kind of slot each is:
+
+  * checkboxes           -> initial_options, picked from the block's options by value
+  * static_select        -> initial_option, picked from the block's options by value
+  * plain_text_input     -> initial_value
+  * multi_users_select   -> initial_users
+
+Template.render(values) builds a new top level list of blocks. Blocks without
+a value are the template's own dicts, shared between renders; only a filled
+block gets a shallow copy of itself and its element, so the templates are
+never mutated and a render costs a few dict copies instead of a deep copy.
+Rendered blocks are for sending, callers must not modify them.
+"""
+from config import all_blocks
+
+SLOT_KINDS = {'checkboxes': 'initial_options',
+              'static_select': 'initial_option',
+              'plain_text_input': 'initial_value',
+              'multi_users_select': 'initial_users'}
+
+
+class Template:
+    """ A compiled block set. """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        # block_id: (position, element field to fill, {option value: option} for option slots)
+        self.slots = {}
+        for position, block in enumerate(blocks):
+            element = block.get('element') or {}
+            field = SLOT_KINDS.get(element.get('type'))
+            if block.get('block_id') and field:
+                options = {option['value']: option for option in element.get('options', [])}
+                self.slots[block['block_id']] = (position, field, options)
+
+    def render(self, values):
+        """
+        The {'blocks': [...]} payload with the slots named in values pre-filled.
+        Empty values and block_ids without a slot are skipped, like unknown option values.
+        """
+        blocks = list(self.blocks)
+        for block_id, value in values.items():
+            slot = self.slots.get(block_id)
+            if slot is None or not value:
+                continue
+            position, field, options = slot
+            if field == 'initial_options':
+                value = [option for option_value, option in options.items() if option_value in value]
+            elif field == 'initial_option':
+                value = options.get(value)
+            if not value:
+                continue
+            block = dict(blocks[position])
+            block['element'] = {**block['element'], field: value}
+            blocks[position] = block
+        return {'blocks': blocks}
+
+
+_templates = {}
+
+
+def compile_blocks(block_set):
+    """ Compile a {'blocks': [...]} block set into a Template. """
+    return Template(block_set['blocks'])
+
+
+def get_template(name):
+    """ The compiled Template of all_blocks[name], compiled on first use. """
+    if name not in _templates:
+        _templates[name] = compile_blocks(all_blocks[name])
+    return _templates[name]
+
+
+def render(name, values):
+    """ Render all_blocks[name] with values, see Template.render. """
+    return get_template(name).render(values)
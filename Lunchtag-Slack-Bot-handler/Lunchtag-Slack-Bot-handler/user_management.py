@@ -1,54 +1,43 @@
-import json
-from slack_client import send_message, get_users
-from config import messages, all_blocks
+from slack_client import send_message
+from directory import list_users, resolve_user
+from fanout import fan_out, message as slack_message
+from storage import load_users, save_users, load_user, save_user, load_roster, roster_indexes
+from archive import archive_survey, user_history, user_surveys, round_count
+from analytics import survey_submitted
+from templates import render
+from config import messages, all_blocks, COHORT_FIELD, RECENT_PARTNER_ROUNDS
 from datetime import date
 
-import boto3
-s3 = boto3.client('s3')
-
-def load_users():
-    """Load user data from the S3 bucket."""
-    try:
-        s3_object = s3.get_object(Bucket='lunchtag-slack-bot-user-data', Key='userdata.json')
-        user_data = json.loads(s3_object['Body'].read().decode('utf-8'))
-    except NoCredentialsError:
-        print("No AWS credentials found")
-        return {}
-    except Exception as e:
-        print("Error occurred while reading from S3:", str(e))
-        return {}
-    return user_data
-
-def save_users(user_data):
-    """Save updated user_data to the S3 bucket."""
-    try:
-        s3.put_object(Body=json.dumps(user_data).encode('utf-8'), Bucket='lunchtag-slack-bot-user-data', Key='userdata.json')
-    except NoCredentialsError:
-        print("No AWS credentials found")
-    except Exception as e:
-        print("Error occurred while writing to S3:", str(e))
-
 
 # invite all specific users
 def invite_users(audience, specific_users = []):
-    """Invite specific users to join the event."""
+    """Invite specific users to join the event. Returns the delivery report."""
     SafeMode = True
     
     message = messages['invite']
     invite_block = all_blocks['invite']
     
-    user_data = load_users()
-    users = get_users()
+    if isinstance(specific_users, str):
+        specific_users = [specific_users]
+    # Only the records of new members are written, everyone else is looked up in the roster
+    roster = load_roster()
+    if audience == 'specified':
+        # Only the named users are needed, so skip listing the whole workspace
+        users = [user for user in map(resolve_user, specific_users) if user is not None]
+    else:
+        users = list_users()
+    new_users = {}
+    deliveries = []
 
-    
     for user in users:
         user_id, real_name = user['id'], user['real_name']
         
         if SafeMode and user_id not in specific_users:
             continue
 
-        if user_id not in user_data:
-            user_data[user_id] = {'real_name': real_name,
+        new = user_id not in roster
+        if new:
+            new_users[user_id] = {'real_name': real_name,
                                     'status': 'noResponse',
                                    'weekly_interest': 'noResponse',
                                    'profile': {
@@ -58,37 +47,50 @@ def invite_users(audience, specific_users = []):
                                                 "avoid_people": []
                                             },
                                    'history': {},
-                                   'surveys': {}
+                                   'archived_rounds': []
                                  }
-            new = True
-        if (audience == 'new' and new) or (audience == 'nonresponders' and user_data[user_id]['status'] == 'noResponse') or (user_id in specific_users):
-            print('Sending invite to ' + str(user_id))
-            send_message(user_id, message, blocks = invite_block)
+        status = new_users[user_id]['status'] if new else roster[user_id]['status']
+        if (audience == 'new' and new) or (audience == 'nonresponders' and status == 'noResponse') or (user_id in specific_users):
+            deliveries.append(slack_message(user_id, message, blocks = invite_block))
             
-    save_users(user_data)
+    print(f'Sending {len(deliveries)} invites')
+    save_users(new_users, complete=False)
+    return fan_out(deliveries)
 
 def confirm_weekly_interest():
-    """Confirm weekly interest of users."""
-    user_data = load_users()
+    """Confirm weekly interest of users. Returns the delivery report."""
+    by_interest = roster_indexes()['weekly_interest']
     print('Confirming weekly interest')
     message = messages['weekly_interest']
-    for user_id in user_data:
-        if user_data[user_id]['weekly_interest'] != 'paused':
-            user_data[user_id]['weekly_interest'] = 'noResponse'
-        print(user_data[user_id]['weekly_interest'])
-        if user_data[user_id]["status"] == "joined" and user_data[user_id]['weekly_interest'] == 'noResponse':
-            send_message(user_id, message, blocks=all_blocks['weekly_interest'])
-    save_users(user_data)
+    # Last week's answers are cleared, only the records of members who gave one are touched
+    answered = [user_id for value, user_ids in by_interest.items() if value not in ('paused', 'noResponse') for user_id in user_ids]
+    user_data = load_users(answered)
+    for record in user_data.values():
+        record['weekly_interest'] = 'noResponse'
+    save_users(user_data, complete=False)
+
+    indexes = roster_indexes()
+    recipients = indexes['status'].get('joined', set()) & indexes['weekly_interest'].get('noResponse', set())
+    deliveries = [slack_message(user_id, message, blocks=all_blocks['weekly_interest']) for user_id in sorted(recipients)]
+    return fan_out(deliveries)
 
 def confirm_weekly_interest_followup():
-    """Confirm weekly interest of users."""
-    user_data = load_users()
+    """Remind users who haven't confirmed their weekly interest. Returns the delivery report."""
+    indexes = roster_indexes()
     print('Confirming weekly interest')
     message = messages['weekly_interest_followup']
-    for user_id in user_data:
-        if user_data[user_id]["status"] == "joined" and user_data[user_id]['weekly_interest'] == 'noResponse':
-            send_message(user_id, message)
-    save_users(user_data)
+    recipients = indexes['status'].get('joined', set()) & indexes['weekly_interest'].get('noResponse', set())
+    deliveries = [slack_message(user_id, message) for user_id in sorted(recipients)]
+    return fan_out(deliveries)
+
+
+def set_cohort(cohort, user_ids):
+    """ Put the given members in cohort ('' for none), the pool 'generate cohorts' pairs them in. Returns how many were found. """
+    user_data = load_users(user_ids)
+    for record in user_data.values():
+        record['profile'][COHORT_FIELD] = cohort
+    save_users(user_data, complete=False)
+    return len(user_data)
 
 
 def ask_interests(user_id):
@@ -99,7 +101,7 @@ def ask_interests(user_id):
 
 
 def update_survey(user_id, state):
-    user_data = load_users()
+    user_record = load_user(user_id)
     
     meeting_date = date.today().strftime("%m/%d/%y")
     
@@ -121,14 +123,16 @@ def update_survey(user_id, state):
                 else:
                     user_responses['Rating'] = response['selected_option']['value']
     
-    user_data[user_id]['surveys'][meeting_date] = user_responses
-    save_users(user_data)
+    # Answers go to the archive under the round they are about, the record only notes that round
+    round_name = archive_survey(user_id, user_record, user_responses, meeting_date)
+    save_user(user_id, user_record)
+    survey_submitted(user_id, user_record, round_name, user_responses)
 
     return []
 
 
 def update_profile(user_id, state):
-    user_data = load_users()
+    user_record = load_user(user_id)
     
     user_responses = {
         "all_interests": [],
@@ -148,58 +152,36 @@ def update_profile(user_id, state):
             elif response['type'] == 'multi_users_select':
                 user_responses[key] = list(response['selected_users'])
     
-    user_data[user_id]['profile'] = user_responses
-    save_users(user_data)
+    # Fields the form doesn't show, like the cohort set by admins, are kept
+    user_record['profile'] = {**user_record['profile'], **user_responses}
+    save_user(user_id, user_record)
 
     return []
     
 def preload_profile(user_id):
-    user_data = load_users()
-    
-    blocks = all_blocks['profile_update']
-
-    user_profile = user_data[user_id]['profile']
-    profile_properties = user_profile.keys()
-    for block in blocks['blocks']:
-        cur_property = block.get('block_id')
-        if cur_property in profile_properties:
-            if block['element']['type'] == 'checkboxes':
-                initial_options = []
-                for checkbox in block['element']['options']:
-                    if checkbox['value'] in user_profile[cur_property]:
-                        initial_options.append(checkbox)
-                if len(initial_options) > 0:
-                    block['element']['initial_options'] = initial_options
-    
-            elif block['element']['type'] == 'plain_text_input':
-                initial_options = user_profile[cur_property]
-                if len(initial_options) > 0:
-                    block['element']['initial_value'] = initial_options
-    
-            elif block['element']['type'] == 'multi_users_select':
-                initial_options = user_profile[cur_property]
-                if len(initial_options) > 0:
-                    block['element']['initial_users'] = initial_options
-
-    return blocks
+    """ The profile_update blocks pre-filled with the user's profile, rendered without touching the shared template. None for non-members. """
+    user_record = load_user(user_id)
+    if user_record is None:
+        print(f'{user_id} is not a member, no profile to show')
+        return None
+    return render('profile_update', user_record.get('profile', {}))
     
 
 def update_user_history(user1_id, user2_id, meeting_date):
     """Update the history of user1 and user2 with the meeting details."""
-    user_data = load_users()
-    user_data[user1_id]['history'][meeting_date] = user2_id
-    user_data[user2_id]['history'][meeting_date] = user1_id
-    save_users(user_data)
+    for user_id, partner_id in ((user1_id, user2_id), (user2_id, user1_id)):
+        user_record = load_user(user_id)
+        user_record['history'][meeting_date] = partner_id
+        save_user(user_id, user_record)
 
 
 def get_user_profile(requested_user_id):
     """ Pulls, formats, and returns the account of a given user"""
-    user_data = load_users()
+    requested_data = load_user(requested_user_id)
     message = messages['invite']
-    if requested_user_id not in user_data.keys():
+    if requested_data is None:
         message = messages['missing_user']
     else:
-        requested_data = user_data[requested_user_id]
         account = {}
         account['real_name'] = requested_data['real_name']
         account['status'] = requested_data['status']
@@ -208,8 +190,14 @@ def get_user_profile(requested_user_id):
         account['Custom_Interest'] = requested_data['profile']['custom_interest']
         account['Promoted_People'] = '<@' + '>, <@'.join(requested_data['profile']['promoted_people']) + '>'
         account['Avoid_People'] = '<@' + '>, <@'.join(requested_data['profile']['avoid_people']) + '>'
-        account['History'] = ', '.join([date + ': ' + '<@' + name + '>' for date, name in requested_data['history'].items()])
-        account['Survey'] = ', '.join([date + ': ' +  ', '.join([Metup, Rating, Feedback]) for date, (Metup, Rating, Feedback) in requested_data['surveys'].items()])
+        # The recent rounds are in the record's summary, only the surveys about them are read from the archive
+        history = user_history(requested_user_id, requested_data, RECENT_PARTNER_ROUNDS)
+        surveys = user_surveys(requested_user_id, requested_data, RECENT_PARTNER_ROUNDS)
+        account['History'] = ', '.join([date + ': ' + '<@' + name + '>' for date, name in history.items()])
+        earlier_rounds = round_count(requested_data) - len(history)
+        if earlier_rounds > 0:
+            account['History'] += f' (and {earlier_rounds} earlier rounds)'
+        account['Survey'] = ', '.join([name + ': ' + ', '.join([survey['MetUp'], str(survey['Rating']), survey['Survey_Feedback']]) for name, survey in surveys.items()])
 
 
         
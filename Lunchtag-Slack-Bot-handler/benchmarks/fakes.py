@@ -0,0 +1,143 @@
+"""
+In-process fakes of the S3 client and the Slack WebClient for benchmarks.
+
+FakeS3 keeps objects in a dict and honours the IfMatch/IfNoneMatch conditions
+storage.S3Backend relies on. FakeWebClient answers every Web API method the
+bot uses with a minimal successful response. Both count their calls by method.
+FakeClock stands in for the clock of Slack's rate limits: waiting for a rate
+tier jumps it ahead instead of sleeping, so the waits cost no wall time but
+are still measured. install() points the handler modules at fresh fakes.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class _Body:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.calls = Counter()
+        self.exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+
+    def get_object(self, Bucket, Key):
+        self.calls['get_object'] += 1
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+        body, etag = self.objects[Key]
+        return {'Body': _Body(body), 'ETag': etag}
+
+    def put_object(self, Body, Bucket, Key, IfMatch=None, IfNoneMatch=None):
+        self.calls['put_object'] += 1
+        current = self.objects.get(Key)
+        if (IfNoneMatch == '*' and current is not None) or (IfMatch is not None and (current is None or current[1] != IfMatch)):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        etag = '"' + hashlib.md5(Body).hexdigest() + '"'
+        self.objects[Key] = (Body, etag)
+        return {'ETag': etag}
+
+    def delete_object(self, Bucket, Key, IfMatch=None):
+        self.calls['delete_object'] += 1
+        if IfMatch is not None and (Key not in self.objects or self.objects[Key][1] != IfMatch):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'DeleteObject')
+        self.objects.pop(Key, None)
+        return {}
+
+
+class FakeWebClient:
+    def __init__(self, members=()):
+        self.members = list(members)
+        self.calls = Counter()
+
+    def users_list(self, limit=200, cursor=None, **kwargs):
+        self.calls['users_list'] += 1
+        start = int(cursor or 0)
+        page = self.members[start:start + limit]
+        next_cursor = str(start + limit) if start + limit < len(self.members) else ''
+        return {'ok': True, 'members': page, 'response_metadata': {'next_cursor': next_cursor}}
+
+    def users_info(self, user, **kwargs):
+        self.calls['users_info'] += 1
+        return {'ok': True, 'user': {'id': user, 'real_name': user, 'is_bot': False, 'deleted': False}}
+
+    def conversations_open(self, users, **kwargs):
+        self.calls['conversations_open'] += 1
+        return {'ok': True, 'channel': {'id': 'G' + hashlib.md5(users.encode()).hexdigest()[:10].upper()}}
+
+    def conversations_history(self, channel, **kwargs):
+        self.calls['conversations_history'] += 1
+        return {'ok': True, 'messages': [{'text': ''}]}
+
+    def __getattr__(self, method):
+        # chat_postMessage, chat_update, files_upload, ...
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def call(**kwargs):
+            self.calls[method] += 1
+            return {'ok': True, 'ts': '0', 'channel': kwargs.get('channel')}
+        return call
+
+
+class FakeClock:
+    """ time.monotonic, time.time and time.sleep, with sleeps moving the clock ahead instead of waiting. """
+
+    def __init__(self):
+        # Seconds slept so far, as the clock only ever jumps ahead by sleeping
+        self.waited = 0.0
+        self.lock = threading.Lock()
+        self.last = threading.local()
+
+    def monotonic(self):
+        self.last.now = time.monotonic() + self.waited
+        return self.last.now
+
+    def time(self):
+        return time.time() + self.waited
+
+    def sleep(self, seconds):
+        # Threads sleep side by side, so the clock only has to reach the end of each sleep, not their sum
+        with self.lock:
+            start = getattr(self.last, 'now', time.monotonic() + self.waited)
+            self.waited = max(self.waited, start + seconds - time.monotonic())
+
+
+def install(members=()):
+    """ Point storage, the Slack modules and the clock of the rate limits at new fakes. Returns (s3, slack, clock). """
+    import storage
+    import slack_client
+    import fanout
+    import directory
+    import pairings_manager
+
+    s3, slack, clock = FakeS3(), FakeWebClient(members), FakeClock()
+    backend = storage.S3Backend()
+    backend.s3 = s3
+    storage.set_backend(backend)
+    slack_client.slack_client = slack
+    fanout.slack_client = slack
+    # Slack's rate tiers still apply, but their waits only move the fake clock (and the publish time budget with it)
+    fanout.time = clock
+    pairings_manager.time = clock
+    fanout._buckets = {method: fanout.TokenBucket(per_minute) for method, per_minute in fanout.SLACK_RATE_LIMITS.items()}
+    directory._snapshot = None
+    return s3, slack, clock
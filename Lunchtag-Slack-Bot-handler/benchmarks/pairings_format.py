@@ -0,0 +1,76 @@
+"""
+Encode and parse time of the saved pairings, JSON lines against the old xlsx round-trip.
+
+Every admin step (pairings, swap, publish) used to download pairings_full.xlsx
+and parse it with pd.read_excel. This builds synthetic pairings for a few round
+sizes and times both formats with the same rows.
+
+    python benchmarks/pairings_format.py
+    python benchmarks/pairings_format.py --pairs 50 500 --repeat 20
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from io import BytesIO
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Lunchtag-Slack-Bot-handler'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+
+from pairings_manager import dump_pairings, parse_pairings  # noqa: E402
+
+INTERESTS = ['AI Risk', 'Animal Welfare', 'Global Health', 'Biorisk', 'Mental Health']
+
+
+def synthetic_pairings(num_pairs, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for index in range(num_pairs):
+        interests1, interests2 = rng.sample(INTERESTS, rng.randint(1, 5)), rng.sample(INTERESTS, rng.randint(1, 5))
+        rows.append({'Person 1': f'Member {2 * index}',
+                     'Person 2': f'Member {2 * index + 1}',
+                     'Score': rng.randint(-100, 15),
+                     'Person 1 Interests': ', '.join(interests1),
+                     'Person 2 Interests': ', '.join(interests2),
+                     'Common Interests': ', '.join(set(interests1) & set(interests2)),
+                     'Person 1 ID': f'U{2 * index:010d}',
+                     'Person 2 ID': f'U{2 * index + 1:010d}'})
+    return pd.DataFrame(rows)
+
+
+def to_xlsx(df):
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False)
+    return output.getvalue()
+
+
+def best_of(function, repeat):
+    """ Best time of one call in milliseconds. """
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, nargs='+', default=[25, 100, 500])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'pairs':>6} {'format':>8} {'bytes':>9} {'encode ms':>10} {'parse ms':>10}")
+    for num_pairs in args.pairs:
+        df = synthetic_pairings(num_pairs)
+        xlsx, jsonl = to_xlsx(df), dump_pairings(df)
+        assert parse_pairings(jsonl) == pd.read_excel(BytesIO(xlsx)).fillna('').to_dict('records')
+
+        xlsx_parse = best_of(lambda: pd.read_excel(BytesIO(xlsx)), args.repeat)
+        jsonl_parse = best_of(lambda: parse_pairings(jsonl), args.repeat)
+        print(f"{num_pairs:>6} {'xlsx':>8} {len(xlsx):>9} {best_of(lambda: to_xlsx(df), args.repeat):>10.2f} {xlsx_parse:>10.2f}")
+        print(f"{num_pairs:>6} {'jsonl':>8} {len(jsonl):>9} {best_of(lambda: dump_pairings(df), args.repeat):>10.2f} {jsonl_parse:>10.2f}"
+              f"   parse {xlsx_parse / jsonl_parse:.0f}x faster")
+
+
+if __name__ == '__main__':
+    main()
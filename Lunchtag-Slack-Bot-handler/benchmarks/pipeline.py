@@ -0,0 +1,241 @@
+"""
+Benchmark of the whole pipeline on synthetic workspaces.
+
+For every workspace size, a seeded workspace (see workspace.py) is stored in an
+in-process fake S3 and every hot path runs against it with a fake Slack
+WebClient (see fakes.py). Each path starts from the same stored state and is
+run twice, once for wall time and once under tracemalloc for peak memory.
+The S3 and Slack calls it makes are counted too. Slack's rate tiers are kept,
+on a fake clock: the time spent waiting for them is reported as slack wait
+instead of being slept, and publish runs as many times as the admin would
+have to publish for every group to be sent within its time budget.
+
+    python benchmarks/pipeline.py                      # 1k and 10k members, compared to the baselines
+    python benchmarks/pipeline.py --sizes 50000 --paths load_users get_user_profile
+    python benchmarks/pipeline.py --update             # store the results as the new baselines
+
+Results are compared with pipeline_baselines.json: a path regresses when it is
+slower or uses more memory than its baseline by more than --tolerance, or makes
+more API calls at all. A path whose peak memory doesn't fit in the handler
+function's MemorySize fails whatever its baseline, since it would be killed
+in Lambda: generate_pairings on 10k members does (over 500MB against 128MB).
+tracemalloc only counts the path's own allocations, not the interpreter and
+libraries, so a peak close to the limit doesn't fit either. The exit status
+is 1 if anything regressed or failed.
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'Lunchtag-Slack-Bot-handler'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-benchmark')
+
+import pandas as pd  # noqa: E402
+
+import fakes  # noqa: E402
+from workspace import make_workspace  # noqa: E402
+import storage  # noqa: E402
+import pairings_manager  # noqa: E402
+from pair_history import build_pair_history, save_pair_history  # noqa: E402
+from archive import migrate_archive  # noqa: E402
+from user_management import get_user_profile  # noqa: E402
+
+BASELINES_FILE = os.path.join(BENCHMARKS_DIR, 'pipeline_baselines.json')
+with open(os.path.join(os.path.dirname(BENCHMARKS_DIR), 'Lunchtag-Slack-Bot-handler.yaml')) as _template:
+    HANDLER_MEMORY_MB = int(re.search(r'MemorySize:\s*(\d+)', _template.read()).group(1))
+# Largest number of confirmed users generate is benchmarked with, beyond that the dense matrix gets too big.
+# solve_pairings itself switches from blossom to local_search above BLOSSOM_MAX_USERS.
+GENERATE_MAX_USERS = 8000
+PROFILE_LOOKUPS = 100
+
+
+def _confirmed(user_data):
+    return [user_id for user_id, data in user_data.items() if data['weekly_interest'] == 'confirmed']
+
+
+# Every path is a setup(user_data) returning the function to measure, or None to skip at this size
+
+def load_users_path(user_data):
+    return storage.load_users
+
+
+def save_users_path(user_data):
+    """ A bulk job that changed a tenth of the members: new statuses and a new history entry. """
+    loaded = storage.load_users()
+    rng = random.Random(1)
+    for user_id in rng.sample(sorted(loaded), len(loaded) // 10):
+        loaded[user_id]['weekly_interest'] = 'noResponse'
+        loaded[user_id]['history']['12-30-25'] = rng.choice(sorted(loaded))
+    return functools.partial(storage.save_users, loaded)
+
+
+def get_user_profile_path(user_data):
+    user_ids = random.Random(2).sample(sorted(user_data), min(PROFILE_LOOKUPS, len(user_data)))
+
+    def lookups():
+        for user_id in user_ids:
+            with storage.unit_of_work():
+                get_user_profile(user_id)
+    return lookups
+
+
+def generate_pairings_path(user_data):
+    if len(_confirmed(user_data)) > GENERATE_MAX_USERS:
+        return None
+
+    def generate():
+        pairings_manager.save_pairings(pairings_manager.generate_pairings())
+        storage.wait_for_background()
+    return generate
+
+
+def publish_path(user_data):
+    """ Publishing a round of random pairs of the confirmed members. """
+    confirmed = _confirmed(user_data)
+    random.Random(3).shuffle(confirmed)
+    rows = [{'Person 1': user_data[user1]['real_name'], 'Person 2': user_data[user2]['real_name'], 'Score': 0,
+             'Person 1 Interests': '', 'Person 2 Interests': '', 'Common Interests': '',
+             'Person 1 ID': user1, 'Person 2 ID': user2} for user1, user2 in zip(confirmed[::2], confirmed[1::2])]
+    pairings_manager.save_pairings(pd.DataFrame(rows))
+    storage.wait_for_background()
+
+    def publish():
+        # The admin publishes again until every group has been sent
+        while pairings_manager.publish_and_send_dm()[1]:
+            pass
+        storage.wait_for_background()
+    return publish
+
+
+PATHS = {
+    'load_users': load_users_path,
+    'save_users': save_users_path,
+    'get_user_profile': get_user_profile_path,
+    'generate_pairings': generate_pairings_path,
+    'publish_and_send_dm': publish_path,
+}
+
+
+def seed_store(user_data):
+    """ The fake S3 objects of a workspace stored the way the bot stores it, its history and surveys archived. """
+    s3, _, _ = fakes.install()
+    with contextlib.redirect_stdout(io.StringIO()):
+        storage.save_users(user_data)
+        save_pair_history(build_pair_history(user_data))
+        migrate_archive()
+    return dict(s3.objects)
+
+
+def run_path(path, user_data, members, objects, memory):
+    """ Run one path from the stored state, returning (seconds, peak MB or None, slack wait, API calls) or None if skipped. """
+    s3, slack, clock = fakes.install(members)
+    s3.objects = dict(objects)
+    with contextlib.redirect_stdout(io.StringIO()):
+        measured = PATHS[path](user_data)
+        if measured is None:
+            return None
+        s3.calls.clear()
+        slack.calls.clear()
+        waited = clock.waited
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        measured()
+        seconds = time.perf_counter() - start
+        peak = None
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+    calls = {**{'s3.' + op: count for op, count in sorted(s3.calls.items())},
+             **{'slack.' + method: count for method, count in sorted(slack.calls.items())}}
+    return seconds, peak, clock.waited - waited, calls
+
+
+def failures(result):
+    """ Reasons result can't work in the handler function, whatever its baseline. """
+    if result.get('peak_mb') and result['peak_mb'] > HANDLER_MEMORY_MB:
+        return [f"peak memory {result['peak_mb']:.1f}MB is over the handler's {HANDLER_MEMORY_MB}MB"]
+    return []
+
+
+def compare(result, baseline, tolerance):
+    """ Reasons result regressed against baseline. """
+    problems = []
+    if result['seconds'] > baseline['seconds'] * (1 + tolerance):
+        problems.append(f"time {result['seconds']:.2f}s vs {baseline['seconds']:.2f}s")
+    if result['slack_wait'] > baseline.get('slack_wait', 0) * (1 + tolerance):
+        problems.append(f"slack wait {result['slack_wait']:.1f}s vs {baseline.get('slack_wait', 0):.1f}s")
+    if result.get('peak_mb') and baseline.get('peak_mb') and result['peak_mb'] > baseline['peak_mb'] * (1 + tolerance):
+        problems.append(f"memory {result['peak_mb']:.1f}MB vs {baseline['peak_mb']:.1f}MB")
+    for name, count in result['calls'].items():
+        if count > baseline['calls'].get(name, 0):
+            problems.append(f"{name} {count} calls vs {baseline['calls'].get(name, 0)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--paths', nargs='+', choices=list(PATHS), default=list(PATHS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown and memory growth')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--update', action='store_true', help='store the results as the new baselines')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(BASELINES_FILE):
+        with open(BASELINES_FILE) as f:
+            baselines = json.load(f)
+
+    regressed = False
+    for size in args.sizes:
+        user_data = make_workspace(size, args.seed)
+        members = [{'id': user_id, 'real_name': data['real_name'], 'is_bot': False} for user_id, data in user_data.items()]
+        objects = seed_store(user_data)
+        print(f"\n{size} members, {len(_confirmed(user_data))} confirmed, {sum(map(len, (body for body, _ in objects.values()))) / 2 ** 20:.1f}MB stored")
+        print(f"{'path':<22} {'seconds':>9} {'peak MB':>9} {'slack wait':>10}  calls")
+
+        for path in args.paths:
+            timed = run_path(path, user_data, members, objects, memory=False)
+            if timed is None:
+                print(f"{path:<22} {'skipped, too large':>20}")
+                continue
+            seconds, _, waited, calls = timed
+            peak = None if args.no_memory else run_path(path, user_data, members, objects, memory=True)[1]
+            result = {'seconds': round(seconds, 4), 'peak_mb': round(peak, 2) if peak is not None else None,
+                      'slack_wait': round(waited, 1), 'calls': calls}
+
+            baseline = baselines.get(str(size), {}).get(path)
+            problems = compare(result, baseline, args.tolerance) if baseline and not args.update else []
+            failed = failures(result)
+            regressed = regressed or bool(problems) or bool(failed)
+            peak_text = f"{peak:9.2f}" if peak is not None else f"{'-':>9}"
+            print(f"{path:<22} {seconds:9.3f} {peak_text} {waited:10.1f}  {', '.join(f'{name}={count}' for name, count in calls.items())}")
+            for problem in problems:
+                print(f"{'':<22} REGRESSION: {problem}")
+            for problem in failed:
+                print(f"{'':<22} FAILURE: {problem}")
+            if args.update:
+                baselines.setdefault(str(size), {})[path] = result
+
+    if args.update:
+        with open(BASELINES_FILE, 'w') as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaselines written to {BASELINES_FILE}")
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
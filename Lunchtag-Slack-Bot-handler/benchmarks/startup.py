@@ -0,0 +1,121 @@
+"""
+Cold start benchmark for the LunchTag Lambdas.
+
+Every entry path is imported in a fresh interpreter, the way a cold Lambda
+container would, and the median import time is checked against the budgets in
+startup_budgets.json. Button presses and user commands only import
+lambda_function, so they must stay clear of the pairing stack (numpy, pandas,
+munkres, ...), which only admin pairing commands load.
+
+    python benchmarks/startup.py              # check against the budgets
+    python benchmarks/startup.py --runs 10 --top 10
+    python benchmarks/startup.py --update     # record the current times (+50%, at least 100 ms) as budgets
+
+Exits with status 1 if a path is over budget or imports a module it shouldn't.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLER_DIR = os.path.join(ROOT, 'Lunchtag-Slack-Bot-handler')
+ACKNOWLEDGER_DIR = os.path.join(os.path.dirname(ROOT), 'Lunchtag-Slack-Bot-acknowledger', 'Lunchtag-Slack-Bot-acknowledger')
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budgets.json')
+
+HEAVY_MODULES = ['numpy', 'pandas', 'munkres', 'tabulate', 'xlsxwriter', 'openpyxl']
+
+# path: (directory, statement run on a cold interpreter, modules it must not import)
+ENTRY_PATHS = {
+    # button presses and user commands
+    'handler': (HANDLER_DIR, 'import lambda_function', HEAVY_MODULES),
+    'admin_pairing': (HANDLER_DIR, 'import lambda_function, pairings_manager', []),
+    'acknowledger': (ACKNOWLEDGER_DIR, 'import lambda_function', HEAVY_MODULES),
+}
+
+CHILD = """
+import sys, time, json
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'forbidden': [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    # boto3 clients are created at import time and need a region, but no credentials
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+    env.setdefault('SLACK_BOT_TOKEN', 'xoxb-benchmark')
+    return env
+
+
+def measure(path, runs):
+    directory, statement, forbidden = ENTRY_PATHS[path]
+    times, leaked = [], set()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', CHILD.format(statement=statement, forbidden=forbidden)],
+                                cwd=directory, env=_env(), capture_output=True, text=True, check=True)
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(sample['ms'])
+        leaked.update(sample['forbidden'])
+    return statistics.median(times), sorted(leaked)
+
+
+def slowest_imports(path, top):
+    """ The top packages by import time (own time of all their modules), from python -X importtime. """
+    directory, statement, _ = ENTRY_PATHS[path]
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=directory, env=_env(), capture_output=True, text=True, check=True)
+    by_package = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, _, module = line[len('import time:'):].split('|')
+        package = module.strip().split('.')[0]
+        by_package[package] = by_package.get(package, 0) + int(own) / 1000
+    return sorted(((ms, package) for package, ms in by_package.items()), reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='show the slowest packages imported by each path')
+    parser.add_argument('--update', action='store_true', help='write the measured times (+50%%, at least 100 ms) as the new budgets')
+    parser.add_argument('paths', nargs='*', default=list(ENTRY_PATHS))
+    args = parser.parse_args()
+
+    budgets = {}
+    if os.path.exists(BUDGETS_FILE):
+        with open(BUDGETS_FILE) as f:
+            budgets = json.load(f)
+
+    failed = False
+    measured = {}
+    for path in args.paths:
+        median, leaked = measure(path, args.runs)
+        measured[path] = median
+        budget = budgets.get(path)
+        over = budget is not None and median > budget
+        status = 'OVER BUDGET' if over else 'ok'
+        print(f"{path:<14} {median:8.1f} ms   budget {budget if budget is not None else '-':>6} ms   {status}")
+        if leaked:
+            print(f"{'':<14} imports {', '.join(leaked)}, which should only load on admin pairing commands")
+        for ms, module in slowest_imports(path, args.top) if args.top else []:
+            print(f"{'':<14} {ms:8.1f} ms   {module}")
+        failed = failed or over or bool(leaked)
+
+    if args.update:
+        budgets.update({path: round(max(ms * 1.5, ms + 100)) for path, ms in measured.items()})
+        with open(BUDGETS_FILE, 'w') as f:
+            json.dump(budgets, f, indent=4)
+            f.write('\n')
+        print(f"Budgets written to {BUDGETS_FILE}")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Seeded generator of realistic LunchTag workspaces.
+
+make_workspace(n, seed) returns a userdata.json style {user_id: record} dict:
+a mix of joined, declined and silent members, interests from the profile
+checkboxes plus the odd custom one, a few avoid/promote picks, and weekly
+pairing history and survey answers going back several years.
+"""
+import random
+from datetime import date, timedelta
+
+INTERESTS = ['AI Risk', 'Animal Welfare', 'Global Health', 'Biorisk', 'Mental Health']
+CUSTOM_INTERESTS = ['Forecasting', 'Climate', 'Nuclear security', 'Cooking', 'Running', 'Philosophy']
+STATUSES = (['joined'] * 7) + ['declined'] + (['noResponse'] * 2)
+WEEKLY_INTERESTS = (['confirmed'] * 11) + (['skipping'] * 3) + (['paused'] * 2) + (['noResponse'] * 4)
+MET_UP = ['MetUp-Yes'] * 6 + ['MetUp-No-both', 'MetUp-No-Me', 'MetUp-No-Them']
+
+
+def user_id(index):
+    return f'U{index:09d}'
+
+
+def make_workspace(num_users, seed=0, years=2, participation=0.35, first_round=date(2023, 9, 4)):
+    """ A workspace of num_users members with `years` of weekly rounds before first_round + years. """
+    rng = random.Random(seed)
+    ids = [user_id(index) for index in range(num_users)]
+    rounds = [first_round + timedelta(weeks=week) for week in range(52 * years)]
+
+    user_data = {}
+    for uid in ids:
+        status = rng.choice(STATUSES)
+        joined = status == 'joined'
+        picks = rng.random()
+        user_data[uid] = {
+            'real_name': f'Member {uid[1:].lstrip("0") or "0"}',
+            'status': status,
+            'weekly_interest': rng.choice(WEEKLY_INTERESTS) if joined else 'noResponse',
+            'profile': {
+                'all_interests': rng.sample(INTERESTS, rng.randint(0, len(INTERESTS))) if joined else [],
+                'custom_interest': rng.choice(CUSTOM_INTERESTS) if joined and rng.random() < 0.2 else '',
+                'promoted_people': rng.sample(ids, rng.randint(1, 3)) if joined and picks < 0.2 else [],
+                'avoid_people': rng.sample(ids, rng.randint(1, 2)) if joined and picks > 0.9 else [],
+            },
+            'history': {},
+            'surveys': {},
+        }
+
+    # Weekly rounds among the joined members who took part that week
+    joined = [uid for uid in ids if user_data[uid]['status'] == 'joined']
+    for meeting in rounds:
+        taking_part = [uid for uid in joined if rng.random() < participation]
+        rng.shuffle(taking_part)
+        for user1, user2 in zip(taking_part[::2], taking_part[1::2]):
+            for user, partner in ((user1, user2), (user2, user1)):
+                user_data[user]['history'][meeting.strftime('%m-%d-%y')] = partner
+                if rng.random() < 0.6:
+                    user_data[user]['surveys'][(meeting + timedelta(days=6)).strftime('%m/%d/%y')] = {
+                        'MetUp': rng.choice(MET_UP),
+                        'Rating': f'Rating-{rng.randint(1, 10)}',
+                        'Survey_Feedback': rng.choice(['', '', '', 'Great chat!', 'Had to reschedule']),
+                    }
+        if len(taking_part) % 2 and len(taking_part) >= 3:
+            # The leftover joins the last pair, as a triad
+            leftover, (user1, user2) = taking_part[-1], taking_part[-3:-1]
+            key = meeting.strftime('%m-%d-%y')
+            user_data[leftover]['history'][key] = f'{user1}, {user2}'
+            for user in (user1, user2):
+                user_data[user]['history'][key] += ', ' + leftover
+    return user_data
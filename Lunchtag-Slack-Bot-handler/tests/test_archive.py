@@ -0,0 +1,46 @@
+"""
+Surveys are filed and listed by the round they are about, not the day they were submitted.
+
+    python -m pytest Lunchtag-Slack-Bot-handler/tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Lunchtag-Slack-Bot-handler'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-test')
+
+import pytest  # noqa: E402
+
+import storage  # noqa: E402
+from archive import archive_survey, user_surveys  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def local_storage(tmp_path):
+    storage.set_backend(storage.LocalBackend(str(tmp_path)))
+
+
+def responses(rating):
+    return {'MetUp': 'MetUp-Yes', 'Rating': f'Rating-{rating}', 'Survey_Feedback': ''}
+
+
+def test_surveys_of_two_rounds_submitted_the_same_day():
+    record = {'history': {'09-04-23': 'U2'}}
+    archive_survey('U1', record, responses(3), '09-11-23')
+    # A new round is published and surveyed the same day
+    record['history']['09-11-23'] = 'U3'
+    archive_survey('U1', record, responses(5), '09-11-23')
+
+    surveys = user_surveys('U1', record)
+    assert list(surveys) == ['09-04-23', '09-11-23']
+    assert [survey['Rating'] for survey in surveys.values()] == ['Rating-3', 'Rating-5']
+    assert all(survey['date'] == '09-11-23' for survey in surveys.values())
+    assert list(user_surveys('U1', record, rounds=1)) == ['09-11-23']
+
+
+def test_unmigrated_surveys_are_keyed_by_their_round():
+    record = {'history': {'09-04-23': 'U2', '09-11-23': 'U3'},
+              'surveys': {'09/08/23': responses(2), '09/12/23': responses(4)}}
+    surveys = user_surveys('U1', record)
+    assert {name: survey['date'] for name, survey in surveys.items()} == {'09-04-23': '09/08/23', '09-11-23': '09/12/23'}
@@ -0,0 +1,58 @@
+"""
+Members a cohort pool can't pair on its own, like the only member of a cohort, still get a pairing or are reported.
+
+    python -m pytest Lunchtag-Slack-Bot-handler/tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Lunchtag-Slack-Bot-handler'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-test')
+
+import pytest  # noqa: E402
+
+import storage  # noqa: E402
+import pairings_manager  # noqa: E402
+from pair_history import new_pair_history  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def local_storage(tmp_path):
+    storage.set_backend(storage.LocalBackend(str(tmp_path)))
+    yield
+    storage.wait_for_background()
+
+
+def roster():
+    """ A cohort of four and a cohort of one. """
+    return {f'U{index}': {'real_name': f'Member {index}', 'weekly_interest': 'confirmed', 'history': {},
+                          'profile': {'all_interests': ['Chess', 'Jazz'][:index % 3], 'avoid_people': [], 'promoted_people': [],
+                                      'cohort': 'big' if index < 4 else 'solo'}}
+            for index in range(5)}
+
+
+def paired(df):
+    return set(df['Person 1 ID']) | set(df['Person 2 ID'])
+
+
+@pytest.mark.parametrize('crossover', [False, True])
+@pytest.mark.parametrize('group_size', [None, 3])
+def test_single_member_cohort_joins_a_pair(monkeypatch, crossover, group_size):
+    monkeypatch.setattr(pairings_manager, 'ODD_USER_POLICY', 'triad')
+    user_data = roster()
+    df = pairings_manager.generate_cohort_pairings(user_data, list(user_data), new_pair_history(), crossover, group_size)
+
+    assert paired(df) == set(user_data)
+    assert df.attrs['unpaired'] == []
+    # The member joins an existing pair, so they share its group
+    assert df[(df['Person 1 ID'] == 'U4') | (df['Person 2 ID'] == 'U4')]['Group'].nunique() == 1
+
+
+def test_unpaired_member_is_reported(monkeypatch):
+    monkeypatch.setattr(pairings_manager, 'ODD_USER_POLICY', 'leftover')
+    user_data = roster()
+    df = pairings_manager.generate_cohort_pairings(user_data, list(user_data), new_pair_history(), False)
+
+    assert df.attrs['unpaired'] == ['U4']
+    assert '<@U4>' in pairings_manager.unpaired_note(df)
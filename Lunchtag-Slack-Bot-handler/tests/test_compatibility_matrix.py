@@ -0,0 +1,70 @@
+"""
+The batched compatibility matrix must match the nested loop over calculate_score it replaced.
+
+    python -m pytest Lunchtag-Slack-Bot-handler/tests
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Lunchtag-Slack-Bot-handler'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-test')
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+from pairings_manager import build_compatibility_matrix, calculate_score  # noqa: E402
+from pair_history import new_pair_history, record_round, pair_key  # noqa: E402
+from config import SELF_MATCH_PENALTY  # noqa: E402
+
+INTERESTS = ['Hiking', 'Chess', 'Cooking', 'Jazz', 'Running', 'Film', 'Board games', 'Photography']
+
+
+def seeded_roster(seed, size=40):
+    """ user_data, the users to pair (one of them twice, like ADDITIONAL_USERS), their pair history and survey adjustments. """
+    rng = random.Random(seed)
+    user_ids = [f'U{index:04d}' for index in range(size)]
+    user_data = {user_id: {'real_name': user_id,
+                           'profile': {'all_interests': rng.sample(INTERESTS, rng.randint(0, 5)),
+                                       'avoid_people': rng.sample(user_ids, rng.randint(0, 2)),
+                                       'promoted_people': rng.sample(user_ids, rng.randint(0, 2))},
+                           'history': {}}
+                 for user_id in user_ids}
+
+    pair_history = new_pair_history()
+    for meeting_date in ('09-04-23', '09-11-23', '09-18-23'):
+        shuffled = rng.sample(user_ids, size)
+        record_round(pair_history, meeting_date, list(zip(shuffled[::2], shuffled[1::2]))[:size // 4])
+
+    adjustments = {'interests': {interest: rng.randint(-3, 3) for interest in rng.sample(INTERESTS, 3)},
+                   'pairs': {pair_key(*rng.sample(user_ids, 2)): rng.randint(-4, 4) for _ in range(10)},
+                   'no_shows': set(rng.sample(user_ids, 3))}
+    users = user_ids + [user_ids[0]]
+    return user_data, users, pair_history, adjustments
+
+
+def nested_loop_matrix(user_data, users, pair_history, adjustments):
+    """ The compatibility matrix the way generate_pairings built it before, one calculate_score per pair. """
+    num_users = len(users)
+    compatibility_matrix = np.full((num_users, num_users), -SELF_MATCH_PENALTY)
+    for user1_index in range(num_users):
+        for user2_index in range(user1_index + 1, num_users):
+            user1 = users[user1_index]
+            user2 = users[user2_index]
+            compatibility_matrix[user1_index, user2_index] = calculate_score(user_data, user1, user2, pair_history, adjustments)
+            compatibility_matrix[user2_index, user1_index] = compatibility_matrix[user1_index, user2_index]
+    return compatibility_matrix
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+@pytest.mark.parametrize('with_adjustments', [False, True])
+def test_matches_nested_loop(seed, with_adjustments):
+    user_data, users, pair_history, adjustments = seeded_roster(seed)
+    adjustments = adjustments if with_adjustments else None
+
+    expected = nested_loop_matrix(user_data, users, pair_history, adjustments)
+    actual = build_compatibility_matrix(user_data, users, pair_history, adjustments)
+
+    assert actual.shape == expected.shape
+    np.testing.assert_array_equal(actual, expected)
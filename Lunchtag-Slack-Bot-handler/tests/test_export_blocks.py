@@ -0,0 +1,19 @@
+"""
+The acknowledger's blocks.json must be the blocks export_blocks.py writes from all_blocks.
+
+    python -m pytest Lunchtag-Slack-Bot-handler/tests
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Lunchtag-Slack-Bot-handler'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-test')
+
+from export_blocks import BLOCKS_FILE, acknowledger_blocks  # noqa: E402
+
+
+def test_acknowledger_blocks_are_current():
+    with open(BLOCKS_FILE) as f:
+        assert json.load(f) == acknowledger_blocks(), 'Run export_blocks.py to update the acknowledger'
@@ -0,0 +1,73 @@
+"""
+The blossom matching must find the best matching of small cohorts, whatever the dtype of their matrix.
+
+    python -m pytest Lunchtag-Slack-Bot-handler/tests
+"""
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Lunchtag-Slack-Bot-handler'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-test')
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+import pairings_manager  # noqa: E402
+from matching import max_weight_matching  # noqa: E402
+from config import SELF_MATCH_PENALTY  # noqa: E402
+
+
+def random_matrix(seed, size, dtype):
+    rng = np.random.default_rng(seed)
+    matrix = np.triu(rng.integers(-20, 60, (size, size)), 1)
+    matrix = matrix + matrix.T
+    np.fill_diagonal(matrix, -SELF_MATCH_PENALTY)
+    return matrix.astype(dtype)
+
+
+def best_total(matrix):
+    """ The total weight of the best matching, by trying every matching that leaves at most one vertex out. """
+    def matchings(vertices):
+        if len(vertices) < 2:
+            yield []
+            return
+        first, rest = vertices[0], vertices[1:]
+        for index, partner in enumerate(rest):
+            for matching in matchings(rest[:index] + rest[index + 1:]):
+                yield [(first, partner)] + matching
+    size = len(matrix)
+    left_out = range(size) if size % 2 else [None]
+    return max(sum(matrix[i, j] for i, j in matching)
+               for leftover in left_out
+               for matching in matchings([v for v in range(size) if v != leftover]))
+
+
+def total(matrix, mate):
+    return sum(matrix[i, j] for i, j in enumerate(mate) if i < j)
+
+
+@pytest.mark.parametrize('seed, size', list(itertools.product(range(4), range(2, 10))))
+@pytest.mark.parametrize('dtype', [np.int64, np.int16, np.float32])
+def test_matches_brute_force(seed, size, dtype):
+    matrix = random_matrix(seed, size, dtype)
+    mate = max_weight_matching(matrix)
+
+    assert all(mate[partner] == vertex for vertex, partner in enumerate(mate) if partner != -1)
+    assert mate.count(-1) == size % 2
+    assert total(matrix, mate) == pytest.approx(best_total(matrix))
+
+
+def test_list_input():
+    matrix = random_matrix(0, 7, np.int64)
+    assert total(matrix, max_weight_matching(matrix.tolist())) == best_total(matrix)
+
+
+def test_large_cohort_falls_back_to_local_search(monkeypatch):
+    monkeypatch.setattr(pairings_manager, 'BLOSSOM_MAX_USERS', 6)
+    monkeypatch.setattr(pairings_manager, 'max_weight_matching', lambda matrix: pytest.fail('blossom used'))
+    matrix = random_matrix(1, 8, np.int64)
+
+    indexes = pairings_manager.solve_pairings(matrix, engine='blossom')
+    assert sorted(vertex for pair in indexes for vertex in pair) == list(range(8))
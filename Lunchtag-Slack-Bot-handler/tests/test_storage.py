@@ -0,0 +1,122 @@
+"""
+Conditional writes that merge with what other invocations wrote, on the local backend and a fake S3.
+
+    python -m pytest Lunchtag-Slack-Bot-handler/tests
+"""
+import contextlib
+import io
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'Lunchtag-Slack-Bot-handler'))
+sys.path.append(os.path.join(os.path.dirname(TESTS_DIR), 'benchmarks'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-test')
+
+import pytest  # noqa: E402
+
+import fakes  # noqa: E402
+import storage  # noqa: E402
+from config import MAX_WRITE_ATTEMPTS, ROSTER_KEY  # noqa: E402
+
+KEY = 'users/U1.json'
+
+
+@pytest.fixture(autouse=True, params=['local', 's3'])
+def backend(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'WRITE_RETRY_BACKOFF', 0)
+    if request.param == 'local':
+        storage.set_backend(storage.LocalBackend(str(tmp_path)))
+    else:
+        fakes.install()
+    yield storage.get_backend()
+    storage.set_backend(None)
+
+
+def stored(key):
+    return storage._decode(storage.get_backend().read(key))
+
+
+def member(name, **fields):
+    return {'real_name': name, 'status': 'joined', 'weekly_interest': 'confirmed', 'history': {}, 'profile': {'all_interests': []}, **fields}
+
+
+def test_diff_and_apply_round_trip():
+    base = {'a': 1, 'nested': {'keep': 1, 'change': 1, 'drop': 1}, 'gone': 1}
+    new = {'a': 1, 'nested': {'keep': 1, 'change': 2, 'add': 3}, 'added': {'x': 1}}
+    changes = storage._diff(base, new)
+
+    assert sorted((path, value) for path, value in changes if value is not storage._DELETED) == [
+        (('added',), {'x': 1}), (('nested', 'add'), 3), (('nested', 'change'), 2)]
+    assert sorted(path for path, value in changes if value is storage._DELETED) == [('gone',), ('nested', 'drop')]
+    assert storage._apply(base, changes) == new
+
+
+def test_two_writers_merge_their_fields(backend):
+    base = member('Ada', history={'09-04-23': 'U2'}, profile={'all_interests': ['Chess'], 'cohort': 'a'})
+    base_body, base_version = storage._encode(base), backend.write(KEY, storage._encode(base), None)
+
+    # Both read base: the first changes the status and drops the cohort, the second the interests and the status too
+    first = member('Ada', status='paused', history={'09-04-23': 'U2'}, profile={'all_interests': ['Chess']})
+    storage._write_merged(KEY, base_body, base_version, first)
+    second = member('Ada', status='left', history={'09-04-23': 'U2', '09-11-23': 'U3'}, profile={'all_interests': ['Chess', 'Jazz'], 'cohort': 'a'})
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        storage._write_merged(KEY, base_body, base_version, second)
+
+    assert 'Write conflict' in output.getvalue()
+    assert stored(KEY) == member('Ada', status='left', history={'09-04-23': 'U2', '09-11-23': 'U3'}, profile={'all_interests': ['Chess', 'Jazz']})
+
+
+def test_deleted_key_stays_deleted_through_a_merge(backend):
+    base = member('Ada', slack_status={'away': True}, notes='x')
+    base_body, base_version = storage._encode(base), backend.write(KEY, storage._encode(base), None)
+
+    storage._write_merged(KEY, base_body, base_version, member('Ada', notes='y', slack_status={'away': True}))
+    with contextlib.redirect_stdout(io.StringIO()):
+        storage._write_merged(KEY, base_body, base_version, member('Ada', notes='x'))
+
+    assert stored(KEY) == member('Ada', notes='y')
+
+
+def test_gives_up_after_max_write_attempts(backend, monkeypatch):
+    attempts = []
+
+    def always_conflicts(key, body, expected_version=storage.ANY_VERSION):
+        attempts.append(key)
+        raise storage.WriteConflict(key)
+    monkeypatch.setattr(backend, 'write', always_conflicts)
+
+    with contextlib.redirect_stdout(io.StringIO()), pytest.raises(storage.WriteConflict):
+        storage._write_merged(KEY, None, None, member('Ada'))
+    assert len(attempts) == MAX_WRITE_ATTEMPTS
+
+
+@pytest.mark.parametrize('complete', [True, False])
+def test_save_users_deletes_missing_members_only_when_complete(complete):
+    storage.save_users({'U1': member('Ada'), 'U2': member('Grace'), 'U3': member('Alan')})
+    # A later invocation, with nothing cached
+    storage.set_backend(storage.get_backend())
+
+    user_data = storage.load_users()
+    del user_data['U2']
+    user_data['U3']['weekly_interest'] = 'noResponse'
+    storage.save_users(user_data, complete=complete)
+
+    assert (stored('users/U2.json') is None) == complete
+    assert ('U2' not in stored(ROSTER_KEY)) == complete
+    assert stored(ROSTER_KEY)['U3']['weekly_interest'] == 'noResponse'
+    assert stored('users/U3.json')['weekly_interest'] == 'noResponse'
+    assert set(storage.load_users()) == ({'U1', 'U3'} if complete else {'U1', 'U2', 'U3'})
+
+
+def test_sync_roster_entry_copies_a_record_changed_elsewhere(backend):
+    storage.save_users({'U1': member('Ada'), 'U2': member('Grace')})
+    # The acknowledger's fast path only writes the record
+    record = stored(KEY)
+    record['weekly_interest'] = 'paused'
+    backend.write(KEY, storage._encode(record))
+
+    storage.sync_roster_entry('U1')
+    assert stored(ROSTER_KEY)['U1']['weekly_interest'] == 'paused'
+    assert stored(ROSTER_KEY)['U2']['weekly_interest'] == 'confirmed'